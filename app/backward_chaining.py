@@ -0,0 +1,297 @@
+"""
+Encadeamento para trás (resolução SLD) com tabelamento.
+Prova um objetivo a partir das regras da KB, sem materializar o fecho
+inteiro. Cada subobjetivo (a menos de renomeação de variáveis) tem uma
+tabela de respostas, o que garante terminação em regras recursivas e
+responde a subobjetivos repetidos sem os voltar a provar.
+As ligações do corpo de uma regra vivem num único trilho (Trail): cada
+antecedente liga variáveis e o retrocesso desfaz-las, sem copiar
+dicionários a cada passo.
+"""
+from typing import Dict, List, Optional, Tuple
+from app.unification import parse_predicate, is_pattern_variable, is_open_pattern, Trail
+from app.fact_index import FactIndex, kb_fact_index
+from app.join_plan import CompiledRule, format_atom, match_atom, parse_rule, bind_term
+from app.terms import parse_term
+
+
+class Table:
+    """Tabela de respostas de um subobjetivo."""
+    
+    def __init__(self):
+        self.answers: Dict[str, Tuple[str, ...]] = {}
+        self.complete = False
+
+
+class TabledProver:
+    """Provador por encadeamento para trás com tabelas de subobjetivos."""
+    
+    def __init__(self, kb):
+        """
+        Inicializa o provador sobre uma KB.
+        
+        Args:
+            kb: Instância de KnowledgeBase
+        """
+        self.kb = kb
+        self._reset()
+        kb.add_listener(self._on_kb_change)
+    
+    def close(self):
+        """Descarta o provador: deixa de acompanhar as alterações da KB."""
+        self.kb.remove_listener(self._on_kb_change)
+    
+    def _reset(self):
+        """Reconstrói os índices a partir da KB e esquece as tabelas."""
+        self.facts = kb_fact_index(self.kb)
+        self.rules: List[CompiledRule] = []
+        for rule in self.kb.get_rules():
+            self._add_rule(rule)
+        self._clear_tables()
+    
+    def _clear_tables(self):
+        self.tables: Dict[tuple, Table] = {}
+        self.proofs: Dict[str, Tuple[CompiledRule, Dict[str, str], List[str]]] = {}
+        self._stack: List[tuple] = []
+        self._low = None
+        self._answers_added = 0
+        # Tabelas incompletas à espera que o líder da sua componente termine
+        self._pending: List[Tuple[Table, int]] = []
+    
+    def _add_rule(self, rule: str):
+        consequent, antecedents = parse_rule(rule)
+        if consequent and antecedents:
+            compiled = CompiledRule(rule, consequent, antecedents)
+            if compiled.valid:
+                self.rules.append(compiled)
+    
+    def _on_kb_change(self, event: str, item):
+        """As tabelas deixam de ser válidas quando a KB muda."""
+        if event == 'add_fact':
+            self.facts.add(item)
+        elif event == 'add_rule':
+            self._add_rule(item)
+        elif event == 'clear':
+            self._reset()
+            return
+        else:
+            # Inferências registadas não mudam os fatos base nem as regras
+            return
+        self._clear_tables()
+    
+    def solve(self, goal: str) -> List[str]:
+        """
+        Retorna todos os fatos que provam um objetivo.
+        
+        Args:
+            goal: Objetivo, ex: mortal(Socrates) ou mortal(X)
+        
+        Returns:
+            Lista de fatos fechados que unificam com o objetivo
+        """
+        return list(self.solve_arguments(goal))
+    
+    def solve_arguments(self, goal: str) -> Dict[str, Tuple[str, ...]]:
+        """
+        Como solve, com os argumentos já separados de cada fato.
+        
+        Args:
+            goal: Objetivo, ex: mortal(Socrates) ou mortal(X)
+        
+        Returns:
+            Dicionário fato -> argumentos, pela ordem das respostas
+        """
+        name, args = parse_predicate(goal)
+        if name is None:
+            return {}
+        return dict(self._solve(name, tuple(args)))
+    
+    def proof(self, fact: str) -> Optional[Tuple[CompiledRule, Dict[str, str], List[str]]]:
+        """
+        Retorna a primeira derivação encontrada para um fato provado.
+        
+        Args:
+            fact: Fato provado por solve
+        
+        Returns:
+            Tupla (regra, ligações, fatos usados) ou None se for um fato base
+        """
+        return self.proofs.get(fact)
+    
+    def is_base_fact(self, fact: str) -> bool:
+        """Verifica se um fato pertence à KB."""
+        return fact in self.facts
+    
+    def _variant_key(self, name: str, args: Tuple[str, ...]) -> tuple:
+        """Chave do subobjetivo a menos de renomeação de variáveis."""
+        seen: Dict[str, int] = {}
+        key = []
+        for arg in args:
+            if is_pattern_variable(arg):
+                key.append((seen.setdefault(arg, len(seen)),))
+            else:
+                key.append(arg)
+        return (name, tuple(key))
+    
+    def _solve(self, name: str, args: Tuple[str, ...]) -> Dict[str, Tuple[str, ...]]:
+        """
+        Resolve um subobjetivo com tabelamento.
+        Um subobjetivo que consome respostas de um antecessor ainda em
+        avaliação (recursão) não fica completo: o antecessor (líder da
+        componente) volta a avaliá-lo até não surgirem respostas novas.
+        """
+        key = self._variant_key(name, args)
+        table = self.tables.get(key)
+        
+        if table is not None and table.complete:
+            return table.answers
+        
+        if key in self._stack:
+            # Chamada recursiva: usar as respostas que já existem
+            depth = self._stack.index(key)
+            self._low = depth if self._low is None else min(self._low, depth)
+            return table.answers
+        
+        if table is None:
+            table = Table()
+            self.tables[key] = table
+        
+        depth = len(self._stack)
+        self._stack.append(key)
+        outer_low = self._low
+        
+        try:
+            while True:
+                before = self._answers_added
+                self._low = None
+                self._evaluate(name, args, table)
+                low = self._low
+                
+                if low is not None and low < depth:
+                    # Depende de um antecessor: será reavaliado por ele
+                    self._pending.append((table, low))
+                    self._low = low if outer_low is None else min(outer_low, low)
+                    return table.answers
+                
+                if self._answers_added == before:
+                    break
+            
+            # Líder: a componente inteira chegou ao ponto fixo
+            table.complete = True
+            while self._pending and self._pending[-1][1] >= depth:
+                self._pending.pop()[0].complete = True
+            self._low = outer_low
+            return table.answers
+        finally:
+            self._stack.pop()
+    
+    def _evaluate(self, name: str, args: Tuple[str, ...], table: Table):
+        """Uma passagem: fatos base e cada regra cuja cabeça unifica com o objetivo."""
+        goal_atom = (name, args, tuple(a for a in args if is_pattern_variable(a)))
+        
+        for fact in self.facts.candidates_for(name, args):
+            fact_args = self.facts.arguments(fact)
+            if match_atom(goal_atom, fact_args) is not None:
+                self._add_answer(table, fact, fact_args, None)
+        
+        for rule in self.rules:
+            head_name, head_args, _ = rule.head
+            if head_name != name or len(head_args) != len(args):
+                continue
+            
+            # Ligar as variáveis da cabeça às constantes do objetivo; argumentos
+            # compostos com variáveis ficam por filtrar no fim (match_atom)
+            trail = Trail()
+            unifies = True
+            for head_arg, goal_arg in zip(head_args, args):
+                if is_open_pattern(goal_arg):
+                    continue
+                if is_pattern_variable(head_arg):
+                    bound = trail.bindings.get(head_arg)
+                    if bound is None:
+                        trail.bind(head_arg, goal_arg)
+                    elif bound != goal_arg:
+                        unifies = False
+                        break
+                elif head_arg != goal_arg and not is_open_pattern(head_arg):
+                    unifies = False
+                    break
+            if not unifies:
+                continue
+            
+            for solution, used in self._solve_body(rule, 0, trail, []):
+                fact_args = self._head_args(head_args, solution)
+                if fact_args is None or match_atom(goal_atom, fact_args) is None:
+                    continue
+                fact = format_atom(head_name, fact_args)
+                self._add_answer(table, fact, fact_args, (rule, solution, used))
+    
+    @staticmethod
+    def _bind_arg(arg: str, bindings: Dict[str, str]) -> str:
+        """Aplica as ligações a um argumento, deixando as variáveis livres."""
+        if is_pattern_variable(arg):
+            return bindings.get(arg, arg)
+        if '(' in arg:
+            return str(bind_term(parse_term(arg), bindings))
+        return arg
+    
+    def _head_args(self, head_args: Tuple[str, ...],
+                   bindings: Dict[str, str]) -> Optional[Tuple[str, ...]]:
+        """Instancia a cabeça; None se ficar alguma variável livre."""
+        values = []
+        for arg in head_args:
+            if is_pattern_variable(arg):
+                if arg not in bindings:
+                    return None
+                values.append(bindings[arg])
+            else:
+                value = self._bind_arg(arg, bindings)
+                if is_open_pattern(value):
+                    return None
+                values.append(value)
+        return tuple(values)
+    
+    def _solve_body(self, rule: CompiledRule, position: int,
+                    trail: Trail, used: List[str]):
+        """
+        Resolve os antecedentes da esquerda para a direita (SLD).
+        As soluções partilham o trilho e a lista de fatos usados: quem as
+        quiser guardar tem de as copiar antes de continuar a iteração.
+        """
+        if position == len(rule.body):
+            yield trail.bindings, used
+            return
+        
+        atom = rule.body[position]
+        name, atom_args, _ = atom
+        bindings = trail.bindings
+        goal_args = tuple(self._bind_arg(arg, bindings) for arg in atom_args)
+        
+        for fact, fact_args in list(self._solve(name, goal_args).items()):
+            local = match_atom(atom, fact_args)
+            if local is None:
+                continue
+            mark = trail.mark()
+            consistent = True
+            for var, value in local.items():
+                bound = bindings.get(var)
+                if bound is None:
+                    trail.bind(var, value)
+                elif bound != value:
+                    consistent = False
+                    break
+            if consistent:
+                used.append(fact)
+                yield from self._solve_body(rule, position + 1, trail, used)
+                used.pop()
+            trail.undo(mark)
+    
+    def _add_answer(self, table: Table, fact: str, fact_args: Tuple[str, ...], proof):
+        if fact in table.answers:
+            return
+        table.answers[fact] = fact_args
+        self._answers_added += 1
+        if proof is not None and fact not in self.proofs and fact not in self.facts:
+            rule, bindings, used = proof
+            self.proofs[fact] = (rule, dict(bindings), list(used))
+
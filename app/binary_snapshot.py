@@ -0,0 +1,436 @@
+"""
+Snapshot binário da base de conhecimento, lido com mmap.
+O ficheiro tem um dicionário de símbolos (todas as strings), uma tabela
+de fatos com inteiros de largura fixa (texto, predicado, aridade e
+argumentos como ids de símbolos), uma tabela de hash para a pertença de
+fatos e um índice por predicado já construído. Abrir o ficheiro não lê
+nada para memória: as strings só são criadas quando um item é acedido.
+Os inteiros usam a ordem de bytes da máquina que escreveu o ficheiro.
+"""
+import json
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from app.symbols import parse_fact
+
+
+MAGIC = b'KBIN'
+VERSION = 1
+# Marca para detetar ficheiros escritos com outra ordem de bytes
+BYTE_ORDER_MARK = 0x01020304
+
+# Secções, pela ordem em que aparecem no ficheiro
+SECTIONS = ('symbol_offsets', 'symbol_data', 'facts', 'fact_args', 'fact_hash',
+            'predicates', 'predicate_facts', 'rules', 'inference_offsets', 'inference_data')
+
+_HEADER = struct.Struct('=4sIIQ' + 'QQ' * len(SECTIONS))
+
+# Colunas de cada linha da tabela de fatos e do índice de predicados
+FACT_COLUMNS = 4       # texto, predicado, aridade, início dos argumentos
+PREDICATE_COLUMNS = 4  # predicado, aridade, início, quantidade
+
+
+def _hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _string_table(strings: List[str]) -> Tuple[bytes, bytes]:
+    """Codifica strings como deslocamentos (u32) e dados UTF-8."""
+    offsets = array('I', [0])
+    chunks = []
+    position = 0
+    for text in strings:
+        chunk = text.encode('utf-8')
+        chunks.append(chunk)
+        position += len(chunk)
+        offsets.append(position)
+    return offsets.tobytes(), b''.join(chunks)
+
+
+def write_snapshot(path: str, data: Dict, seq: int = 0):
+    """
+    Escreve um snapshot binário.
+    
+    Args:
+        path: Caminho do ficheiro
+        data: Dicionário com 'facts', 'rules' e 'inferences'
+        seq: Número de sequência do último registo incluído (ver LogStorage)
+    """
+    symbols: Dict[str, int] = {}
+    
+    def intern(text: str) -> int:
+        symbol_id = symbols.get(text)
+        if symbol_id is None:
+            symbol_id = symbols[text] = len(symbols)
+        return symbol_id
+    
+    facts = list(data['facts'])
+    fact_rows = array('I')
+    fact_args = array('I')
+    by_predicate: Dict[Tuple[int, int], List[int]] = {}
+    for fact_id, fact in enumerate(facts):
+        name, args = parse_fact(fact)
+        predicate = intern(name if name is not None else '')
+        fact_rows.extend((intern(fact), predicate, len(args), len(fact_args)))
+        fact_args.extend(intern(arg) for arg in args)
+        by_predicate.setdefault((predicate, len(args)), []).append(fact_id)
+    
+    # Tabela de hash com endereçamento aberto: posição -> id do fato + 1
+    size = 1
+    while size < 2 * len(facts):
+        size *= 2
+    fact_hash = array('I', bytes(4 * size))
+    for fact_id, fact in enumerate(facts):
+        slot = _hash(fact) & (size - 1)
+        while fact_hash[slot]:
+            slot = (slot + 1) & (size - 1)
+        fact_hash[slot] = fact_id + 1
+    
+    predicates = array('I')
+    predicate_facts = array('I')
+    for (predicate, arity), fact_ids in by_predicate.items():
+        predicates.extend((predicate, arity, len(predicate_facts), len(fact_ids)))
+        predicate_facts.extend(fact_ids)
+    
+    rules = array('I', (intern(rule) for rule in data['rules']))
+    inference_offsets, inference_data = _string_table(
+        [json.dumps(inference, ensure_ascii=False) for inference in data['inferences']]
+    )
+    symbol_offsets, symbol_data = _string_table(list(symbols))
+    
+    blocks = {
+        'symbol_offsets': symbol_offsets,
+        'symbol_data': symbol_data,
+        'facts': fact_rows.tobytes(),
+        'fact_args': fact_args.tobytes(),
+        'fact_hash': fact_hash.tobytes(),
+        'predicates': predicates.tobytes(),
+        'predicate_facts': predicate_facts.tobytes(),
+        'rules': rules.tobytes(),
+        'inference_offsets': inference_offsets,
+        'inference_data': inference_data,
+    }
+    
+    # Secções alinhadas a 8 bytes depois do cabeçalho
+    layout = []
+    position = _HEADER.size
+    for name in SECTIONS:
+        position += -position % 8
+        layout.extend((position, len(blocks[name])))
+        position += len(blocks[name])
+    
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, BYTE_ORDER_MARK, seq, *layout))
+        for index, name in enumerate(SECTIONS):
+            f.write(bytes(layout[2 * index] - f.tell()))
+            f.write(blocks[name])
+        f.flush()
+
+
+class MappedColumn:
+    """
+    Lista só de acréscimo cujos primeiros itens vêm do snapshot mapeado.
+    Os itens acrescentados depois de abrir o ficheiro ficam em memória.
+    Tem a interface usada pela KB (append, pertença, iteração, copy) e
+    get(item) para a posição de um item, usada por app.storage.SnapshotView.
+    """
+    
+    def __init__(self, count: int, item: Callable[[int], object],
+                 find: Optional[Callable[[object], Optional[int]]] = None):
+        """
+        Args:
+            count: Número de itens no snapshot
+            item: Função que materializa o item de uma posição
+            find: Função que procura a posição de um item no snapshot (opcional)
+        """
+        self._count = count
+        self._item = item
+        self._find = find
+        self._extra: list = []
+        self._extra_index: Dict[object, int] = {}
+    
+    @property
+    def indexed(self) -> bool:
+        """True se get não precisar de percorrer a coluna."""
+        return self._find is not None
+    
+    def __len__(self) -> int:
+        return self._count + len(self._extra)
+    
+    def __getitem__(self, position: int):
+        if position < self._count:
+            return self._item(position)
+        return self._extra[position - self._count]
+    
+    def __iter__(self) -> Iterator:
+        for position in range(self._count):
+            yield self._item(position)
+        yield from self._extra
+    
+    def get(self, item, default=None) -> Optional[int]:
+        """Posição de um item (ou default se não existir)."""
+        if self._find is None:
+            for position, existing in enumerate(self):
+                if existing == item:
+                    return position
+            return default
+        position = self._find(item)
+        if position is not None:
+            return position
+        position = self._extra_index.get(item)
+        return default if position is None else self._count + position
+    
+    def __contains__(self, item) -> bool:
+        return self.get(item) is not None
+    
+    def append(self, item) -> bool:
+        """
+        Acrescenta um item (sem repetições, se a coluna tiver procura).
+        
+        Returns:
+            True se o item foi acrescentado
+        """
+        if self._find is not None:
+            if item in self:
+                return False
+            self._extra_index[item] = len(self._extra)
+        self._extra.append(item)
+        return True
+    
+    def copy(self) -> list:
+        """Cópia dos itens em lista."""
+        return list(self)
+    
+    def remap(self, column: 'MappedColumn'):
+        """
+        Passa a ler os itens de outro snapshot (ex: depois de uma
+        compactação). O snapshot novo tem os primeiros itens desta coluna
+        pela mesma ordem; só os acrescentados depois de ser escrito
+        continuam em memória. As vistas já criadas continuam válidas.
+        
+        Args:
+            column: Coluna correspondente do snapshot novo
+        """
+        extra = self._extra[column._count - self._count:]
+        self._count, self._item, self._find = column._count, column._item, column._find
+        self._extra = extra
+        self._extra_index = ({item: position for position, item in enumerate(extra)}
+                             if self._find is not None else {})
+
+
+class MappedFacts(MappedColumn):
+    """
+    Coluna de fatos de um snapshot. Serve de fonte por predicado para
+    FactIndex: os fatos de um predicado vêm do índice de predicados do
+    snapshot e os argumentos da tabela de argumentos, sem parse do texto.
+    """
+    
+    # Fonte de FactIndex por predicado (ver app.fact_index.kb_fact_index)
+    lazy = True
+    
+    def __init__(self, snapshot: 'MappedSnapshot'):
+        super().__init__(snapshot.fact_count, snapshot.fact, snapshot.find_fact)
+        self._snapshot = snapshot
+        # Fatos acrescentados depois de abrir o snapshot, por predicado
+        self._extra_by_name: Dict[Optional[str], List[str]] = {}
+    
+    def append(self, fact: str) -> bool:
+        if not super().append(fact):
+            return False
+        self._extra_by_name.setdefault(parse_fact(fact)[0], []).append(fact)
+        return True
+    
+    def remap(self, column: 'MappedFacts'):
+        super().remap(column)
+        self._snapshot = column._snapshot
+        self._extra_by_name = {}
+        for fact in self._extra:
+            self._extra_by_name.setdefault(parse_fact(fact)[0], []).append(fact)
+    
+    def predicates(self) -> List[Optional[str]]:
+        """Predicados do snapshot e dos fatos acrescentados."""
+        names = dict.fromkeys(self._snapshot.predicate_names())
+        names.update(dict.fromkeys(self._extra_by_name))
+        return list(names)
+    
+    def parsed_facts_for(self, name: Optional[str]) -> Iterator[Tuple]:
+        """
+        Fatos de um predicado com o parse feito.
+        
+        Yields:
+            Tuplos (fato, predicado, argumentos)
+        """
+        yield from self._snapshot.parsed_facts(name)
+        for fact in list(self._extra_by_name.get(name, ())):
+            yield (fact,) + parse_fact(fact)
+
+
+class MappedSnapshot:
+    """Snapshot binário aberto com mmap."""
+    
+    def __init__(self, path: str):
+        """
+        Abre um snapshot.
+        
+        Args:
+            path: Caminho do ficheiro
+        
+        Raises:
+            ValueError: Se o ficheiro não for um snapshot compatível
+        """
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        header = _HEADER.unpack_from(self._mmap, 0)
+        magic, version, mark, self.seq = header[:4]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} não é um snapshot binário da KB")
+        if mark != BYTE_ORDER_MARK:
+            raise ValueError(f"{path} foi escrito com outra ordem de bytes ({sys.byteorder} aqui)")
+        
+        buffer = memoryview(self._mmap)
+        sections = {}
+        for index, name in enumerate(SECTIONS):
+            offset, length = header[4 + 2 * index], header[5 + 2 * index]
+            sections[name] = buffer[offset:offset + length]
+        
+        self._symbol_offsets = sections['symbol_offsets'].cast('I')
+        self._symbol_data = sections['symbol_data']
+        self._facts = sections['facts'].cast('I')
+        self._fact_args = sections['fact_args'].cast('I')
+        self._fact_hash = sections['fact_hash'].cast('I')
+        self._predicates = sections['predicates'].cast('I')
+        self._predicate_facts = sections['predicate_facts'].cast('I')
+        self._rules = sections['rules'].cast('I')
+        self._inference_offsets = sections['inference_offsets'].cast('I')
+        self._inference_data = sections['inference_data']
+        
+        self.fact_count = len(self._facts) // FACT_COLUMNS
+        self.rule_count = len(self._rules)
+        self.inference_count = len(self._inference_offsets) - 1
+        self._rule_index: Optional[Dict[str, int]] = None
+        # Símbolos já materializados (os argumentos repetem-se muito)
+        self._symbols: Dict[int, str] = {}
+    
+    def close(self):
+        """
+        Fecha o mapeamento (os itens deixam de poder ser lidos). Se ainda
+        houver vistas do ficheiro em uso (ex: um gerador por acabar), o
+        mapeamento só é fechado quando forem libertadas.
+        """
+        for view in (self._symbol_offsets, self._symbol_data, self._facts, self._fact_args,
+                     self._fact_hash, self._predicates, self._predicate_facts, self._rules,
+                     self._inference_offsets, self._inference_data):
+            view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+    
+    def symbol(self, symbol_id: int) -> str:
+        """Materializa um símbolo."""
+        text = self._symbols.get(symbol_id)
+        if text is None:
+            offsets = self._symbol_offsets
+            text = str(self._symbol_data[offsets[symbol_id]:offsets[symbol_id + 1]], 'utf-8')
+            self._symbols[symbol_id] = text
+        return text
+    
+    def fact(self, fact_id: int) -> str:
+        """Texto de um fato."""
+        return self.symbol(self._facts[fact_id * FACT_COLUMNS])
+    
+    def fact_arguments(self, fact_id: int) -> Tuple[str, Tuple[str, ...]]:
+        """Predicado e argumentos de um fato, sem fazer parse do texto."""
+        row = fact_id * FACT_COLUMNS
+        _, predicate, arity, start = self._facts[row:row + FACT_COLUMNS]
+        return self.symbol(predicate), tuple(self.symbol(i) for i in self._fact_args[start:start + arity])
+    
+    def find_fact(self, fact: str) -> Optional[int]:
+        """Posição de um fato pela tabela de hash (ou None)."""
+        table = self._fact_hash
+        if not len(table):
+            return None
+        mask = len(table) - 1
+        slot = _hash(fact) & mask
+        while table[slot]:
+            fact_id = table[slot] - 1
+            if self.fact(fact_id) == fact:
+                return fact_id
+            slot = (slot + 1) & mask
+        return None
+    
+    def facts_for(self, name: str, arity: int) -> Iterator[str]:
+        """
+        Fatos de um predicado, pelo índice já construído.
+        
+        Args:
+            name: Nome do predicado
+            arity: Aridade
+        
+        Yields:
+            Fatos pela ordem do snapshot
+        """
+        rows = self._predicates
+        for row in range(0, len(rows), PREDICATE_COLUMNS):
+            predicate, predicate_arity, start, count = rows[row:row + PREDICATE_COLUMNS]
+            if predicate_arity == arity and self.symbol(predicate) == name:
+                for fact_id in self._predicate_facts[start:start + count]:
+                    yield self.fact(fact_id)
+                return
+    
+    def predicate_names(self) -> List[Optional[str]]:
+        """Nomes dos predicados do índice (None para os fatos sem predicado)."""
+        rows = self._predicates
+        names = (self.symbol(rows[row]) or None for row in range(0, len(rows), PREDICATE_COLUMNS))
+        return list(dict.fromkeys(names))
+    
+    def parsed_facts(self, name: Optional[str]) -> Iterator[Tuple]:
+        """
+        Fatos de um predicado (com qualquer aridade), pelo índice já construído.
+        
+        Args:
+            name: Nome do predicado (None para os fatos sem predicado)
+        
+        Yields:
+            Tuplos (fato, predicado, argumentos), sem parse do texto
+        """
+        rows = self._predicates
+        for row in range(0, len(rows), PREDICATE_COLUMNS):
+            predicate, _, start, count = rows[row:row + PREDICATE_COLUMNS]
+            if (self.symbol(predicate) or None) != name:
+                continue
+            for fact_id in self._predicate_facts[start:start + count]:
+                _, args = self.fact_arguments(fact_id)
+                yield self.fact(fact_id), name, args if name is not None else ()
+    
+    def rule(self, rule_id: int) -> str:
+        """Texto de uma regra."""
+        return self.symbol(self._rules[rule_id])
+    
+    def find_rule(self, rule: str) -> Optional[int]:
+        """Posição de uma regra (o índice é criado no primeiro uso; as regras são poucas)."""
+        if self._rule_index is None:
+            self._rule_index = {self.rule(i): i for i in range(self.rule_count)}
+        return self._rule_index.get(rule)
+    
+    def inference(self, inference_id: int) -> Dict:
+        """Materializa uma inferência."""
+        offsets = self._inference_offsets
+        return json.loads(str(self._inference_data[offsets[inference_id]:offsets[inference_id + 1]], 'utf-8'))
+    
+    def columns(self) -> Dict:
+        """
+        Contentores da KB sobre o snapshot.
+        
+        Returns:
+            Dicionário com 'facts', 'rules' e 'inferences' (MappedColumn)
+        """
+        return {
+            'facts': MappedFacts(self),
+            'rules': MappedColumn(self.rule_count, self.rule, self.find_rule),
+            'inferences': MappedColumn(self.inference_count, self.inference)
+        }
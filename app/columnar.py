@@ -0,0 +1,403 @@
+"""
+Backend colunar (NumPy) para o encadeamento para frente.
+Cada predicado é guardado como uma matriz de inteiros (uma coluna por
+argumento, com os ids da tabela de símbolos da KB, e uma com o
+identificador do fato) e o corpo das regras é avaliado por junções
+vetorizadas (ordenação + searchsorted), sem fazer parse de strings por fato. A diferença com os fatos já conhecidos é feita
+com np.isin sobre as linhas codificadas.
+
+O NumPy é uma dependência opcional: sem ele, available() devolve False.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.unification import is_pattern_variable, is_open_pattern
+from app.join_plan import CompiledRule
+from app.dependency_graph import PredicateGraph, Predicate, atom_predicate
+from app.symbols import SymbolTable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available() -> bool:
+    """Verifica se o NumPy está instalado."""
+    return np is not None
+
+
+def supports(rule: CompiledRule) -> bool:
+    """
+    Verifica se uma regra pode ser avaliada em colunas: cada argumento tem
+    de ser uma variável ou um símbolo (sem termos compostos com variáveis).
+    
+    Args:
+        rule: Regra compilada
+    
+    Returns:
+        True se a regra só tiver argumentos simples
+    """
+    atoms = [rule.head] + list(rule.body) if rule.valid else []
+    return not any(is_open_pattern(arg) and not is_pattern_variable(arg)
+                   for _, args, _ in atoms for arg in args)
+
+
+def _row_keys(*blocks):
+    """
+    Codifica as linhas de várias matrizes com as mesmas colunas num inteiro
+    por linha: linhas iguais (em qualquer matriz) recebem o mesmo inteiro.
+    
+    Args:
+        blocks: Matrizes de inteiros (n, k)
+    
+    Returns:
+        Lista com um vetor de chaves por matriz
+    """
+    sizes = [len(block) for block in blocks]
+    stacked = np.vstack(blocks)
+    
+    if stacked.shape[1] == 0 or len(stacked) == 0:
+        keys = np.zeros(len(stacked), dtype=np.int64)
+    elif stacked.shape[1] == 1:
+        keys = stacked[:, 0]
+    else:
+        _, keys = np.unique(stacked, axis=0, return_inverse=True)
+        keys = keys.reshape(-1)
+    
+    return np.split(keys, np.cumsum(sizes)[:-1])
+
+
+class ColumnarStore:
+    """Fatos codificados em inteiros, uma matriz por predicado."""
+    
+    def __init__(self, symbols: Optional[SymbolTable] = None):
+        """
+        Args:
+            symbols: Tabela de símbolos dos códigos (ex: KnowledgeBase.symbols;
+                se não especificada usa uma nova)
+        """
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.facts: List[str] = []
+        self.fact_ids: Dict[str, int] = {}
+        self.relations: Dict[Predicate, 'np.ndarray'] = {}
+        self._variable_mask = np.zeros(0, dtype=bool)
+    
+    def encode(self, value: str) -> int:
+        """Retorna o id de um símbolo na tabela de símbolos."""
+        return self.symbols.intern(value)
+    
+    def lookup(self, value: str) -> Optional[int]:
+        """Retorna o id de um símbolo já conhecido (ou None)."""
+        return self.symbols.lookup(value)
+    
+    def variable_mask(self) -> 'np.ndarray':
+        """Vetor que indica, por id de símbolo, se ele tem a forma de uma variável."""
+        known = len(self._variable_mask)
+        symbols = self.symbols
+        if known < len(symbols):
+            added = [is_pattern_variable(symbols.symbol(i)) for i in range(known, len(symbols))]
+            self._variable_mask = np.concatenate([self._variable_mask, np.array(added, dtype=bool)])
+        return self._variable_mask
+    
+    def relation(self, key: Predicate) -> 'np.ndarray':
+        """
+        Retorna a matriz de um predicado.
+        
+        Args:
+            key: Par (nome, aridade)
+        
+        Returns:
+            Matriz (n, aridade + 1); a última coluna é o identificador do fato
+        """
+        rows = self.relations.get(key)
+        if rows is None:
+            return np.zeros((0, key[1] + 1), dtype=np.int64)
+        return rows
+    
+    def add_facts(self, facts: Iterable[str]):
+        """
+        Codifica e adiciona fatos em string.
+        
+        Args:
+            facts: Fatos no formato predicado(arg1, ...)
+        """
+        pending: Dict[Predicate, List[List[int]]] = {}
+        for fact in facts:
+            if fact in self.fact_ids:
+                continue
+            key = self.symbols.encode(fact)
+            if key is None:
+                continue
+            row = list(key[1:])
+            row.append(self._register(fact))
+            pending.setdefault((self.symbols.symbol(key[0]), len(row) - 1), []).append(row)
+        
+        for key, rows in pending.items():
+            self._append(key, np.array(rows, dtype=np.int64).reshape(len(rows), key[1] + 1))
+    
+    def add_rows(self, key: Predicate, rows: 'np.ndarray') -> List[str]:
+        """
+        Adiciona linhas derivadas (sem identificador) a um predicado.
+        
+        Args:
+            key: Par (nome, aridade)
+            rows: Matriz (n, aridade) de códigos
+        
+        Returns:
+            Fatos em string correspondentes às linhas, pela mesma ordem
+        """
+        name = self.symbols.intern(key[0])
+        facts = [self.symbols.decode((name,) + tuple(row)) for row in rows.tolist()]
+        ids = np.array([self._register(fact) for fact in facts], dtype=np.int64)
+        self._append(key, np.column_stack([rows, ids]))
+        return facts
+    
+    def _register(self, fact: str) -> int:
+        fact_id = self.fact_ids.get(fact)
+        if fact_id is None:
+            fact_id = len(self.facts)
+            self.fact_ids[fact] = fact_id
+            self.facts.append(fact)
+        return fact_id
+    
+    def _append(self, key: Predicate, rows: 'np.ndarray'):
+        self.relations[key] = np.vstack([self.relation(key), rows])
+
+
+# Uma tabela intermédia: (variáveis, valores (n, k), fatos usados (n, m), posições no corpo)
+Table = Tuple[List[str], 'np.ndarray', 'np.ndarray', List[int]]
+
+
+class ColumnarEvaluator:
+    """Avaliação semi-ingénua estratificada sobre um ColumnarStore."""
+    
+    def __init__(self, store: ColumnarStore):
+        """
+        Args:
+            store: Fatos codificados (é atualizado com os fatos derivados)
+        """
+        self.store = store
+    
+    def saturate(self, rules: List[CompiledRule],
+                 record: Optional[Callable[[CompiledRule, str, Dict[str, str], List[str]], None]] = None) -> List[str]:
+        """
+        Aplica as regras até ao ponto fixo. Como no modo semi-ingénuo, os
+        estratos são avaliados por ordem topológica e os resultados de uma
+        ronda só ficam visíveis na ronda seguinte.
+        
+        Args:
+            rules: Regras compiladas
+            record: Chamada para cada fato novo com (regra, fato, ligações,
+                fatos usados); se None, não se calculam justificações
+        
+        Returns:
+            Lista dos fatos derivados, pela ordem em que foram obtidos
+        """
+        derived = []
+        
+        for stratum in PredicateGraph(rules).strata():
+            # Na primeira ronda o estrato é avaliado contra todos os fatos
+            bounds: Optional[Dict[Predicate, Tuple[int, int]]] = None
+            
+            while True:
+                results = []
+                for rule in stratum.rules:
+                    for table in self._evaluate(rule, bounds):
+                        results.append((rule, table))
+                
+                sizes = {key: len(rows) for key, rows in self.store.relations.items()}
+                new = self._merge(results, record)
+                derived.extend(new)
+                
+                if not stratum.recursive or not new:
+                    break
+                bounds = {
+                    key: (sizes.get(key, 0), len(rows))
+                    for key, rows in self.store.relations.items()
+                    if len(rows) > sizes.get(key, 0)
+                }
+        
+        return derived
+    
+    def _evaluate(self, rule: CompiledRule,
+                  bounds: Optional[Dict[Predicate, Tuple[int, int]]]) -> List[Table]:
+        """Soluções do corpo da regra (todas, ou só as que usam o delta)."""
+        keys = [atom_predicate(atom) for atom in rule.body]
+        relations = [self.store.relation(key) for key in keys]
+        
+        if bounds is None:
+            solution = self._solve(rule, relations, None)
+            return [] if solution is None else [solution]
+        
+        solutions = []
+        for delta_pos, key in enumerate(keys):
+            if key not in bounds:
+                continue
+            start, end = bounds[key]
+            sources = []
+            for i, rows in enumerate(relations):
+                if i == delta_pos:
+                    sources.append(rows[start:end])
+                elif i < delta_pos and keys[i] in bounds:
+                    # Átomos anteriores usam só fatos antigos, evitando repetições
+                    sources.append(rows[:bounds[keys[i]][0]])
+                else:
+                    sources.append(rows)
+            solution = self._solve(rule, sources, delta_pos)
+            if solution is not None:
+                solutions.append(solution)
+        return solutions
+    
+    def _solve(self, rule: CompiledRule, sources: List['np.ndarray'],
+               first: Optional[int]) -> Optional[Table]:
+        """Junta os átomos do corpo, começando pelo mais seletivo."""
+        atoms = [self._select(atom, rows, position)
+                 for position, (atom, rows) in enumerate(zip(rule.body, sources))]
+        if any(len(atom[1]) == 0 for atom in atoms):
+            return None
+        
+        remaining = list(range(len(atoms)))
+        if first is None:
+            first = min(remaining, key=lambda i: len(atoms[i][1]))
+        remaining.remove(first)
+        order = [first]
+        bound = set(atoms[first][0])
+        
+        while remaining:
+            best = min(
+                remaining,
+                key=lambda i: (not bound.intersection(atoms[i][0]) and bool(bound), len(atoms[i][1]))
+            )
+            remaining.remove(best)
+            order.append(best)
+            bound.update(atoms[best][0])
+        
+        table: Table = ([], np.zeros((1, 0), dtype=np.int64), np.zeros((1, 0), dtype=np.int64), [])
+        for position in order:
+            table = self._join(table, atoms[position])
+            if len(table[1]) == 0:
+                return None
+        return table
+    
+    def _select(self, atom, rows: 'np.ndarray', position: int) -> Table:
+        """Filtra as linhas de um átomo pelas constantes e variáveis repetidas."""
+        _, args, _ = atom
+        mask = np.ones(len(rows), dtype=bool)
+        columns: Dict[str, int] = {}
+        
+        for column, arg in enumerate(args):
+            if is_pattern_variable(arg):
+                if arg in columns:
+                    mask &= rows[:, column] == rows[:, columns[arg]]
+                else:
+                    columns[arg] = column
+            else:
+                code = self.store.lookup(arg)
+                if code is None:
+                    mask[:] = False
+                    break
+                mask &= rows[:, column] == code
+        
+        rows = rows[mask]
+        return list(columns), rows[:, list(columns.values())], rows[:, -1:], [position]
+    
+    def _join(self, left: Table, right: Table) -> Table:
+        """Junção de igualdade vetorizada pelas variáveis comuns."""
+        left_vars, left_values, left_used, left_positions = left
+        right_vars, right_values, right_used, right_positions = right
+        shared = [v for v in right_vars if v in left_vars]
+        
+        if shared:
+            left_keys, right_keys = _row_keys(
+                left_values[:, [left_vars.index(v) for v in shared]],
+                right_values[:, [right_vars.index(v) for v in shared]]
+            )
+            order = np.argsort(right_keys, kind='stable')
+            sorted_keys = right_keys[order]
+            low = np.searchsorted(sorted_keys, left_keys, side='left')
+            high = np.searchsorted(sorted_keys, left_keys, side='right')
+            counts = high - low
+            left_index = np.repeat(np.arange(len(left_keys)), counts)
+            offsets = np.repeat(low - (np.cumsum(counts) - counts), counts)
+            right_index = order[offsets + np.arange(len(left_index))]
+        else:
+            left_index = np.repeat(np.arange(len(left_values)), len(right_values))
+            right_index = np.tile(np.arange(len(right_values)), len(left_values))
+        
+        extra = [i for i, v in enumerate(right_vars) if v not in left_vars]
+        return (
+            left_vars + [right_vars[i] for i in extra],
+            np.hstack([left_values[left_index], right_values[right_index][:, extra]]),
+            np.hstack([left_used[left_index], right_used[right_index]]),
+            left_positions + right_positions
+        )
+    
+    def _project(self, rule: CompiledRule, table: Table):
+        """
+        Instancia a cabeça da regra para cada solução. Como no modo em
+        string, descarta fatos cujos argumentos têm a forma de variáveis.
+        
+        Returns:
+            Tupla (linhas da cabeça, tabela das soluções aceites) ou None
+        """
+        variables, values, used, positions = table
+        _, args, _ = rule.head
+        columns = []
+        variable_columns = []
+        
+        for arg in args:
+            if is_pattern_variable(arg):
+                if arg not in variables:
+                    return None
+                variable_columns.append(len(columns))
+                columns.append(values[:, variables.index(arg)])
+            else:
+                columns.append(np.full(len(values), self.store.encode(arg), dtype=np.int64))
+        
+        heads = np.column_stack(columns) if columns else np.zeros((len(values), 0), dtype=np.int64)
+        keep = ~self.store.variable_mask()[heads[:, variable_columns]].any(axis=1)
+        # Fatos usados pela ordem dos antecedentes
+        used = used[:, np.argsort(positions)]
+        return heads[keep], (variables, values[keep], used[keep], sorted(positions))
+    
+    def _merge(self, results: List[Tuple[CompiledRule, Table]], record) -> List[str]:
+        """Junta os resultados da ronda, sem repetidos nem fatos já conhecidos."""
+        by_head: Dict[Predicate, List[Tuple[CompiledRule, 'np.ndarray', Table]]] = {}
+        for rule, table in results:
+            projected = self._project(rule, table)
+            if projected is not None and len(projected[0]):
+                by_head.setdefault(atom_predicate(rule.head), []).append((rule,) + projected)
+        
+        derived = []
+        for key, parts in by_head.items():
+            heads = np.vstack([part[1] for part in parts])
+            existing = self.store.relation(key)[:, :-1]
+            new_keys, old_keys = _row_keys(heads, existing)
+            
+            # Primeira ocorrência de cada linha que ainda não é conhecida
+            keep = np.zeros(len(heads), dtype=bool)
+            keep[np.unique(new_keys, return_index=True)[1]] = True
+            keep &= ~np.isin(new_keys, old_keys)
+            selected = np.flatnonzero(keep)
+            if not len(selected):
+                continue
+            
+            facts = self.store.add_rows(key, heads[selected])
+            derived.extend(facts)
+            
+            if record is not None:
+                self._record(parts, selected, facts, record)
+        
+        return derived
+    
+    def _record(self, parts, selected: 'np.ndarray', facts: List[str], record):
+        """Chama record para cada fato novo com a solução que o produziu."""
+        offsets = np.cumsum([0] + [len(part[1]) for part in parts])
+        part_of = np.searchsorted(offsets, selected, side='right') - 1
+        store_facts = self.store.facts
+        symbols = self.store.symbols
+        
+        for fact, row, part_index in zip(facts, selected.tolist(), part_of.tolist()):
+            rule, _, (variables, solutions, used, _) = parts[part_index]
+            local = row - offsets[part_index]
+            bindings = {var: symbols.symbol(code) for var, code in zip(variables, solutions[local].tolist())}
+            record(rule, fact, bindings, [store_facts[i] for i in used[local].tolist()])
@@ -0,0 +1,149 @@
+"""
+Grafo de dependências entre predicados e estratificação das regras.
+As componentes fortemente conexas (SCC) do grafo são avaliadas por ordem
+topológica; só as componentes recursivas precisam de iterar.
+"""
+from typing import Dict, List, Set, Tuple
+from app.join_plan import CompiledRule
+
+
+# Um predicado identificado por (nome, aridade)
+Predicate = Tuple[str, int]
+
+
+def atom_predicate(atom) -> Predicate:
+    """Retorna o par (nome, aridade) de um átomo compilado."""
+    return atom[0], len(atom[1])
+
+
+class Stratum:
+    """Uma componente fortemente conexa do grafo, com as regras que a definem."""
+    
+    def __init__(self, predicates: List[Predicate], rules: List[CompiledRule], recursive: bool):
+        self.predicates = predicates
+        self.rules = rules
+        self.recursive = recursive
+    
+    def to_dict(self) -> Dict:
+        """Retorna o estrato como dicionário (para relatórios)."""
+        return {
+            'predicates': [f"{name}/{arity}" for name, arity in self.predicates],
+            'recursive': self.recursive,
+            'rules': [rule.rule for rule in self.rules]
+        }
+
+
+class PredicateGraph:
+    """Grafo de dependências: aresta de cada predicado do corpo para o da cabeça."""
+    
+    def __init__(self, rules: List[CompiledRule]):
+        """
+        Constrói o grafo a partir de regras compiladas.
+        
+        Args:
+            rules: Regras compiladas (as inválidas são ignoradas)
+        """
+        self.rules = [rule for rule in rules if rule.valid]
+        self.edges: Dict[Predicate, Set[Predicate]] = {}
+        
+        for rule in self.rules:
+            head = atom_predicate(rule.head)
+            self.edges.setdefault(head, set())
+            for atom in rule.body:
+                self.edges.setdefault(atom_predicate(atom), set()).add(head)
+    
+    def strongly_connected_components(self) -> List[List[Predicate]]:
+        """
+        Calcula as SCC pelo algoritmo de Tarjan (versão iterativa).
+        
+        Returns:
+            Lista de componentes por ordem topológica (dependências primeiro)
+        """
+        index: Dict[Predicate, int] = {}
+        lowlink: Dict[Predicate, int] = {}
+        on_stack: Set[Predicate] = set()
+        stack: List[Predicate] = []
+        components: List[List[Predicate]] = []
+        counter = 0
+        
+        for root in sorted(self.edges):
+            if root in index:
+                continue
+            
+            work = [(root, iter(sorted(self.edges[root])))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            
+            while work:
+                node, successors = work[-1]
+                advanced = False
+                
+                for succ in successors:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = counter
+                        counter += 1
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, iter(sorted(self.edges[succ]))))
+                        advanced = True
+                        break
+                    elif succ in on_stack:
+                        lowlink[node] = min(lowlink[node], index[succ])
+                
+                if advanced:
+                    continue
+                
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+        
+        # Tarjan produz as componentes por ordem topológica inversa
+        components.reverse()
+        return components
+    
+    def strata(self) -> List[Stratum]:
+        """
+        Agrupa as regras por componente, por ordem topológica.
+        Componentes sem regras (predicados só de fatos base) são omitidas.
+        
+        Returns:
+            Lista de estratos
+        """
+        rules_by_head: Dict[Predicate, List[CompiledRule]] = {}
+        for rule in self.rules:
+            rules_by_head.setdefault(atom_predicate(rule.head), []).append(rule)
+        
+        strata = []
+        for component in self.strongly_connected_components():
+            rules = [rule for pred in component for rule in rules_by_head.get(pred, [])]
+            if not rules:
+                continue
+            members = set(component)
+            recursive = len(component) > 1 or any(
+                atom_predicate(atom) in members for rule in rules for atom in rule.body
+            )
+            strata.append(Stratum(component, rules, recursive))
+        
+        return strata
+    
+    def describe(self) -> List[Dict]:
+        """
+        Relatório da estrutura de recursão do conjunto de regras.
+        
+        Returns:
+            Lista de estratos como dicionários, por ordem de avaliação
+        """
+        return [stratum.to_dict() for stratum in self.strata()]
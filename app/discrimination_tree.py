@@ -0,0 +1,151 @@
+"""
+Árvore de discriminação sobre fatos.
+Cada fato é guardado num caminho (predicado/aridade, argumento 1,
+argumento 2, ...). Uma consulta percorre só os ramos compatíveis: as
+constantes escolhem um filho e as variáveis funcionam como coringas
+(variáveis repetidas têm de apanhar o mesmo valor). O resultado são
+exatamente os fatos que unificam com o padrão, pela ordem de inserção.
+Um argumento composto com variáveis (ex: filho(X)) só desce pelos ramos
+cujo valor unifica com ele; as variáveis dentro de argumentos compostos
+não são cruzadas entre posições, por isso quem precisa das ligações
+deve emparelhar os fatos devolvidos (ex: com match_atom).
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.unification import is_pattern_variable, parse_predicate, unify_terms
+from app.terms import parse_term
+from app.symbols import parse_fact
+
+
+class Node:
+    """Nó da árvore: filhos por valor do argumento seguinte e fatos (nas folhas)."""
+    
+    __slots__ = ('children', 'facts')
+    
+    def __init__(self):
+        self.children: Dict[str, 'Node'] = {}
+        self.facts: Dict[str, None] = {}
+
+
+class DiscriminationTree:
+    """Índice de fatos por predicado e, depois, por cada argumento."""
+    
+    def __init__(self, facts: Optional[Iterable[str]] = None):
+        """
+        Inicializa a árvore.
+        
+        Args:
+            facts: Fatos iniciais
+        """
+        self._roots: Dict[Tuple[str, int], Node] = {}
+        # Fato -> número de ordem (para devolver pela ordem de inserção)
+        self._order: Dict[str, int] = {}
+        
+        if facts:
+            for fact in facts:
+                self.add(fact)
+    
+    def add(self, fact: str) -> bool:
+        """
+        Adiciona um fato à árvore.
+        
+        Args:
+            fact: Fato no formato predicado(arg1, ...)
+        
+        Returns:
+            True se o fato era novo e válido
+        """
+        if fact in self._order:
+            return False
+        name, args = parse_fact(fact)
+        if name is None:
+            return False
+        
+        self._order[fact] = len(self._order)
+        node = self._roots.get((name, len(args)))
+        if node is None:
+            node = self._roots[(name, len(args))] = Node()
+        for arg in args:
+            child = node.children.get(arg)
+            if child is None:
+                child = node.children[arg] = Node()
+            node = child
+        node.facts[fact] = None
+        return True
+    
+    def retrieve(self, pattern: str) -> List[str]:
+        """
+        Retorna os fatos que unificam com um padrão.
+        
+        Args:
+            pattern: Padrão, ex: humano(X) ou pai(X, Maria)
+        
+        Returns:
+            Lista de fatos pela ordem de inserção
+        """
+        # Padrões de consultas não entram no cache do parse de fatos
+        name, args = parse_predicate(pattern)
+        if name is None:
+            return []
+        return self.retrieve_for(name, args)
+    
+    def retrieve_for(self, name: str, args) -> List[str]:
+        """
+        Como retrieve, mas para um padrão já separado em nome e argumentos.
+        
+        Args:
+            name: Nome do predicado
+            args: Argumentos (variáveis ou constantes)
+        
+        Returns:
+            Lista de fatos pela ordem de inserção
+        """
+        root = self._roots.get((name, len(args)))
+        if root is None:
+            return []
+        
+        variables = [is_pattern_variable(arg) for arg in args]
+        nested = [not variables[i] and '(' in arg and not parse_term(arg).ground
+                  for i, arg in enumerate(args)]
+        # Só é preciso lembrar valores de variáveis que voltam a aparecer
+        repeated = {arg for i, arg in enumerate(args) if variables[i] and arg in args[i + 1:]}
+        
+        found: List[str] = []
+        stack = [(root, 0, {})]
+        while stack:
+            node, depth, bindings = stack.pop()
+            if depth == len(args):
+                found.extend(node.facts)
+                continue
+            
+            arg = args[depth]
+            if nested[depth]:
+                pattern = parse_term(arg)
+                for value, child in node.children.items():
+                    if unify_terms(pattern, parse_term(value)) is not None:
+                        stack.append((child, depth + 1, bindings))
+            elif not variables[depth]:
+                child = node.children.get(arg)
+                if child is not None:
+                    stack.append((child, depth + 1, bindings))
+            elif arg in bindings:
+                child = node.children.get(bindings[arg])
+                if child is not None:
+                    stack.append((child, depth + 1, bindings))
+            elif arg in repeated:
+                for value, child in node.children.items():
+                    stack.append((child, depth + 1, {**bindings, arg: value}))
+            else:
+                for child in node.children.values():
+                    stack.append((child, depth + 1, bindings))
+        
+        found.sort(key=self._order.__getitem__)
+        return found
+    
+    def __contains__(self, fact: str) -> bool:
+        return fact in self._order
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._order)
+    
+    def __len__(self) -> int:
+        return len(self._order)
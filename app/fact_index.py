@@ -0,0 +1,319 @@
+"""
+Índice de fatos por predicado/aridade e por posição de argumento.
+Evita que o unificador seja chamado para fatos de outros predicados.
+Os conjuntos são dicionários (ordem de inserção), para que a ordem de
+avaliação seja a mesma em qualquer processo.
+"""
+from itertools import chain
+from typing import Dict, Iterable, Iterator, KeysView, List, Optional, Set, Tuple
+from app.unification import parse_predicate, is_open_pattern
+from app.symbols import parse_fact
+from app.discrimination_tree import DiscriminationTree
+
+
+_EMPTY: Dict[str, None] = {}
+
+
+class FactIndex:
+    """Conjunto de fatos indexado por (predicado, aridade) e por argumentos constantes."""
+    
+    def __init__(self, facts: Optional[Iterable[str]] = None, index_positions: bool = True,
+                 parent: Optional['FactIndex'] = None, source=None):
+        """
+        Inicializa o índice.
+        
+        Args:
+            facts: Fatos iniciais
+            index_positions: Se True, indexa também cada posição de argumento
+            parent: Índice base só de leitura (opcional); os seus fatos são
+                visíveis neste índice, mas add só escreve na camada local
+            source: Fatos carregados por predicado (opcional): objeto com
+                predicates() e parsed_facts_for(nome), que dá tuplos (fato,
+                predicado, argumentos); os fatos de um predicado só são lidos
+                quando o índice é consultado sobre ele
+        """
+        self.index_positions = index_positions
+        self.parent = parent
+        self.source = source
+        self._loaded: Set[str] = set()
+        self._facts: Dict[str, None] = {}
+        self._parsed: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._buckets: Dict[Tuple[str, int], Dict[str, None]] = {}
+        self._positions: Dict[Tuple[str, int, int, str], Dict[str, None]] = {}
+        # Árvore de discriminação, construída na primeira consulta exata
+        self._tree: Optional[DiscriminationTree] = None
+        
+        if isinstance(facts, FactIndex):
+            # Copiar de outro índice reaproveita o parse que ele já fez
+            for fact in facts:
+                predicate = facts.predicate(fact)
+                self.add_parsed(fact, predicate and predicate[0], facts.arguments(fact))
+        elif facts:
+            for fact in facts:
+                self.add(fact)
+    
+    def add(self, fact: str) -> bool:
+        """
+        Adiciona um fato ao índice.
+        
+        Args:
+            fact: Fato no formato predicado(arg1, ...)
+            
+        Returns:
+            True se o fato era novo, False se já existia
+        """
+        if fact in self._facts or (self.parent is not None and fact in self.parent):
+            return False
+        name, args = parse_fact(fact)
+        self._insert(fact, name, args)
+        return True
+    
+    def add_parsed(self, fact: str, name: Optional[str], args: Tuple[str, ...]) -> bool:
+        """
+        Como add, para um fato cujo parse já é conhecido (não volta a ser feito).
+        
+        Args:
+            fact: Fato no formato predicado(arg1, ...)
+            name: Nome do predicado (None se o fato não for válido)
+            args: Argumentos
+            
+        Returns:
+            True se o fato era novo, False se já existia
+        """
+        if fact in self._facts or (self.parent is not None and fact in self.parent):
+            return False
+        self._insert(fact, name, args)
+        return True
+    
+    def _insert(self, fact: str, name: Optional[str], args: Tuple[str, ...]):
+        self._facts[fact] = None
+        if name is None:
+            return
+        
+        arity = len(args)
+        self._parsed[fact] = (name, args)
+        if self._tree is not None:
+            self._tree.add(fact)
+        self._buckets.setdefault((name, arity), {})[fact] = None
+        
+        if self.index_positions:
+            for position, arg in enumerate(args):
+                key = (name, arity, position, arg)
+                self._positions.setdefault(key, {})[fact] = None
+    
+    def _require(self, name: Optional[str]):
+        """Lê da fonte os fatos de um predicado, na primeira vez que é consultado."""
+        if name not in self._loaded:
+            self._loaded.add(name)
+            for fact, fact_name, args in self.source.parsed_facts_for(name):
+                self.add_parsed(fact, fact_name, args)
+    
+    def _require_all(self):
+        for name in self.source.predicates():
+            self._require(name)
+    
+    def facts_of(self, names: Iterable[str]) -> Iterator[str]:
+        """
+        Fatos de alguns predicados (só esses são lidos da fonte).
+        
+        Args:
+            names: Nomes dos predicados
+            
+        Yields:
+            Fatos de cada predicado, com qualquer aridade
+        """
+        names = set(names)
+        if self.source is not None:
+            for name in names:
+                self._require(name)
+        for (name, _), bucket in list(self._buckets.items()):
+            if name in names:
+                yield from bucket
+    
+    def arguments(self, fact: str) -> Tuple[str, ...]:
+        """
+        Retorna os argumentos já separados de um fato indexado.
+        
+        Args:
+            fact: Fato indexado
+            
+        Returns:
+            Tupla de argumentos (vazia se o fato não tiver sido indexado)
+        """
+        parsed = self._parsed.get(fact)
+        if parsed is None and self.parent is not None:
+            return self.parent.arguments(fact)
+        return parsed[1] if parsed else ()
+    
+    def predicate(self, fact: str) -> Optional[Tuple[str, int]]:
+        """
+        Retorna o par (predicado, aridade) de um fato indexado.
+        
+        Args:
+            fact: Fato indexado
+            
+        Returns:
+            Tupla (nome, aridade) ou None se o fato não tiver sido indexado
+        """
+        parsed = self._parsed.get(fact)
+        if parsed is None and self.parent is not None:
+            return self.parent.predicate(fact)
+        return (parsed[0], len(parsed[1])) if parsed else None
+    
+    def bucket(self, name: str, arity: int) -> KeysView:
+        """
+        Retorna os fatos de um predicado com uma dada aridade.
+        
+        Args:
+            name: Nome do predicado
+            arity: Número de argumentos
+            
+        Returns:
+            Conjunto de fatos (não deve ser alterado)
+        """
+        if self.source is not None:
+            self._require(name)
+        local = self._buckets.get((name, arity), _EMPTY).keys()
+        if self.parent is None:
+            return local
+        return self._merge(self.parent.bucket(name, arity), local)
+    
+    def candidates(self, pattern: str) -> KeysView:
+        """
+        Retorna os fatos que podem unificar com um padrão.
+        O resultado é um superconjunto: o unificador continua a confirmar cada fato.
+        
+        Args:
+            pattern: Padrão, ex: humano(X) ou pai(X, Maria)
+            
+        Returns:
+            Conjunto de fatos candidatos (não deve ser alterado)
+        """
+        name, args = parse_predicate(pattern)
+        if name is None:
+            return _EMPTY.keys()
+        return self.candidates_for(name, args)
+    
+    def candidates_for(self, name: str, args) -> KeysView:
+        """
+        Como candidates, mas para um padrão já separado em nome e argumentos.
+        
+        Args:
+            name: Nome do predicado
+            args: Argumentos (variáveis ou constantes)
+            
+        Returns:
+            Conjunto (ou lista) de fatos candidatos (não deve ser alterado)
+        """
+        if self.source is not None:
+            self._require(name)
+        arity = len(args)
+        best = self._buckets.get((name, arity), _EMPTY).keys()
+        
+        if self.index_positions and sum(not is_open_pattern(arg) for arg in args) > 1:
+            # Várias constantes: a árvore devolve só os fatos que as têm todas
+            best = self.tree.retrieve_for(name, args)
+        elif self.index_positions:
+            # Usar o índice de posição mais seletivo entre os argumentos constantes
+            for position, arg in enumerate(args):
+                if is_open_pattern(arg):
+                    continue
+                matches = self._positions.get((name, arity, position, arg), _EMPTY).keys()
+                if len(matches) < len(best):
+                    best = matches
+                if not best:
+                    break
+        
+        if self.parent is None:
+            return best
+        return self._merge(self.parent.candidates_for(name, args), best)
+    
+    @property
+    def tree(self) -> DiscriminationTree:
+        """Árvore de discriminação dos fatos locais (construída na primeira utilização)."""
+        if self._tree is None:
+            self._tree = DiscriminationTree(self._facts)
+        return self._tree
+    
+    def retrieve(self, pattern: str) -> List[str]:
+        """
+        Retorna exatamente os fatos que unificam com um padrão (variáveis
+        como coringas), pela ordem de inserção. O custo é proporcional aos
+        ramos compatíveis da árvore e não ao número de fatos.
+        
+        Args:
+            pattern: Padrão, ex: humano(X) ou pai(X, Maria)
+            
+        Returns:
+            Lista de fatos (os da camada base primeiro)
+        """
+        if self.source is not None:
+            self._require(parse_predicate(pattern)[0])
+        found = self.tree.retrieve(pattern)
+        if self.parent is not None:
+            found = self.parent.retrieve(pattern) + found
+        return found
+    
+    @staticmethod
+    def _merge(inherited: KeysView, local: KeysView) -> KeysView:
+        """Junta os fatos da camada base com os locais (só copia se ambos existirem)."""
+        if not local:
+            return inherited
+        if not inherited:
+            return local
+        return dict.fromkeys(chain(inherited, local)).keys()
+    
+    def __contains__(self, fact: str) -> bool:
+        if self.source is not None and fact not in self._facts:
+            self._require(parse_fact(fact)[0])
+        return fact in self._facts or (self.parent is not None and fact in self.parent)
+    
+    def __iter__(self) -> Iterator[str]:
+        if self.source is not None:
+            self._require_all()
+        if self.parent is None:
+            return iter(self._facts)
+        return chain(self.parent, self._facts)
+    
+    def __len__(self) -> int:
+        if self.source is not None:
+            self._require_all()
+        return len(self._facts) + (len(self.parent) if self.parent is not None else 0)
+
+
+class MergedSource:
+    """Várias fontes de FactIndex vistas como uma (ex: fatos base e derivados)."""
+    
+    def __init__(self, *sources):
+        """
+        Args:
+            sources: Objetos com predicates() e parsed_facts_for(nome)
+        """
+        self.sources = sources
+    
+    def predicates(self) -> List[str]:
+        """Predicados de todas as fontes, sem repetições."""
+        return list(dict.fromkeys(name for source in self.sources for name in source.predicates()))
+    
+    def parsed_facts_for(self, name: Optional[str]) -> Iterator[Tuple]:
+        """Fatos de um predicado em cada fonte, pela ordem das fontes."""
+        for source in self.sources:
+            yield from source.parsed_facts_for(name)
+
+
+def kb_fact_index(kb) -> FactIndex:
+    """
+    Índice dos fatos de uma KB. Se os fatos puderem ser lidos por
+    predicado (ShardedStorage em app.storage ou o snapshot binário de
+    app.binary_snapshot), os de cada predicado só são lidos quando uma
+    regra ou consulta o usa, já separados em argumentos.
+    
+    Args:
+        kb: KnowledgeBase
+        
+    Returns:
+        FactIndex com os fatos da KB
+    """
+    if getattr(kb.facts, 'lazy', False):
+        return FactIndex(source=kb.facts)
+    return FactIndex(kb.get_facts())
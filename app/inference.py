@@ -1,24 +1,137 @@
 """
 Motor de inferência com encadeamento para frente (forward chaining).
 """
-from typing import Dict, List, Set, Optional
-from app.unification import parse_predicate, unify_predicates, apply_substitution_to_predicate
-import uuid
+from typing import Callable, Dict, Iterator, List, Set, Optional, Tuple
+from app.unification import is_open_pattern
+from app.fact_index import FactIndex, MergedSource, kb_fact_index
+from app.join_plan import CompiledRule, parse_rule
+from app.rete import ReteNetwork
+from app.dependency_graph import PredicateGraph
+from app.provenance import ProvenanceStore
+from app import columnar
+from app.parallel import FactLog, evaluate_rule_shard
+from app.symbols import parse_fact
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+
+
+class InferenceBudget:
+    """Limites de uma execução de inferência (None = sem limite)."""
+    
+    def __init__(self, max_seconds: Optional[float] = None, max_facts: Optional[int] = None,
+                 max_iterations: Optional[int] = None):
+        """
+        Args:
+            max_seconds: Tempo máximo em segundos
+            max_facts: Número máximo de fatos derivados
+            max_iterations: Número máximo de iterações
+        """
+        self.max_seconds = max_seconds
+        self.max_facts = max_facts
+        self.max_iterations = max_iterations
+    
+    def exhausted(self, started: float, iterations: int, facts: int) -> Optional[str]:
+        """
+        Verifica se algum limite foi atingido.
+        
+        Args:
+            started: Instante de início (time.monotonic)
+            iterations: Iterações já feitas
+            facts: Fatos já derivados
+            
+        Returns:
+            'time', 'facts' ou 'iterations', ou None se ainda houver orçamento
+        """
+        if self.max_seconds is not None and time.monotonic() - started >= self.max_seconds:
+            return 'time'
+        if self.max_facts is not None and facts >= self.max_facts:
+            return 'facts'
+        if self.max_iterations is not None and iterations >= self.max_iterations:
+            return 'iterations'
+        return None
+
+
+class CancellationToken:
+    """Token para cancelar uma inferência a partir de outra thread."""
+    
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self):
+        """Pede a paragem da inferência."""
+        self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        """True se a paragem foi pedida."""
+        return self._event.is_set()
 
 
 class InferenceEngine:
     """Motor de inferência lógica por encadeamento para frente."""
     
-    def __init__(self, kb):
+    # Modos de avaliação suportados
+    MODES = ('naive', 'semi_naive', 'rete', 'parallel', 'columnar')
+    
+    # Abaixo deste tamanho de delta uma ronda paralela é avaliada localmente
+    parallel_min_delta = 256
+    
+    @classmethod
+    def available_modes(cls) -> Tuple[str, ...]:
+        """
+        Modos que podem ser usados neste ambiente ('columnar' só com o NumPy).
+        
+        Returns:
+            Tuplo com os nomes dos modos, pela ordem de MODES
+        """
+        return tuple(mode for mode in cls.MODES
+                     if mode != 'columnar' or columnar.available())
+    
+    def __init__(self, kb, mode: str = 'naive', workers: Optional[int] = None,
+                 provenance: bool = True, max_derivations: int = 1):
         """
         Inicializa o motor de inferência.
         
         Args:
             kb: Instância de KnowledgeBase
+            mode: Modo de avaliação ('naive', 'semi_naive', 'rete', 'parallel'
+                ou 'columnar', que requer o NumPy)
+            workers: Número de processos no modo 'parallel' (None = núcleos disponíveis)
+            provenance: Se False, não guarda justificações nem inferências na KB
+                (para cargas em massa em que as provas não são precisas)
+            max_derivations: Número máximo de derivações guardadas por fato
         """
+        if mode not in self.MODES:
+            raise ValueError(f"Modo de inferência desconhecido: {mode}")
+        if mode == 'columnar' and not columnar.available():
+            raise ValueError("O modo 'columnar' requer o NumPy (pip install numpy)")
+        
         self.kb = kb
+        self.mode = mode
+        self.workers = workers
+        self.provenance = provenance
+        self.max_derivations = max_derivations
+        self.provenance_store: Optional[ProvenanceStore] = None
         self.derived_facts: Set[str] = set()
-        self.justifications: Dict[str, Dict] = {}
+        self.fact_index = FactIndex()
+        self._compiled_rules: Dict[str, CompiledRule] = {}
+        self.network: Optional[ReteNetwork] = None
+        self._materialized = False
+        # Uma execução semi-ingénua parou antes do ponto fixo (orçamento ou
+        # cancelamento): as inferências da KB não têm o fecho completo
+        self._closure_incomplete = False
+        self._reported: Set[str] = set()
+        # Armazém temporário usado por evaluate_program (não toca na KB)
+        self._sink: Optional[ProvenanceStore] = None
+        # Pool do modo 'parallel' (criado na primeira ronda paralela) e o
+        # ficheiro com os fatos que os seus processos já receberam
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._fact_log: Optional[FactLog] = None
+        
+        kb.add_listener(self._on_kb_change)
     
     def parse_rule(self, rule: str) -> tuple:
         """
@@ -30,47 +143,84 @@ class InferenceEngine:
         Returns:
             Tupla (consequente, [antecedentes])
         """
-        if ':-' not in rule:
-            return None, []
-        
-        parts = rule.split(':-')
-        consequent = parts[0].strip()
-        
-        # Pode haver múltiplos antecedentes separados por vírgula
-        antecedents_str = parts[1].strip()
-        antecedents = [a.strip() for a in antecedents_str.split(',')]
+        return parse_rule(rule)
+    
+    def compile_rule(self, consequent: str, antecedents: List[str],
+                     original_rule: str) -> CompiledRule:
+        """
+        Compila uma regra num plano de junção (com cache por regra).
         
-        return consequent, antecedents
+        Args:
+            consequent: Consequente da regra
+            antecedents: Lista de antecedentes
+            original_rule: Regra original
+            
+        Returns:
+            Regra compilada
+        """
+        compiled = self._compiled_rules.get(original_rule)
+        if compiled is None:
+            compiled = CompiledRule(original_rule, consequent, antecedents)
+            self._compiled_rules[original_rule] = compiled
+        return compiled
     
     def forward_chaining(self) -> List[str]:
         """
         Executa inferência por encadeamento para frente.
         Deriva novos fatos a partir dos fatos e regras existentes.
         
+        Returns:
+            Lista de novos fatos derivados
+        """
+        if self.mode in ('semi_naive', 'parallel'):
+            return self._forward_chaining_semi_naive()
+        if self.mode == 'rete':
+            return self._forward_chaining_rete()
+        if self.mode == 'columnar':
+            return self._forward_chaining_columnar()
+        return self._forward_chaining_naive()
+    
+    def _compile_rules(self) -> List[tuple]:
+        """
+        Faz parse de todas as regras da KB uma única vez.
+        
+        Returns:
+            Lista de tuplas (consequente, [antecedentes], regra original)
+        """
+        compiled = []
+        for rule in self.kb.get_rules():
+            consequent, antecedents = self.parse_rule(rule)
+            if consequent and antecedents:
+                compiled.append((consequent, antecedents, rule))
+        return compiled
+    
+    def _forward_chaining_naive(self) -> List[str]:
+        """
+        Avaliação ingénua: em cada iteração todas as regras são aplicadas
+        a todos os fatos conhecidos.
+        
         Returns:
             Lista de novos fatos derivados
         """
         # Inicializa com fatos da base de conhecimento
-        known_facts = set(self.kb.get_facts())
+        known_facts = kb_fact_index(self.kb)
+        self.fact_index = known_facts
         self.derived_facts = set()
-        self.justifications = {}
         
         # Loop até não haver mais fatos novos
         changed = True
         iteration = 0
         max_iterations = 100  # Limite de segurança
         
+        # Cada regra é analisada uma só vez, não em cada iteração
+        rules = self._compile_rules()
+        
         while changed and iteration < max_iterations:
             changed = False
             iteration += 1
             
             # Para cada regra
-            for rule in self.kb.get_rules():
-                consequent, antecedents = self.parse_rule(rule)
-                
-                if not consequent or not antecedents:
-                    continue
-                
+            for consequent, antecedents, rule in rules:
                 # Tentar aplicar a regra
                 new_facts = self.apply_rule(consequent, antecedents, known_facts, rule)
                 
@@ -80,56 +230,601 @@ class InferenceEngine:
                         self.derived_facts.add(new_fact)
                         changed = True
         
+        self._materialized = True
         return list(self.derived_facts)
     
+    def _forward_chaining_semi_naive(self) -> List[str]:
+        """
+        Avaliação semi-ingénua (orientada ao delta): em cada iteração as
+        regras só são aplicadas aos fatos novos da iteração anterior.
+        Corre até ao ponto fixo, sem limite de iterações.
+        
+        Returns:
+            Lista de novos fatos derivados
+        """
+        for _ in self.forward_chaining_iter():
+            pass
+        return list(self.derived_facts)
+    
+    def forward_chaining_iter(self, budget: Optional['InferenceBudget'] = None,
+                              cancel: Optional['CancellationToken'] = None) -> Iterator[Dict]:
+        """
+        Variante em gerador do encadeamento para frente (semi-ingénua).
+        Produz cada fato derivado assim que é obtido e um relatório de
+        progresso por iteração; pára em segurança quando o orçamento se
+        esgota ou o token é cancelado, mantendo os resultados parciais.
+        
+        Eventos produzidos:
+            {'type': 'fact', 'fact': ...}
+            {'type': 'progress', 'iteration': ..., 'derived': ..., 'elapsed': ...}
+            {'type': 'done', 'reason': 'fixpoint' | 'time' | 'facts' | 'iterations' | 'cancelled', ...}
+        
+        Args:
+            budget: Limites de tempo, fatos e iterações (opcional)
+            cancel: Token de cancelamento (opcional)
+            
+        Yields:
+            Dicionários de evento
+        """
+        if self.mode in ('rete', 'columnar'):
+            derived = self.forward_chaining()
+            for fact in derived:
+                yield {'type': 'fact', 'fact': fact}
+            yield {'type': 'done', 'reason': 'fixpoint', 'iteration': 0,
+                   'derived': len(derived), 'elapsed': 0.0}
+            return
+        
+        yield from self._semi_naive_iter(budget, cancel)
+    
+    def _semi_naive_iter(self, budget: Optional['InferenceBudget'] = None,
+                         cancel: Optional['CancellationToken'] = None) -> Iterator[Dict]:
+        """Corpo semi-ingénuo de forward_chaining_iter (para qualquer modo)."""
+        known_facts = kb_fact_index(self.kb)
+        self.fact_index = known_facts
+        self.derived_facts = set()
+        self._materialized = False
+        self._closure_incomplete = True
+        
+        rules = self._compile_rules()
+        if known_facts.source is None:
+            # Na primeira iteração o delta é a KB inteira
+            delta = FactIndex(known_facts)
+        else:
+            # KB lida por predicado: só os predicados do corpo das regras
+            # podem disparar uma regra, por isso só esses são lidos
+            names = {parse_fact(atom)[0] for _, antecedents, _ in rules for atom in antecedents}
+            delta = FactIndex()
+            for fact in known_facts.facts_of(names):
+                delta.add_parsed(fact, known_facts.predicate(fact)[0], known_facts.arguments(fact))
+        events = self._saturate_iter(known_facts, delta, rules, budget, cancel)
+        for event in events:
+            if event['type'] == 'done':
+                # Só uma execução completa serve de base à inferência incremental
+                self._materialized = event['reason'] == 'fixpoint'
+                self._closure_incomplete = not self._materialized
+            yield event
+    
+    def _saturate(self, known_facts: FactIndex, delta: FactIndex,
+                  rules: List[tuple]) -> Set[str]:
+        """
+        Executa o ciclo semi-ingénuo até ao ponto fixo.
+        
+        Args:
+            known_facts: Materialização atual (é atualizada)
+            delta: Fatos ainda não propagados
+            rules: Regras compiladas por _compile_rules
+            
+        Returns:
+            Conjunto dos fatos derivados por este ciclo
+        """
+        return set(
+            event['fact']
+            for event in self._saturate_iter(known_facts, delta, rules)
+            if event['type'] == 'fact'
+        )
+    
+    def _saturate_iter(self, known_facts: FactIndex, delta: FactIndex, rules: List[tuple],
+                       budget: Optional['InferenceBudget'] = None,
+                       cancel: Optional['CancellationToken'] = None) -> Iterator[Dict]:
+        """
+        Ciclo semi-ingénuo estratificado: as componentes do grafo de
+        dependências são avaliadas por ordem topológica. Estratos não
+        recursivos são avaliados uma só vez e regras cujo corpo não recebeu
+        fatos novos são saltadas.
+        
+        Args:
+            known_facts: Materialização atual (é atualizada)
+            delta: Fatos ainda não propagados
+            rules: Regras compiladas por _compile_rules
+            budget: Limites de tempo, fatos e iterações (opcional)
+            cancel: Token de cancelamento (opcional)
+            
+        Yields:
+            Eventos (ver forward_chaining_iter)
+        """
+        graph = PredicateGraph([self.compile_rule(*rule) for rule in rules])
+        budget = budget or InferenceBudget()
+        started = time.monotonic()
+        iteration = 0
+        count = 0
+        
+        def stop_reason():
+            if cancel is not None and cancel.cancelled:
+                return 'cancelled'
+            return budget.exhausted(started, iteration, count)
+        
+        def event(kind, **extra):
+            extra.update({'type': kind, 'iteration': iteration, 'derived': count,
+                          'elapsed': time.monotonic() - started})
+            return extra
+        
+        # Fatos novos ainda por propagar aos estratos seguintes
+        new_facts = FactIndex(delta)
+        
+        parallel = self.mode == 'parallel'
+        for stratum in graph.strata():
+            stratum_delta = new_facts
+            produced = []
+            
+            while len(stratum_delta):
+                reason = stop_reason()
+                if reason:
+                    yield event('done', reason=reason)
+                    return
+                iteration += 1
+                next_delta = FactIndex()
+                
+                # Todas as regras da ronda veem a mesma materialização;
+                # os resultados só são juntados no fim da ronda
+                active = [r for r in stratum.rules if self._touches(r, stratum_delta)]
+                results = self._evaluate_round(active, known_facts, stratum_delta,
+                                               parallel, stop_reason)
+                
+                for new in results:
+                    for new_fact in new:
+                        if new_fact not in known_facts:
+                            known_facts.add(new_fact)
+                            self.derived_facts.add(new_fact)
+                            next_delta.add(new_fact)
+                            produced.append(new_fact)
+                            count += 1
+                            yield {'type': 'fact', 'fact': new_fact}
+                            
+                            if budget.max_facts is not None and count >= budget.max_facts:
+                                yield event('done', reason='facts')
+                                return
+                
+                yield event('progress')
+                
+                if not stratum.recursive:
+                    break
+                stratum_delta = next_delta
+            
+            for new_fact in produced:
+                new_facts.add(new_fact)
+        
+        yield event('done', reason='fixpoint')
+    
+    def _evaluate_round(self, rules: List[CompiledRule], known_facts: FactIndex,
+                        delta: FactIndex, parallel: bool = False,
+                        stop_reason: Optional[Callable[[], Optional[str]]] = None) -> List[List[str]]:
+        """
+        Avalia uma ronda semi-ingénua: cada regra contra a mesma materialização.
+        Em paralelo, o delta de cada regra é partido em fragmentos e cada
+        tarefa só leva o seu fragmento: os fatos conhecidos e o delta chegam
+        aos processos pelo FactLog (ver app.parallel). Os resultados são
+        registados pela mesma ordem do modo sequencial, por isso as
+        justificações são iguais.
+        
+        Args:
+            rules: Regras a avaliar
+            known_facts: Materialização no início da ronda
+            delta: Fatos novos da ronda anterior
+            parallel: Avaliar no pool de processos do motor
+            stop_reason: Verificada antes de cada regra; se devolver um motivo,
+                as regras restantes da ronda não são avaliadas
+            
+        Returns:
+            Lista, por regra, dos fatos derivados
+        """
+        if not parallel or len(delta) < self.parallel_min_delta:
+            results = []
+            for rule in rules:
+                if stop_reason is not None and stop_reason():
+                    break
+                results.append(self._record_matches(rule, rule.matches(known_facts, delta)))
+            return results
+        
+        # Predicados lidos por cada regra e pela ronda
+        bodies = [dict.fromkeys((name, len(args)) for name, args, _ in rule.body) for rule in rules]
+        predicates = list(dict.fromkeys(key for body in bodies for key in body))
+        
+        executor = self._executor()
+        log = self._log_for(known_facts)
+        log.sync(predicates)
+        log.write_delta(f for name, arity in predicates for f in delta.bucket(name, arity))
+        
+        shards = self.workers or os.cpu_count() or 1
+        tasks = []
+        for rule, body in zip(rules, bodies):
+            rule_delta = [f for name, arity in body for f in delta.bucket(name, arity)]
+            
+            # Fragmentos contíguos do delta, um por tarefa
+            size = max(1, -(-len(rule_delta) // shards))
+            futures = [
+                executor.submit(evaluate_rule_shard, rule.rule, rule.consequent, rule.antecedents,
+                                log.path, log.size, rule_delta[start:start + size])
+                for start in range(0, len(rule_delta), size)
+            ]
+            tasks.append((rule, futures))
+        
+        results = []
+        for rule, futures in tasks:
+            parts = [future.result() for future in futures]
+            # Juntar por posição e depois por fragmento: a ordem do modo sequencial
+            matches = [
+                match
+                for position in range(len(rule.body))
+                for part in parts
+                for match in part[position]
+            ]
+            results.append(self._record_matches(rule, matches))
+        return results
+    
+    def _executor(self) -> ProcessPoolExecutor:
+        """Pool de processos do motor (criado na primeira utilização)."""
+        if self._pool is None:
+            # spawn em vez de fork: o servidor web tem várias threads e um
+            # processo criado por fork pode herdar locks que nunca são libertados
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+    
+    def _log_for(self, known_facts: FactIndex) -> FactLog:
+        """
+        FactLog que espelha uma materialização. Enquanto a materialização
+        for a mesma (ex: inferência incremental), os processos do pool só
+        recebem os fatos novos; uma materialização nova começa outro ficheiro.
+        """
+        if self._fact_log is None or self._fact_log.index is not known_facts:
+            if self._fact_log is not None:
+                self._fact_log.close()
+            self._fact_log = FactLog(known_facts)
+        return self._fact_log
+    
+    def close(self):
+        """
+        Descarta o motor: deixa de acompanhar a KB, termina o pool de
+        processos do modo 'parallel' e apaga o seu ficheiro de fatos.
+        """
+        self.kb.remove_listener(self._on_kb_change)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._fact_log is not None:
+            self._fact_log.close()
+            self._fact_log = None
+    
+    def _touches(self, rule: CompiledRule, delta: FactIndex) -> bool:
+        """Verifica se algum predicado do corpo da regra tem fatos no delta."""
+        return any(delta.bucket(name, len(args)) for name, args, _ in rule.body)
+    
+    def dependency_graph(self) -> PredicateGraph:
+        """
+        Constrói o grafo de dependências entre predicados das regras da KB.
+        
+        Returns:
+            PredicateGraph (usar describe() para a estrutura de recursão)
+        """
+        return PredicateGraph([self.compile_rule(*rule) for rule in self._compile_rules()])
+    
+    def evaluate_program(self, rules: List[str], seeds: List[str],
+                         base: Optional[FactIndex] = None) -> Tuple[FactIndex, ProvenanceStore]:
+        """
+        Avalia um programa de regras que não está na KB (ex: reescrito por
+        magic sets) a partir de fatos semente. Só os sementes formam o delta
+        inicial, por isso só disparam as regras que dependem deles. A KB, a
+        materialização e as justificações do motor não são alteradas.
+        
+        Args:
+            rules: Regras do programa
+            seeds: Fatos semente
+            base: Índice dos fatos da KB a reutilizar (opcional; por omissão
+                é construído a partir da KB)
+            
+        Returns:
+            Tupla (índice com a base e os fatos derivados, proveniência dos derivados)
+        """
+        known_facts = FactIndex(parent=base if base is not None else kb_fact_index(self.kb))
+        delta = FactIndex()
+        for seed in seeds:
+            if known_facts.add(seed):
+                delta.add(seed)
+        
+        program = []
+        for rule in rules:
+            consequent, antecedents = self.parse_rule(rule)
+            if consequent and antecedents:
+                program.append((consequent, antecedents, rule))
+        
+        store = ProvenanceStore(symbols=self.kb.symbols)
+        derived_facts = self.derived_facts
+        self.derived_facts = set()
+        self._sink = store
+        try:
+            self._saturate(known_facts, delta, program)
+        finally:
+            self.derived_facts = derived_facts
+            self._sink = None
+        return known_facts, store
+    
+    def infer_incremental(self, new_facts: List[str],
+                          new_rules: Optional[List[str]] = None) -> List[str]:
+        """
+        Deriva apenas as consequências de fatos e regras acabados de importar,
+        juntando-as à materialização existente (derived_facts, justificações
+        e inferências da KB) em vez de recalcular tudo.
+        
+        Args:
+            new_facts: Fatos novos (já adicionados à KB)
+            new_rules: Regras novas (já adicionadas à KB)
+            
+        Returns:
+            Lista dos fatos derivados por esta atualização
+        """
+        if self.mode == 'rete':
+            # A rede já propagou as alterações quando foram feitas na KB
+            self._forward_chaining_rete()
+            fresh = [f for f in self.network.derived if f not in self._reported]
+            self._reported.update(fresh)
+            return fresh
+        
+        if self.mode == 'columnar':
+            # Recalcular em bloco é mais barato do que reconstruir as strings
+            previous = self.derived_facts
+            return [f for f in self._forward_chaining_columnar() if f not in previous]
+        
+        if self._closure_incomplete:
+            # A última execução parou antes do ponto fixo: também faltam
+            # consequências dos fatos antigos, por isso satura a KB inteira
+            previous = self.derived_facts
+            for _ in self._semi_naive_iter():
+                pass
+            return [f for f in self.derived_facts if f not in previous]
+        
+        known_facts = self._materialization()
+        new_rules = set(new_rules or [])
+        rules = self._compile_rules()
+        
+        # Regras novas nunca foram avaliadas: aplicá-las à materialização anterior
+        delta = FactIndex()
+        for consequent, antecedents, rule in rules:
+            if rule not in new_rules:
+                continue
+            for new_fact in self.apply_rule(consequent, antecedents, known_facts, rule):
+                if new_fact not in known_facts:
+                    delta.add(new_fact)
+        
+        # Os fatos novos entram sempre no delta: a materialização pode ter
+        # sido reconstruída depois de já estarem na KB
+        for fact in new_facts:
+            delta.add(fact)
+        
+        new_fact_set = set(new_facts)
+        derived = set(f for f in delta if f not in new_fact_set)
+        for fact in delta:
+            known_facts.add(fact)
+        self.derived_facts.update(derived)
+        
+        derived.update(self._saturate(known_facts, delta, rules))
+        return list(derived)
+    
+    def _materialization(self) -> FactIndex:
+        """
+        Retorna a materialização atual (fatos base e derivados).
+        Se o motor ainda não a tiver calculado, é reconstruída a partir das
+        inferências guardadas na KB, sem voltar a aplicar as regras.
+        
+        Returns:
+            FactIndex com todos os fatos conhecidos
+        """
+        if self._materialized:
+            return self.fact_index
+        
+        self.derived_facts = set()
+        if self.kb.storage.lazy:
+            # KB dividida por predicado: os fatos base e derivados de cada
+            # predicado só são lidos quando uma regra os usa (derived_facts
+            # fica só com os fatos derivados a partir de agora). As vistas
+            # não veem as inferências que o motor vai registando na KB.
+            self.fact_index = FactIndex(source=MergedSource(self.kb.get_facts(),
+                                                            self.kb.get_inferences()))
+            self._materialized = True
+            return self.fact_index
+        
+        self.fact_index = FactIndex(self.kb.get_facts())
+        for inference in self.kb.get_inferences():
+            fact = inference.get('derived_fact')
+            if fact and self.fact_index.add(fact):
+                self.derived_facts.add(fact)
+        
+        self._materialized = True
+        return self.fact_index
+    
+    def _forward_chaining_columnar(self) -> List[str]:
+        """
+        Avaliação semi-ingénua sobre colunas de inteiros (NumPy).
+        Deriva os mesmos fatos que o modo 'semi_naive'; cada fato guarda
+        uma das suas derivações como justificação.
+        
+        Returns:
+            Lista de novos fatos derivados
+        """
+        rules = [self.compile_rule(*rule) for rule in self._compile_rules()]
+        if not all(columnar.supports(rule) for rule in rules):
+            # Termos compostos com variáveis não cabem em colunas de símbolos
+            for _ in self._semi_naive_iter():
+                pass
+            return list(self.derived_facts)
+        
+        store = columnar.ColumnarStore(self.kb.symbols)
+        store.add_facts(self.kb.get_facts())
+        
+        record = None
+        if self.provenance:
+            def record(rule, new_fact, substitutions, used_facts):
+                self.record_derivation(new_fact, rule.rule, used_facts, substitutions)
+        
+        derived = columnar.ColumnarEvaluator(store).saturate(rules, record)
+        self.derived_facts = set(derived)
+        self._materialized = False
+        return derived
+    
+    def _forward_chaining_rete(self) -> List[str]:
+        """
+        Avaliação por rede Rete persistente.
+        A rede é construída na primeira chamada; depois disso cada fato ou
+        regra adicionado à KB é propagado logo, e esta chamada só devolve
+        o estado já materializado.
+        
+        Returns:
+            Lista de fatos derivados
+        """
+        if self.network is None:
+            self._build_network()
+        
+        base_facts = set(self.kb.get_facts())
+        return [f for f in self.network.derived if f not in base_facts]
+    
+    def _build_network(self):
+        """Constrói a rede Rete a partir das regras e fatos atuais da KB."""
+        self.network = ReteNetwork(self._on_network_match)
+        self.fact_index = self.network.facts
+        self.derived_facts = self.network.derived
+        
+        for fact in self.kb.get_facts():
+            self.network.add_fact(fact)
+        for consequent, antecedents, rule in self._compile_rules():
+            self.network.add_rule(self.compile_rule(consequent, antecedents, rule))
+    
+    def _on_kb_change(self, event: str, item):
+        """Acompanha as alterações feitas na KB (materialização e rede Rete)."""
+        if event == 'clear':
+            self._materialized = False
+            self._reported = set()
+            self.provenance_store = None
+        
+        if self.network is None:
+            return
+        
+        if event == 'add_fact':
+            self.network.add_fact(item)
+        elif event == 'add_rule':
+            consequent, antecedents = self.parse_rule(item)
+            if consequent and antecedents:
+                self.network.add_rule(self.compile_rule(consequent, antecedents, item))
+        elif event == 'clear':
+            self._build_network()
+    
+    def _on_network_match(self, rule: CompiledRule, new_fact: str,
+                          substitutions: Dict[str, str], used_facts: List[str]) -> bool:
+        """Regista cada disparo de regra produzido pela rede Rete."""
+        if self.has_variables(new_fact):
+            return False
+        self.record_derivation(new_fact, rule.rule, used_facts, substitutions)
+        return True
+    
+    def record_derivation(self, new_fact: str, rule: str, used_facts: List[str],
+                          substitutions: Dict[str, str]):
+        """
+        Guarda a justificação de um fato derivado e regista a inferência na KB.
+        Derivações repetidas (mesma regra e mesmos fatos) são ignoradas.
+        
+        Args:
+            new_fact: Fato derivado
+            rule: Regra original
+            used_facts: Fatos usados, pela ordem dos antecedentes
+            substitutions: Ligações das variáveis
+        """
+        if self._sink is not None:
+            self._sink.record(new_fact, rule, used_facts, substitutions)
+            return
+        
+        if not self.provenance:
+            return
+        
+        store = self._provenance()
+        derivation = store.record(new_fact, rule, used_facts, substitutions)
+        
+        # Só derivações novas chegam à KB (uma por fato, ou max_derivations)
+        if derivation is not None:
+            self.kb.add_inference(store.inference(derivation))
+    
+    def _provenance(self) -> ProvenanceStore:
+        """
+        Retorna o armazém de proveniência, carregando-o das inferências da KB
+        na primeira utilização.
+        
+        Returns:
+            ProvenanceStore partilhado pelas execuções deste motor
+        """
+        if self.provenance_store is None:
+            if self.kb.storage.lazy:
+                # As derivações de cada predicado só são lidas quando usadas
+                self.provenance_store = ProvenanceStore(self.max_derivations,
+                                                        source=self.kb.inferences,
+                                                        symbols=self.kb.symbols)
+            else:
+                self.provenance_store = ProvenanceStore(self.max_derivations,
+                                                        symbols=self.kb.symbols)
+                self.provenance_store.load(self.kb.get_inferences())
+        return self.provenance_store
+    
     def apply_rule(self, consequent: str, antecedents: List[str], 
-                   known_facts: Set[str], original_rule: str) -> List[str]:
+                   known_facts, original_rule: str,
+                   delta: Optional[FactIndex] = None) -> List[str]:
         """
         Tenta aplicar uma regra aos fatos conhecidos.
+        A regra só dispara quando todos os antecedentes são satisfeitos
+        com as mesmas ligações de variáveis.
         
         Args:
             consequent: Consequente da regra
             antecedents: Lista de antecedentes
-            known_facts: Conjunto de fatos conhecidos
+            known_facts: FactIndex (ou conjunto) de fatos conhecidos
             original_rule: Regra original (para justificação)
+            delta: Fatos novos; se indicado, cada solução usa pelo menos um deles
+            
+        Returns:
+            Lista de novos fatos derivados
+        """
+        if not isinstance(known_facts, FactIndex):
+            known_facts = FactIndex(known_facts)
+        
+        compiled = self.compile_rule(consequent, antecedents, original_rule)
+        return self._record_matches(compiled, compiled.matches(known_facts, delta))
+    
+    def _record_matches(self, rule: CompiledRule, matches) -> List[str]:
+        """
+        Regista os disparos de uma regra, pela ordem em que foram produzidos.
+        
+        Args:
+            rule: Regra compilada
+            matches: Tuplas (fato derivado, ligações, fatos usados)
             
         Returns:
             Lista de novos fatos derivados
         """
         new_facts = []
         
-        # Para cada fato conhecido
-        for fact in known_facts:
-            # Tentar unificar com cada antecedente
-            for antecedent in antecedents:
-                substitutions = unify_predicates(antecedent, fact)
-                
-                if substitutions is not None:
-                    # Aplicar substituições ao consequente
-                    new_fact = apply_substitution_to_predicate(consequent, substitutions)
-                    
-                    # Verificar se o novo fato ainda tem variáveis
-                    if not self.has_variables(new_fact):
-                        # Guardar justificação
-                        fact_id = str(uuid.uuid4())
-                        self.justifications[new_fact] = {
-                            'id': fact_id,
-                            'fact': new_fact,
-                            'rule': original_rule,
-                            'used_facts': [fact],
-                            'substitutions': substitutions
-                        }
-                        
-                        # Adicionar à KB
-                        self.kb.add_inference({
-                            'id': fact_id,
-                            'derived_fact': new_fact,
-                            'from_rule': original_rule,
-                            'using_facts': [fact],
-                            'substitutions': substitutions
-                        })
-                        
-                        new_facts.append(new_fact)
+        for new_fact, substitutions, used_facts in matches:
+            # Verificar se o novo fato ainda tem variáveis
+            if self.has_variables(new_fact):
+                continue
+            
+            # Guardar justificação
+            self.record_derivation(new_fact, rule.rule, used_facts, substitutions)
+            new_facts.append(new_fact)
         
         return new_facts
     
@@ -144,12 +839,10 @@ class InferenceEngine:
         Returns:
             True se contém variáveis
         """
-        _, args = parse_predicate(predicate)
-        for arg in args:
-            # Variável é uma letra única maiúscula ou segue padrão Var1, Var2, etc.
-            if arg and arg[0].isupper() and (len(arg) == 1 or arg.isalnum() and any(c.isdigit() for c in arg)):
-                return True
-        return False
+        _, args = parse_fact(predicate)
+        # Variável é uma letra única maiúscula ou segue padrão Var1, Var2, etc.,
+        # também dentro de termos compostos, ex: filho(X)
+        return any(is_open_pattern(arg) for arg in args)
     
     def get_justification(self, fact: str) -> Optional[Dict]:
         """
@@ -161,4 +854,15 @@ class InferenceEngine:
         Returns:
             Dicionário com informações de justificação ou None
         """
-        return self.justifications.get(fact)
+        if not self.provenance:
+            return None
+        derivation = self._provenance().get(fact)
+        return self._provenance().justification(derivation) if derivation else None
+    
+    @property
+    def justifications(self) -> Dict[str, Dict]:
+        """Justificações de todos os fatos derivados (uma por fato)."""
+        if not self.provenance:
+            return {}
+        store = self._provenance()
+        return {fact: store.justification(store.get(fact)) for fact in store.facts()}
@@ -0,0 +1,348 @@
+"""
+Compilação de regras em planos de junção (hash joins).
+Uma regra com vários antecedentes só dispara quando todos os antecedentes
+são satisfeitos com as mesmas ligações de variáveis.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.unification import parse_predicate, is_pattern_variable, substitute, Trail
+from app.fact_index import FactIndex
+from app.terms import Term, parse_term, parse_rule_term, term_variables
+
+
+# Um antecedente compilado: (nome, argumentos, variáveis)
+Atom = Tuple[str, Tuple[str, ...], Tuple[str, ...]]
+
+
+def parse_rule(rule: str) -> tuple:
+    """
+    Faz parse de uma regra no formato: consequente :- antecedente.
+    Só as vírgulas fora de parênteses separam antecedentes; o parse de cada
+    regra é guardado em cache (ver app.terms.parse_rule_term).
+    
+    Args:
+        rule: Regra em string
+        
+    Returns:
+        Tupla (consequente, [antecedentes])
+    """
+    parsed = parse_rule_term(rule)
+    if parsed is None:
+        return None, []
+    return str(parsed.head), [str(antecedent) for antecedent in parsed.body]
+
+
+def format_atom(name: str, args) -> str:
+    """
+    Escreve um átomo no formato predicado(arg1, arg2).
+    
+    Args:
+        name: Nome do predicado
+        args: Argumentos
+        
+    Returns:
+        Predicado em string
+    """
+    return f"{name}({', '.join(args)})"
+
+
+def compile_atom(predicate: str) -> Optional[Atom]:
+    """
+    Compila um predicado num átomo com as suas variáveis.
+    
+    Args:
+        predicate: Predicado, ex: pai(X, Maria)
+        
+    Returns:
+        Tupla (nome, argumentos, variáveis) ou None se não for válido
+    """
+    name, args = parse_predicate(predicate)
+    if name is None:
+        return None
+    variables: Dict[str, None] = {}
+    for arg in args:
+        if is_pattern_variable(arg):
+            variables[arg] = None
+        elif '(' in arg:
+            # Variáveis dentro de termos compostos, ex: X em filho(X)
+            variables.update(dict.fromkeys(term_variables(parse_term(arg))))
+    return name, tuple(args), tuple(variables)
+
+
+def _match_nested(pattern: str, value: str, bindings: Dict[str, str]) -> bool:
+    """
+    Emparelha um argumento composto (ex: filho(X)) com o argumento de um fato.
+    
+    Args:
+        pattern: Argumento do átomo
+        value: Argumento do fato
+        bindings: Ligações já feitas (são atualizadas)
+    
+    Returns:
+        True se emparelhar de forma consistente com as ligações
+    """
+    term = parse_term(pattern)
+    if term.ground:
+        return False
+    trail = Trail()
+    if not trail.unify(term, parse_term(value)):
+        return False
+    for name, bound in trail.bindings.items():
+        text = str(trail.resolve(bound))
+        if bindings.setdefault(name, text) != text:
+            return False
+    return True
+
+
+def bind_term(term: Term, bindings: Dict[str, str]) -> Term:
+    """
+    Aplica ligações em texto às variáveis de um termo composto.
+    
+    Args:
+        term: Termo
+        bindings: Ligações (nome da variável -> valor em texto)
+    
+    Returns:
+        Termo com as variáveis ligadas substituídas
+    """
+    values = {name: parse_term(bindings[name]) for name in term_variables(term) if name in bindings}
+    return substitute(term, values) if values else term
+
+
+def match_atom(atom: Atom, fact_args: Tuple[str, ...]) -> Optional[Dict[str, str]]:
+    """
+    Emparelha um átomo com os argumentos de um fato.
+    
+    Args:
+        atom: Átomo compilado
+        fact_args: Argumentos do fato
+        
+    Returns:
+        Ligações das variáveis do átomo ou None se não emparelhar
+    """
+    _, args, _ = atom
+    if len(args) != len(fact_args):
+        return None
+    
+    bindings = {}
+    for arg, value in zip(args, fact_args):
+        if is_pattern_variable(arg):
+            bound = bindings.get(arg)
+            if bound is None:
+                bindings[arg] = value
+            elif bound != value:
+                return None
+        elif arg != value and not ('(' in arg and _match_nested(arg, value, bindings)):
+            return None
+    return bindings
+
+
+class CompiledRule:
+    """Regra compilada num plano de junção sobre um FactIndex."""
+    
+    def __init__(self, rule: str, consequent: str, antecedents: List[str]):
+        """
+        Compila uma regra.
+        
+        Args:
+            rule: Regra original
+            consequent: Consequente da regra
+            antecedents: Lista de antecedentes
+        """
+        self.rule = rule
+        self.consequent = consequent
+        self.antecedents = antecedents
+        self.head = compile_atom(consequent)
+        self.body = [compile_atom(a) for a in antecedents]
+        # Regras com antecedentes inválidos nunca disparam
+        self.valid = self.head is not None and bool(self.body) and None not in self.body
+    
+    def plan(self, index: FactIndex, first: Optional[int] = None) -> List[int]:
+        """
+        Ordena os antecedentes por seletividade estimada.
+        Começa pelo átomo com menos candidatos e prefere depois átomos que
+        partilham variáveis já ligadas, evitando produtos cartesianos.
+        
+        Args:
+            index: Índice de fatos usado para estimar tamanhos
+            first: Posição a avaliar primeiro (ex: o átomo do delta)
+            
+        Returns:
+            Lista de posições dos antecedentes pela ordem de avaliação
+        """
+        sizes = [len(index.candidates(a)) for a in self.antecedents]
+        remaining = list(range(len(self.body)))
+        order = []
+        bound = set()
+        
+        if first is not None:
+            remaining.remove(first)
+            order.append(first)
+            bound.update(self.body[first][2])
+        
+        while remaining:
+            best = min(
+                remaining,
+                key=lambda i: (not bound.intersection(self.body[i][2]) and bool(bound), sizes[i])
+            )
+            remaining.remove(best)
+            order.append(best)
+            bound.update(self.body[best][2])
+        
+        return order
+    
+    def evaluate(self, index: FactIndex,
+                 delta: Optional[FactIndex] = None) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+        """
+        Avalia o corpo da regra por junções de hash.
+        Com delta, cada solução usa pelo menos um fato do delta
+        (avaliação semi-ingénua).
+        
+        Args:
+            index: Todos os fatos conhecidos
+            delta: Fatos novos da última iteração (opcional)
+            
+        Yields:
+            Tuplas (ligações, fatos usados pela ordem dos antecedentes)
+        """
+        if not self.valid:
+            return
+        
+        if delta is None:
+            yield from self._join(self.plan(index), lambda i: index.candidates(self.antecedents[i]), index)
+            return
+        
+        for delta_pos in range(len(self.body)):
+            yield from self.evaluate_position(index, delta, delta_pos)
+    
+    def evaluate_position(self, index: FactIndex, delta: FactIndex, delta_pos: int,
+                          shard: Optional[FactIndex] = None) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+        """
+        Soluções semi-ingénuas em que o antecedente delta_pos vem do delta.
+        Com shard, esse antecedente só usa os fatos do fragmento; juntar os
+        resultados dos fragmentos pela sua ordem reproduz a ordem sem fragmentos.
+        
+        Args:
+            index: Todos os fatos conhecidos
+            delta: Fatos novos da última iteração
+            delta_pos: Posição do antecedente ligado ao delta
+            shard: Fragmento contíguo do delta (opcional)
+            
+        Yields:
+            Tuplas (ligações, fatos usados pela ordem dos antecedentes)
+        """
+        seeds = (shard if shard is not None else delta).candidates(self.antecedents[delta_pos])
+        if not self.valid or not seeds:
+            return
+        
+        def source(i):
+            if i == delta_pos:
+                return seeds
+            candidates = index.candidates(self.antecedents[i])
+            if i < delta_pos:
+                # Átomos anteriores usam só fatos antigos, evitando repetições
+                return [f for f in candidates if f not in delta]
+            return candidates
+        
+        yield from self._join(self.plan(index, first=delta_pos), source, index)
+    
+    def matches(self, index: FactIndex,
+                delta: Optional[FactIndex] = None) -> Iterator[Tuple[str, Dict[str, str], List[str]]]:
+        """
+        Avalia a regra e instancia o consequente de cada solução.
+        
+        Args:
+            index: Todos os fatos conhecidos
+            delta: Fatos novos da última iteração (opcional)
+            
+        Yields:
+            Tuplas (fato derivado, ligações, fatos usados)
+        """
+        return self.instantiate_solutions(self.evaluate(index, delta))
+    
+    def instantiate_solutions(self, solutions) -> Iterator[Tuple[str, Dict[str, str], List[str]]]:
+        """
+        Instancia o consequente para cada solução do corpo.
+        
+        Args:
+            solutions: Tuplas (ligações, fatos usados)
+            
+        Yields:
+            Tuplas (fato derivado, ligações, fatos usados)
+        """
+        for bindings, used in solutions:
+            new_fact = self.instantiate(bindings)
+            if new_fact is not None:
+                yield new_fact, bindings, used
+    
+    def _join(self, order: List[int], source,
+              index: FactIndex) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+        """
+        Executa o plano de junção pela ordem dada.
+        
+        Args:
+            order: Posições dos antecedentes pela ordem de avaliação
+            source: Função que devolve os fatos candidatos de uma posição
+            index: Índice com os argumentos já separados de cada fato
+            
+        Yields:
+            Tuplas (ligações, fatos usados pela ordem dos antecedentes)
+        """
+        partials = [({}, {})]
+        bound = set()
+        
+        for position in order:
+            atom = self.body[position]
+            keys = tuple(v for v in atom[2] if v in bound)
+            
+            # Construir a tabela de hash do átomo pelas variáveis de junção
+            table: Dict[tuple, List[Tuple[str, Dict[str, str]]]] = {}
+            for fact in source(position):
+                bindings = match_atom(atom, index.arguments(fact))
+                if bindings is not None:
+                    key = tuple(bindings[v] for v in keys)
+                    table.setdefault(key, []).append((fact, bindings))
+            
+            # Sondar a tabela com cada solução parcial
+            joined = []
+            for bindings, used in partials:
+                key = tuple(bindings[v] for v in keys)
+                for fact, local in table.get(key, ()):
+                    merged = dict(bindings)
+                    merged.update(local)
+                    merged_used = dict(used)
+                    merged_used[position] = fact
+                    joined.append((merged, merged_used))
+            
+            partials = joined
+            if not partials:
+                return
+            bound.update(atom[2])
+        
+        for bindings, used in partials:
+            yield bindings, [used[i] for i in range(len(self.body))]
+    
+    def instantiate(self, bindings: Dict[str, str]) -> Optional[str]:
+        """
+        Instancia o consequente com as ligações de uma solução.
+        
+        Args:
+            bindings: Ligações das variáveis
+            
+        Returns:
+            Fato derivado ou None se ficar alguma variável por ligar
+        """
+        name, args, _ = self.head
+        values = []
+        for arg in args:
+            if is_pattern_variable(arg):
+                if arg not in bindings:
+                    return None
+                values.append(bindings[arg])
+            elif '(' in arg and not parse_term(arg).ground:
+                term = bind_term(parse_term(arg), bindings)
+                if not term.ground:
+                    return None
+                values.append(str(term))
+            else:
+                values.append(arg)
+        return format_atom(name, values)
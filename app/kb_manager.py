@@ -1,21 +1,45 @@
 """
 Módulo de gestão da base de conhecimento (Knowledge Base).
-Armazena fatos e regras em formato JSON.
+Armazena fatos e regras em formato JSON (ver app.storage para o registo
+de alterações e o armazenamento SQLite opcionais).
 """
-import json
+import inspect
 import os
-from typing import Dict, List, Optional
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, List, Optional
+from app.symbols import SymbolTable
+from app.storage import OrderedSet, SnapshotView, open_storage, snapshot_view, write_ndjson
+from app.locking import BackgroundSaver, ReadWriteLock
+
+
+class KBSnapshot:
+    """Estado da KB numa geração: vistas só de leitura, sem cópias."""
+    
+    __slots__ = ('generation', 'facts', 'rules', 'inferences')
+    
+    def __init__(self, generation: int, facts, rules, inferences):
+        self.generation = generation
+        self.facts = facts
+        self.rules = rules
+        self.inferences = inferences
 
 
 class KnowledgeBase:
     """Gestor da base de conhecimento."""
     
-    def __init__(self, kb_path: str = None):
+    def __init__(self, kb_path: str = None, storage: Optional[str] = None):
         """
         Inicializa a base de conhecimento.
         
         Args:
             kb_path: Caminho para o ficheiro JSON da KB (usa KB_PATH env var se não especificado)
+            storage: 'json' (reescreve o ficheiro), 'wal' (snapshot mais registo
+                de alterações), 'binary', 'sqlite', 'sharded' (diretório com um
+                ficheiro por grupo de predicados) ou 'ndjson' (um registo por
+                linha, comprimido se terminar em .gz ou .xz); se não especificado
+                usa KB_STORAGE env var ou a extensão de kb_path (ex: kb.sqlite,
+                kb.shards, kb.ndjson.gz)
         """
         if kb_path is None:
             kb_path = os.environ.get('KB_PATH', 'kb.json')
@@ -26,65 +50,178 @@ class KnowledgeBase:
             os.makedirs(kb_dir, exist_ok=True)
         
         self.kb_path = kb_path
-        self.facts: List[str] = []
-        self.rules: List[str] = []
+        self.storage = open_storage(kb_path, storage)
+        # Listas só de acréscimo com pertença O(1) (OrderedSet ou vistas SQLite)
+        self.facts = OrderedSet()
+        self.rules = OrderedSet()
         self.inferences: List[Dict] = []
+        # Ids dos símbolos desta KB (motor colunar e proveniência)
+        self.symbols = SymbolTable()
+        # Funções notificadas das alterações (métodos por referência fraca)
+        self._listeners: List[object] = []
+        self._listeners_lock = threading.Lock()
+        # Incrementada a cada alteração; identifica o estado visto por um snapshot
+        self.generation = 0
+        # Leituras em paralelo, alterações exclusivas (ver app.locking)
+        self.lock = ReadWriteLock()
+        # Uma gravação de cada vez (adquirido depois do lock de leitura)
+        self._save_lock = threading.Lock()
+        self._saver: Optional[BackgroundSaver] = None
         
         self.load()
     
     def load(self):
-        """Carrega a base de conhecimento do ficheiro JSON."""
-        if os.path.exists(self.kb_path):
+        """Carrega a base de conhecimento do ficheiro JSON (e do registo, se houver)."""
+        with self.lock.write():
             try:
-                with open(self.kb_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.facts = data.get('facts', [])
-                    self.rules = data.get('rules', [])
-                    self.inferences = data.get('inferences', [])
+                data = self.storage.load()
+                self.facts = data['facts']
+                self.rules = data['rules']
+                self.inferences = data['inferences']
             except Exception as e:
                 print(f"Erro ao carregar KB: {e}")
                 self._initialize_empty()
-        else:
-            self._initialize_empty()
+            self.generation += 1
     
     def _initialize_empty(self):
         """Inicializa uma base de conhecimento vazia."""
-        self.facts = []
-        self.rules = []
+        self.facts = OrderedSet()
+        self.rules = OrderedSet()
         self.inferences = []
     
     def save(self):
-        """Guarda a base de conhecimento no ficheiro JSON."""
-        try:
-            data = {
-                'facts': self.facts,
-                'rules': self.rules,
-                'inferences': self.inferences
-            }
-            with open(self.kb_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Erro ao guardar KB: {e}")
-    
-    def add_fact(self, fact: str):
+        """
+        Guarda a base de conhecimento.
+        Com o registo de alterações só são escritas as alterações desde a
+        última gravação. Com a gravação em segundo plano ativa apenas pede
+        a gravação e retorna logo.
+        """
+        if self._saver is not None:
+            self._saver.request()
+        else:
+            self._write()
+    
+    def _write(self):
+        """
+        Grava já. Bloqueia as alterações (não as leituras) durante a gravação;
+        uma compactação que troca os ficheiros lidos pelas leituras (ver
+        LogStorage.exclusive_compaction) bloqueia também as leituras.
+        """
+        exclusive = (getattr(self.storage, 'exclusive_compaction', False)
+                     and self.storage.compaction_due())
+        with (self.lock.write() if exclusive else self.lock.read()), self._save_lock:
+            try:
+                self.storage.save(self)
+            except Exception as e:
+                print(f"Erro ao guardar KB: {e}")
+    
+    def start_background_saver(self, delay: float = 0.5):
+        """
+        Passa as gravações para uma thread própria: save() retorna logo e as
+        gravações pedidas durante delay segundos são feitas de uma só vez.
+        
+        Args:
+            delay: Segundos a juntar alterações antes de gravar
+        """
+        if self._saver is None:
+            self._saver = BackgroundSaver(self._write, delay)
+    
+    def flush(self):
+        """Grava já as alterações pendentes (não usar com o lock de escrita)."""
+        if self._saver is not None:
+            self._saver.flush()
+        else:
+            self._write()
+    
+    def close(self):
+        """Grava as alterações pendentes e termina a gravação em segundo plano."""
+        if self._saver is not None:
+            saver, self._saver = self._saver, None
+            saver.stop()
+        else:
+            self._write()
+    
+    def add_fact(self, fact: str) -> bool:
         """
         Adiciona um fato à base de conhecimento.
         
         Args:
             fact: Fato no formato predicado(termo)
+            
+        Returns:
+            True se o fato era novo
         """
-        if fact not in self.facts:
-            self.facts.append(fact)
+        with self.lock.write():
+            return self._add_fact(fact)
+    
+    def _add_fact(self, fact: str) -> bool:
+        if fact in self.facts:
+            return False
+        self.facts.append(fact)
+        self._notify('add_fact', fact)
+        return True
     
-    def add_rule(self, rule: str):
+    def add_rule(self, rule: str) -> bool:
         """
         Adiciona uma regra à base de conhecimento.
         
         Args:
             rule: Regra no formato consequente :- antecedente
+            
+        Returns:
+            True se a regra era nova
         """
-        if rule not in self.rules:
-            self.rules.append(rule)
+        with self.lock.write():
+            return self._add_rule(rule)
+    
+    def _add_rule(self, rule: str) -> bool:
+        if rule in self.rules:
+            return False
+        self.rules.append(rule)
+        self._notify('add_rule', rule)
+        return True
+    
+    def add_facts(self, facts: Iterable[str]) -> List[str]:
+        """
+        Adiciona vários fatos (lista ou gerador), sem gravar.
+        
+        Args:
+            facts: Fatos a adicionar
+            
+        Returns:
+            Fatos que ainda não existiam, pela ordem (sem repetições)
+        """
+        with self.lock.write():
+            return [fact for fact in facts if self._add_fact(fact)]
+    
+    def add_rules(self, rules: Iterable[str]) -> List[str]:
+        """
+        Adiciona várias regras (lista ou gerador), sem gravar.
+        
+        Args:
+            rules: Regras a adicionar
+            
+        Returns:
+            Regras que ainda não existiam, pela ordem (sem repetições)
+        """
+        with self.lock.write():
+            return [rule for rule in rules if self._add_rule(rule)]
+    
+    def ingest(self, facts: Iterable[str] = (), rules: Iterable[str] = ()) -> Dict[str, List[str]]:
+        """
+        Adiciona um lote de fatos e regras e grava uma única vez.
+        
+        Args:
+            facts: Fatos (lista ou gerador)
+            rules: Regras (lista ou gerador)
+            
+        Returns:
+            Dicionário com os 'facts' e 'rules' que ainda não existiam na KB
+        """
+        with self.lock.write():
+            added = {'facts': self.add_facts(facts), 'rules': self.add_rules(rules)}
+            self.save()
+        return added
     
     def add_inference(self, inference: Dict):
         """
@@ -93,45 +230,139 @@ class KnowledgeBase:
         Args:
             inference: Dicionário com informações da inferência
         """
-        self.inferences.append(inference)
+        with self.lock.write():
+            self.inferences.append(inference)
+            self._notify('add_inference', inference)
     
-    def get_facts(self) -> List[str]:
-        """Retorna todos os fatos."""
-        return self.facts.copy()
+    def get_facts(self) -> SnapshotView:
+        """Retorna todos os fatos (vista só de leitura, sem cópia)."""
+        with self.lock.read():
+            return snapshot_view(self.facts)
     
-    def get_rules(self) -> List[str]:
-        """Retorna todas as regras."""
-        return self.rules.copy()
+    def get_rules(self) -> SnapshotView:
+        """Retorna todas as regras (vista só de leitura, sem cópia)."""
+        with self.lock.read():
+            return snapshot_view(self.rules)
     
-    def get_inferences(self) -> List[Dict]:
-        """Retorna todas as inferências."""
-        return self.inferences.copy()
+    def get_inferences(self) -> SnapshotView:
+        """Retorna todas as inferências (vista só de leitura, sem cópia)."""
+        with self.lock.read():
+            return snapshot_view(self.inferences)
+    
+    def snapshot(self) -> KBSnapshot:
+        """
+        Retorna o estado atual da KB para leitura consistente.
+        As alterações feitas depois (incluindo um clear) não aparecem nas
+        vistas do snapshot. Com SQLite as vistas são cursores sobre a
+        base de dados e não isolam alterações posteriores.
+        
+        Returns:
+            KBSnapshot com a geração e as vistas de fatos, regras e inferências
+        """
+        with self.lock.read():
+            return KBSnapshot(self.generation, self.get_facts(), self.get_rules(),
+                              self.get_inferences())
+    
+    def find_inference(self, fact: str) -> Optional[Dict]:
+        """
+        Procura a primeira inferência que derivou um fato.
+        
+        Args:
+            fact: Fato derivado
+            
+        Returns:
+            Dicionário da inferência ou None
+        """
+        with self.lock.read():
+            if self.storage.indexed:
+                return self.inferences.find(fact)
+            return next((inference for inference in self.inferences
+                         if inference.get('derived_fact') == fact), None)
+    
+    def add_listener(self, listener: Callable[[str, object], None]):
+        """
+        Regista uma função chamada a cada alteração da KB. Os métodos são
+        guardados por referência fraca: o motor que os registou pode ser
+        descartado sem chamar remove_listener (deixa de ser notificado).
+        
+        Args:
+            listener: Função (evento, item) com evento 'add_fact', 'add_rule',
+                'add_inference' ou 'clear'
+        """
+        ref = weakref.WeakMethod(listener) if inspect.ismethod(listener) else listener
+        with self._listeners_lock:
+            self._listeners.append(ref)
+    
+    def remove_listener(self, listener: Callable[[str, object], None]):
+        """
+        Deixa de notificar uma função registada com add_listener.
+        
+        Args:
+            listener: A função (ou método) registada
+        """
+        with self._listeners_lock:
+            self._listeners = [ref for ref in self._listeners
+                               if self._resolve(ref) not in (None, listener)]
+    
+    @staticmethod
+    def _resolve(ref) -> Optional[Callable[[str, object], None]]:
+        """Função de um listener registado (None se o seu objeto já não existir)."""
+        return ref() if isinstance(ref, weakref.WeakMethod) else ref
+    
+    def _notify(self, event: str, item: object = None):
+        """Regista a alteração no armazenamento e notifica os listeners."""
+        self.generation += 1
+        self.storage.record(event, item)
+        dead = False
+        for ref in list(self._listeners):
+            listener = self._resolve(ref)
+            if listener is None:
+                dead = True
+            else:
+                listener(event, item)
+        if dead:
+            with self._listeners_lock:
+                self._listeners = [ref for ref in self._listeners if self._resolve(ref) is not None]
     
     def clear(self):
         """Limpa toda a base de conhecimento."""
-        self.facts = []
-        self.rules = []
-        self.inferences = []
-        self.save()
+        with self.lock.write():
+            data = self.storage.clear()
+            self.facts = data['facts']
+            self.rules = data['rules']
+            self.inferences = data['inferences']
+            self._notify('clear')
+            self.save()
     
-    def import_knowledge(self, facts: List[str], rules: List[str]):
+    def import_knowledge(self, facts: List[str], rules: List[str]) -> Dict[str, List[str]]:
         """
         Importa conhecimento (fatos e regras) para a KB.
         
         Args:
             facts: Lista de fatos
             rules: Lista de regras
+            
+        Returns:
+            Dicionário com os 'facts' e 'rules' que ainda não existiam na KB
+        """
+        return self.ingest(facts, rules)
+    
+    def export(self, path: str):
+        """
+        Exporta a KB em NDJSON, registo a registo (sem montar o documento
+        em memória); comprimido se path terminar em .gz ou .xz.
+        
+        Args:
+            path: Caminho do ficheiro (ex: kb.ndjson.gz)
         """
-        for fact in facts:
-            self.add_fact(fact)
-        for rule in rules:
-            self.add_rule(rule)
-        self.save()
+        snapshot = self.snapshot()
+        write_ndjson(path, snapshot.facts, snapshot.rules, snapshot.inferences)
     
     def to_dict(self) -> Dict:
-        """Retorna a KB como dicionário."""
+        """Retorna a KB como dicionário (de um único snapshot)."""
+        snapshot = self.snapshot()
         return {
-            'facts': self.facts,
-            'rules': self.rules,
-            'inferences': self.inferences
+            'facts': list(snapshot.facts),
+            'rules': list(snapshot.rules),
+            'inferences': list(snapshot.inferences)
         }
@@ -0,0 +1,160 @@
+"""
+Sincronização do acesso à base de conhecimento entre threads.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+
+class ReadWriteLock:
+    """
+    Lock de leitores e escritor: várias threads podem ler ao mesmo tempo;
+    uma escrita é exclusiva. Uma escrita à espera impede novas leituras
+    (os escritores não ficam à espera para sempre).
+    
+    É reentrante: a thread que escreve pode voltar a escrever ou ler, e uma
+    thread que lê pode voltar a ler. Passar de leitura a escrita não é
+    permitido (duas threads a fazê-lo bloqueariam uma à outra).
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+        # Profundidade de leitura de cada thread (para leituras reentrantes)
+        self._local = threading.local()
+    
+    def _read_depth(self) -> int:
+        return getattr(self._local, 'depth', 0)
+    
+    def writing(self) -> bool:
+        """True se a thread atual tiver o lock de escrita."""
+        return self._writer == threading.get_ident()
+    
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Bloco de leitura."""
+        me = threading.get_ident()
+        depth = self._read_depth()
+        if self._writer == me or depth:
+            # Já tem o lock: não espera (nem pelos escritores em espera)
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """
+        Bloco de escrita.
+        
+        Raises:
+            RuntimeError: Se a thread estiver a meio de uma leitura
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                if self._read_depth():
+                    raise RuntimeError("Não é possível escrever durante uma leitura")
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+            self._write_depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+class BackgroundSaver:
+    """
+    Thread que grava a KB fora dos pedidos. Os pedidos de gravação que
+    chegam durante o intervalo de espera são juntos numa única gravação.
+    """
+    
+    def __init__(self, save: Callable[[], None], delay: float = 0.5):
+        """
+        Args:
+            save: Função que grava a KB
+            delay: Segundos a esperar por mais alterações antes de gravar
+        """
+        self._save = save
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._dirty = False
+        self._stopped = False
+        # Serializa as gravações desta thread com flush()
+        self._saving = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='kb-saver', daemon=True)
+        self._thread.start()
+    
+    def request(self):
+        """Marca a KB para ser gravada (retorna logo)."""
+        with self._condition:
+            self._dirty = True
+            self._condition.notify()
+    
+    def flush(self):
+        """Grava já, se houver alterações por gravar."""
+        with self._saving:
+            with self._condition:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            self._save()
+    
+    def stop(self):
+        """Grava o que falta e termina a thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._dirty and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                # Juntar as alterações que chegarem até ao fim do intervalo
+                deadline = time.monotonic() + self.delay
+                while not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopped:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erro ao guardar KB: {e}")
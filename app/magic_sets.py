@@ -0,0 +1,186 @@
+"""
+Reescrita magic sets das regras da KB, guiada pela consulta.
+A partir do padrão de ligação da consulta (ex: mortal(Socrates) tem o
+argumento ligado, 'b'; mortal(X) tem-no livre, 'f'), cada predicado
+derivado é adornado e cada regra passa a exigir um fato magic__ com os
+valores procurados. Avaliado para a frente a partir de um único fato
+semente, o programa reescrito só deriva os fatos relevantes para a consulta.
+"""
+from typing import Dict, List, Optional, Tuple
+from app.unification import parse_predicate, is_pattern_variable
+from app.terms import parse_term, term_variables
+from app.join_plan import CompiledRule, format_atom, parse_rule
+from app.symbols import parse_fact
+
+
+MAGIC_PREFIX = 'magic__'
+
+
+def adornment(args, bound=()) -> str:
+    """
+    Calcula o adorno de uma lista de argumentos.
+    
+    Args:
+        args: Argumentos do átomo
+        bound: Variáveis já ligadas
+    
+    Returns:
+        String com 'b' (ligado) ou 'f' (livre) por argumento
+    """
+    return ''.join('b' if all(var in bound for var in _variables(arg)) else 'f' for arg in args)
+
+
+def _variables(arg: str) -> List[str]:
+    """Variáveis de um argumento (também dentro de termos compostos)."""
+    if is_pattern_variable(arg):
+        return [arg]
+    if '(' in arg:
+        return term_variables(parse_term(arg))
+    return []
+
+
+def adorned_name(name: str, adorn: str) -> str:
+    """Nome do predicado adornado, ex: mortal__b."""
+    return f"{name}__{adorn}"
+
+
+def magic_name(name: str, adorn: str) -> str:
+    """Nome do predicado magic de um predicado adornado, ex: magic__mortal__b."""
+    return f"{MAGIC_PREFIX}{name}__{adorn}"
+
+
+def _bound_args(args, adorn: str) -> List[str]:
+    return [arg for arg, mode in zip(args, adorn) if mode == 'b']
+
+
+def _format_rule(head: str, body: List[str]) -> str:
+    return f"{head} :- {', '.join(body)}"
+
+
+class MagicProgram:
+    """Programa reescrito para uma consulta."""
+    
+    def __init__(self, query: str):
+        """
+        Inicializa um programa vazio.
+        
+        Args:
+            query: Consulta que guiou a reescrita
+        """
+        self.query = query
+        self.rules: List[str] = []
+        self.seed: Optional[str] = None
+        self.answer: Optional[Tuple[str, Tuple[str, ...]]] = None
+        # Regra reescrita -> regra original (para as árvores de prova)
+        self.sources: Dict[str, str] = {}
+        # Predicado adornado -> predicado original
+        self._names: Dict[str, str] = {}
+    
+    def add_rule(self, rule: str, source: Optional[str] = None):
+        if rule in self.rules:
+            return
+        self.rules.append(rule)
+        if source is not None:
+            self.sources[rule] = source
+    
+    def is_magic(self, fact: str) -> bool:
+        """Verifica se um fato pertence a um predicado magic__."""
+        return fact.startswith(MAGIC_PREFIX)
+    
+    def restore(self, fact: str) -> str:
+        """
+        Converte um fato adornado no fato original (mortal__b(Socrates) -> mortal(Socrates)).
+        
+        Args:
+            fact: Fato do programa reescrito
+        
+        Returns:
+            Fato com o nome original do predicado
+        """
+        name, args = parse_fact(fact)
+        if name is None or name not in self._names:
+            return fact
+        return format_atom(self._names[name], args)
+
+
+def rewrite(rules: List[str], query: str) -> Optional[MagicProgram]:
+    """
+    Reescreve as regras para uma consulta (magic sets, ligações passadas da
+    esquerda para a direita).
+    
+    Args:
+        rules: Regras da KB
+        query: Consulta, ex: mortal(Socrates) ou ancestral(Ana, X)
+    
+    Returns:
+        MagicProgram ou None se a consulta for inválida ou o seu predicado
+        não for derivado por nenhuma regra (basta então consultar os fatos)
+    """
+    name, args = parse_predicate(query)
+    if name is None:
+        return None
+    
+    compiled = []
+    for rule in rules:
+        consequent, antecedents = parse_rule(rule)
+        if consequent and antecedents:
+            candidate = CompiledRule(rule, consequent, antecedents)
+            if candidate.valid:
+                compiled.append(candidate)
+    
+    derived = {(rule.head[0], len(rule.head[1])) for rule in compiled}
+    if (name, len(args)) not in derived:
+        return None
+    
+    program = MagicProgram(query)
+    query_adorn = adornment(args)
+    program.seed = format_atom(magic_name(name, query_adorn), _bound_args(args, query_adorn))
+    program.answer = (adorned_name(name, query_adorn), tuple(args))
+    
+    pending = [(name, len(args), query_adorn)]
+    seen = set(pending)
+    
+    while pending:
+        pred, arity, adorn = pending.pop(0)
+        program._names[adorned_name(pred, adorn)] = pred
+        
+        # Fatos base do predicado derivado também são respostas
+        variables = [f"X{i}" for i in range(1, arity + 1)]
+        program.add_rule(_format_rule(
+            format_atom(adorned_name(pred, adorn), variables),
+            [format_atom(magic_name(pred, adorn), _bound_args(variables, adorn)),
+             format_atom(pred, variables)]
+        ))
+        
+        for rule in compiled:
+            head_name, head_args, _ = rule.head
+            if head_name != pred or len(head_args) != arity:
+                continue
+            
+            # O fato magic restringe a cabeça aos valores procurados
+            body = [format_atom(magic_name(pred, adorn), _bound_args(head_args, adorn))]
+            bound = {var for arg in _bound_args(head_args, adorn) for var in _variables(arg)}
+            
+            for atom_name, atom_args, atom_vars in rule.body:
+                if (atom_name, len(atom_args)) in derived:
+                    atom_adorn = adornment(atom_args, bound)
+                    
+                    # Os valores ligados do subobjetivo passam a ser procurados
+                    magic_head = format_atom(magic_name(atom_name, atom_adorn),
+                                             _bound_args(atom_args, atom_adorn))
+                    if body != [magic_head]:
+                        program.add_rule(_format_rule(magic_head, body))
+                    
+                    body.append(format_atom(adorned_name(atom_name, atom_adorn), atom_args))
+                    key = (atom_name, len(atom_args), atom_adorn)
+                    if key not in seen:
+                        seen.add(key)
+                        pending.append(key)
+                else:
+                    body.append(format_atom(atom_name, atom_args))
+                bound.update(atom_vars)
+            
+            head = format_atom(adorned_name(pred, adorn), head_args)
+            program.add_rule(_format_rule(head, body), rule.rule)
+    
+    return program
@@ -0,0 +1,138 @@
+"""
+Avaliação paralela do encadeamento para frente (modo 'parallel').
+Os fatos conhecidos chegam aos processos do pool por um ficheiro só de
+acréscimo: cada processo guarda o seu índice e só lê o que foi escrito
+desde a sua última tarefa, por isso cada fato é enviado uma vez a cada
+processo. As tarefas só levam a posição atual do ficheiro e o seu
+fragmento do delta.
+"""
+import json
+import os
+import tempfile
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.fact_index import FactIndex
+from app.join_plan import CompiledRule
+
+
+class FactLog:
+    """
+    Ficheiro de fatos partilhado com o pool, espelho de uma materialização.
+    Cada linha é um fato (string JSON) ou o delta de uma ronda (lista JSON).
+    Só os predicados lidos pelas regras são copiados; os fatos de cada um
+    seguem a ordem do índice, para que as junções nos processos produzam
+    as soluções pela mesma ordem do modo sequencial.
+    """
+    
+    def __init__(self, index: FactIndex):
+        """
+        Args:
+            index: Materialização espelhada (só recebe fatos novos)
+        """
+        self.index = index
+        # (predicado, aridade) -> número de fatos já escritos
+        self._written: Dict[Tuple[str, int], int] = {}
+        fd, self.path = tempfile.mkstemp(prefix='inference-', suffix='.log')
+        self._file = os.fdopen(fd, 'wb')
+        self.size = 0
+    
+    def sync(self, predicates: Iterable[Tuple[str, int]]):
+        """
+        Escreve os fatos dos predicados que o índice tem e o ficheiro ainda não.
+        
+        Args:
+            predicates: Pares (predicado, aridade) lidos pelas regras da ronda
+        """
+        facts = []
+        for key in predicates:
+            bucket = self.index.bucket(*key)
+            written = self._written.get(key, 0)
+            if len(bucket) > written:
+                facts.extend(islice(bucket, written, None))
+                self._written[key] = len(bucket)
+        self._write(facts)
+    
+    def write_delta(self, facts: Iterable[str]):
+        """Escreve o delta da ronda (substitui o da ronda anterior)."""
+        self._write([list(facts)])
+    
+    def _write(self, items: List):
+        data = b''.join(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n'
+                        for item in items)
+        if data:
+            self._file.write(data)
+            self._file.flush()
+            self.size += len(data)
+    
+    def close(self):
+        """Fecha e apaga o ficheiro."""
+        self._file.close()
+        os.remove(self.path)
+
+
+class _LogReader:
+    """Índice de um processo do pool, lido do FactLog a partir de onde ficou."""
+    
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.offset = 0
+        self.index = FactIndex()
+        self.delta = FactIndex()
+    
+    def read(self, path: str, size: int) -> Tuple[FactIndex, FactIndex]:
+        """
+        Lê o ficheiro até size (um ficheiro novo recomeça o índice).
+        
+        Returns:
+            Tupla (fatos conhecidos, delta da ronda)
+        """
+        if path != self.path:
+            self.path, self.offset = path, 0
+            self.index, self.delta = FactIndex(), FactIndex()
+        if self.offset < size:
+            with open(path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+            self.offset = size
+            for line in data.splitlines():
+                item = json.loads(line)
+                if isinstance(item, list):
+                    self.delta = FactIndex(item)
+                else:
+                    self.index.add(item)
+        return self.index, self.delta
+
+
+# Estado de cada processo do pool: o índice lido do FactLog e as regras
+# já compiladas (cada regra é compilada uma vez por processo)
+_reader = _LogReader()
+_compiled: Dict[str, CompiledRule] = {}
+
+
+def evaluate_rule_shard(rule: str, consequent: str, antecedents: List[str],
+                        log_path: str, log_size: int, shard: List[str]) -> List[List[tuple]]:
+    """
+    Avalia uma regra sobre um fragmento do delta num processo do pool.
+    
+    Args:
+        rule: Regra original
+        consequent: Consequente da regra
+        antecedents: Lista de antecedentes
+        log_path: Caminho do FactLog
+        log_size: Bytes do FactLog escritos até esta ronda
+        shard: Fragmento contíguo do delta atribuído a esta tarefa
+    
+    Returns:
+        Por posição de antecedente, lista de tuplas (fato derivado, ligações, fatos usados)
+    """
+    index, delta = _reader.read(log_path, log_size)
+    compiled = _compiled.get(rule)
+    if compiled is None:
+        compiled = _compiled[rule] = CompiledRule(rule, consequent, antecedents)
+    shard_index = FactIndex(shard)
+    return [
+        list(compiled.instantiate_solutions(
+            compiled.evaluate_position(index, delta, position, shard_index)
+        ))
+        for position in range(len(compiled.body))
+    ]
@@ -0,0 +1,182 @@
+"""
+Armazém compacto de proveniência (justificações) dos fatos derivados.
+Guarda uma derivação por fato (ou um número limitado de alternativas),
+com identificadores inteiros e registos com __slots__. Os fatos e as
+regras são internados na tabela de símbolos da KB (KnowledgeBase.symbols),
+o mesmo espaço de ids usado pelo motor colunar.
+"""
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from app.symbols import SymbolTable, parse_fact
+
+
+class Derivation:
+    """Uma derivação: fato, regra e fatos usados, todos como ids inteiros."""
+    
+    __slots__ = ('id', 'fact', 'rule', 'used', 'bindings')
+    
+    def __init__(self, id: int, fact: int, rule: int, used: Tuple[int, ...],
+                 bindings: Tuple[Tuple[str, str], ...]):
+        self.id = id
+        self.fact = fact
+        self.rule = rule
+        self.used = used
+        self.bindings = bindings
+
+
+class ProvenanceStore:
+    """Justificações deduplicadas, indexadas por fato derivado."""
+    
+    def __init__(self, max_alternatives: int = 1, source=None,
+                 symbols: Optional[SymbolTable] = None):
+        """
+        Inicializa um armazém vazio.
+        
+        Args:
+            max_alternatives: Número máximo de derivações guardadas por fato
+            source: Inferências lidas por predicado (opcional): objeto com
+                predicates(), inferences_for(nome) e len(); as derivações
+                guardadas de um fato só são lidas quando o seu predicado é
+                registado ou consultado
+            symbols: Tabela de símbolos dos ids de fatos e regras (ex:
+                KnowledgeBase.symbols; se não especificada usa uma nova)
+        """
+        self.max_alternatives = max_alternatives
+        self.source = source
+        self._loaded: Set[Optional[str]] = set()
+        # As inferências guardadas têm os ids 1..N dados por este armazém,
+        # por isso os ids novos continuam depois delas sem as ler
+        self._next_id = len(source) + 1 if source is not None else 1
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self._by_fact: Dict[int, List[Derivation]] = {}
+    
+    def _require(self, name: Optional[str]):
+        """Lê da fonte as derivações de um predicado, na primeira vez que é usado."""
+        if name not in self._loaded:
+            self._loaded.add(name)
+            self.load(self.source.inferences_for(name))
+    
+    def _require_all(self):
+        for name in self.source.predicates():
+            self._require(name)
+    
+    def record(self, fact: str, rule: str, used_facts: List[str],
+               substitutions: Dict[str, str], id: Optional[int] = None) -> Optional[Derivation]:
+        """
+        Regista uma derivação, se for nova e houver espaço para ela.
+        
+        Args:
+            fact: Fato derivado
+            rule: Regra usada
+            used_facts: Fatos usados, pela ordem dos antecedentes
+            substitutions: Ligações das variáveis
+            id: Id a usar (ao carregar derivações já guardadas)
+            
+        Returns:
+            A derivação guardada, ou None se era repetida ou excedia o limite
+        """
+        if self.source is not None:
+            self._require(parse_fact(fact)[0])
+        intern = self.symbols.intern
+        fact_id = intern(fact)
+        rule_id = intern(rule)
+        used = tuple(intern(f) for f in used_facts)
+        
+        derivations = self._by_fact.setdefault(fact_id, [])
+        if len(derivations) >= self.max_alternatives:
+            return None
+        for existing in derivations:
+            if existing.rule == rule_id and existing.used == used:
+                return None
+        
+        if id is None:
+            id = self._next_id
+        self._next_id = max(self._next_id, id + 1)
+        
+        derivation = Derivation(id, fact_id, rule_id, used, tuple(substitutions.items()))
+        derivations.append(derivation)
+        return derivation
+    
+    def load(self, inferences: List[Dict]):
+        """
+        Carrega derivações já guardadas (ex: KnowledgeBase.inferences).
+        
+        Args:
+            inferences: Lista de dicionários de inferência
+        """
+        for inference in inferences:
+            fact = inference.get('derived_fact')
+            if not fact:
+                continue
+            stored_id = inference.get('id')
+            self.record(
+                fact,
+                inference.get('from_rule', ''),
+                inference.get('using_facts', []),
+                inference.get('substitutions', {}),
+                id=stored_id if isinstance(stored_id, int) else None
+            )
+    
+    def get(self, fact: str) -> Optional[Derivation]:
+        """Retorna a primeira derivação de um fato, ou None."""
+        derivations = self.alternatives(fact)
+        return derivations[0] if derivations else None
+    
+    def alternatives(self, fact: str) -> List[Derivation]:
+        """Retorna todas as derivações guardadas de um fato."""
+        if self.source is not None:
+            self._require(parse_fact(fact)[0])
+        fact_id = self.symbols.lookup(fact)
+        if fact_id is None:
+            return []
+        return self._by_fact.get(fact_id, [])
+    
+    def justification(self, derivation: Derivation) -> Dict:
+        """
+        Converte uma derivação no formato de justificação do motor.
+        
+        Args:
+            derivation: Derivação guardada
+            
+        Returns:
+            Dicionário com id, fact, rule, used_facts e substitutions
+        """
+        symbol = self.symbols.symbol
+        return {
+            'id': derivation.id,
+            'fact': symbol(derivation.fact),
+            'rule': symbol(derivation.rule),
+            'used_facts': [symbol(f) for f in derivation.used],
+            'substitutions': dict(derivation.bindings)
+        }
+    
+    def inference(self, derivation: Derivation) -> Dict:
+        """
+        Converte uma derivação no formato de KnowledgeBase.inferences.
+        
+        Args:
+            derivation: Derivação guardada
+            
+        Returns:
+            Dicionário com id, derived_fact, from_rule, using_facts e substitutions
+        """
+        symbol = self.symbols.symbol
+        return {
+            'id': derivation.id,
+            'derived_fact': symbol(derivation.fact),
+            'from_rule': symbol(derivation.rule),
+            'using_facts': [symbol(f) for f in derivation.used],
+            'substitutions': dict(derivation.bindings)
+        }
+    
+    def facts(self) -> Iterator[str]:
+        """Itera sobre os fatos com pelo menos uma derivação."""
+        if self.source is not None:
+            self._require_all()
+        for fact_id, derivations in self._by_fact.items():
+            if derivations:
+                yield self.symbols.symbol(fact_id)
+    
+    def __len__(self) -> int:
+        if self.source is not None:
+            self._require_all()
+        return sum(len(d) for d in self._by_fact.values())
@@ -1,14 +1,23 @@
 """
 Módulo de consultas e geração de árvores de prova.
 """
+import threading
 from typing import Dict, Optional, List
-from app.unification import parse_predicate, unify_predicates
+from app.unification import parse_predicate, unify_predicates, is_open_pattern
 from app.kb_manager import KnowledgeBase
+from app.backward_chaining import TabledProver
+from app.inference import InferenceEngine
+from app.join_plan import compile_atom, match_atom
+from app import magic_sets
+from app.fact_index import FactIndex
 
 
 class QueryEngine:
     """Motor de consultas com geração de árvores de prova."""
     
+    # Estratégias de consulta suportadas
+    STRATEGIES = ('materialized', 'backward', 'magic')
+    
     def __init__(self, kb: KnowledgeBase):
         """
         Inicializa o motor de consultas.
@@ -17,6 +26,23 @@ class QueryEngine:
             kb: Instância de KnowledgeBase
         """
         self.kb = kb
+        self._prover: Optional[TabledProver] = None
+        self._magic_engine: Optional[InferenceEngine] = None
+        # Fatos inferidos (índice e primeira inferência de cada um), criados na primeira consulta
+        self._derived: Optional[FactIndex] = None
+        self._inference_of: Dict[str, Dict] = {}
+        # Os índices e tabelas acima são preenchidos durante as consultas:
+        # uma consulta de cada vez (as leituras da KB podem ser em paralelo)
+        self._lock = threading.Lock()
+        kb.add_listener(self._on_kb_change)
+    
+    def close(self):
+        """Descarta o motor e os motores que criou: deixam de acompanhar a KB."""
+        self.kb.remove_listener(self._on_kb_change)
+        if self._prover is not None:
+            self._prover.close()
+        if self._magic_engine is not None:
+            self._magic_engine.close()
     
     def parse_query(self, query: str) -> str:
         """
@@ -30,20 +56,36 @@ class QueryEngine:
         """
         return query.strip().rstrip('?')
     
-    def query(self, query_str: str) -> Dict:
+    def query(self, query_str: str, strategy: str = 'materialized') -> Dict:
         """
         Executa uma consulta na base de conhecimento.
         
         Args:
             query_str: Query a executar
+            strategy: 'materialized' (fatos já inferidos), 'backward'
+                (prova por encadeamento para trás, sem /infer prévio) ou
+                'magic' (materialização só dos fatos relevantes à consulta)
             
         Returns:
             Dicionário com resultado e árvore de prova
         """
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Estratégia de consulta desconhecida: {strategy}")
+        
         query = self.parse_query(query_str)
         
+        with self.kb.lock.read(), self._lock:
+            return self._answer(query, strategy)
+    
+    def _answer(self, query: str, strategy: str) -> Dict:
+        """Responde a uma consulta já limpa (com os locks adquiridos)."""
+        if strategy == 'backward':
+            return self.query_backward(query)
+        if strategy == 'magic':
+            return self.query_magic(query)
+        
         # Verificar se é um fato direto
-        if query in self.kb.get_facts():
+        if query in self.prover.facts:
             return {
                 'result': 'true',
                 'query': query,
@@ -51,23 +93,13 @@ class QueryEngine:
             }
         
         # Verificar se foi inferido
-        inferences = self.kb.get_inferences()
-        for inference in inferences:
-            if inference.get('derived_fact') == query:
-                return {
-                    'result': 'true',
-                    'query': query,
-                    'proof_tree': self.build_proof_tree(query, 'inference', inference)
-                }
-        
-        # Tentar unificar com fatos existentes (para queries com variáveis)
-        all_facts = self.kb.get_facts().copy()
-        
-        # Adicionar fatos inferidos
-        for inference in inferences:
-            derived = inference.get('derived_fact')
-            if derived:
-                all_facts.append(derived)
+        inference = self.find_inference_for_fact(query)
+        if inference:
+            return {
+                'result': 'true',
+                'query': query,
+                'proof_tree': self.build_proof_tree(query, 'inference', inference)
+            }
         
         # Parse da query para verificar se tem variáveis
         query_pred = parse_predicate(query)
@@ -75,27 +107,16 @@ class QueryEngine:
         if query_pred:
             # Verificar se algum argumento é uma variável (começa com maiúscula e é uma letra só, ou é Var...)
             for arg in query_pred[1]:
-                if arg and (arg[0].isupper() and len(arg) == 1) or arg.startswith('Var'):
+                if (arg and (arg[0].isupper() and len(arg) == 1) or arg.startswith('Var')
+                        or '(' in arg and is_open_pattern(arg)):
                     query_has_variables = True
                     break
         
-        # Se a query não tem variáveis, só aceitamos match exato
-        if not query_has_variables:
-            # Query específica (ex: mortal(Maria)) - deve existir fato concreto
-            for fact in all_facts:
-                if fact == query:  # Match exato apenas
-                    inference_info = self.find_inference_for_fact(fact)
-                    proof_type = 'inference' if inference_info else 'base_fact'
-                    return {
-                        'result': 'true',
-                        'query': query,
-                        'matched_fact': fact,
-                        'substitutions': {},
-                        'proof_tree': self.build_proof_tree(fact, proof_type, inference_info)
-                    }
-        else:
-            # Query com variáveis (ex: mortal(X)) - pode unificar
-            for fact in all_facts:
+        # Sem variáveis só há match exato, e esse já foi verificado acima
+        if query_has_variables:
+            # Query com variáveis (ex: mortal(X)) - a árvore de discriminação
+            # devolve só os fatos (base e depois inferidos) que unificam
+            for fact in self.prover.facts.retrieve(query) + self.derived_index.retrieve(query):
                 subs = unify_predicates(query, fact)
                 if subs is not None:
                     # Encontrou match
@@ -116,6 +137,181 @@ class QueryEngine:
             'proof_tree': None
         }
     
+    def _on_kb_change(self, event: str, item):
+        """Mantém o índice dos fatos inferidos a par da KB."""
+        if event == 'clear':
+            self._derived = None
+            self._inference_of = {}
+        elif event == 'add_inference' and self._derived is not None:
+            self._index_inference(item)
+    
+    def _index_inference(self, inference: Dict):
+        fact = inference.get('derived_fact')
+        if fact:
+            self._derived.add(fact)
+            self._inference_of.setdefault(fact, inference)
+    
+    @property
+    def derived_index(self) -> FactIndex:
+        """Índice dos fatos inferidos, pela ordem das inferências da KB."""
+        if self._derived is None:
+            self._load_inferences()
+        return self._derived
+    
+    def _load_inferences(self):
+        self._inference_of = {}
+        if self.kb.storage.lazy:
+            # As inferências de cada predicado só são lidas quando consultadas
+            self._derived = FactIndex(source=self.kb.inferences)
+            return
+        self._derived = FactIndex()
+        for inference in self.kb.get_inferences():
+            self._index_inference(inference)
+    
+    @property
+    def prover(self) -> TabledProver:
+        """Provador por encadeamento para trás (criado na primeira utilização)."""
+        if self._prover is None:
+            self._prover = TabledProver(self.kb)
+        return self._prover
+    
+    def query_backward(self, query: str) -> Dict:
+        """
+        Responde a uma consulta por encadeamento para trás com tabelamento.
+        O custo é proporcional à prova, não ao fecho da KB.
+        
+        Args:
+            query: Query já limpa (ex: "mortal(Socrates)")
+            
+        Returns:
+            Dicionário com resultado e árvore de prova
+        """
+        answers = self.prover.solve_arguments(query)
+        if not answers:
+            return {
+                'result': 'false',
+                'query': query,
+                'proof_tree': None
+            }
+        
+        fact, args = next(iter(answers.items()))
+        substitutions = {}
+        query_atom = compile_atom(query)
+        if query_atom is not None:
+            substitutions = match_atom(query_atom, args) or {}
+        
+        return {
+            'result': 'true',
+            'query': query,
+            'matched_fact': fact,
+            'substitutions': substitutions,
+            'proof_tree': self.build_backward_proof_tree(fact)
+        }
+    
+    def query_magic(self, query: str) -> Dict:
+        """
+        Responde a uma consulta materializando só os fatos de que ela depende:
+        as regras são reescritas por magic sets para o padrão de ligação da
+        consulta e avaliadas para a frente a partir de um fato semente.
+        Os fatos derivados não são guardados na KB.
+        
+        Args:
+            query: Query já limpa (ex: "mortal(Socrates)")
+            
+        Returns:
+            Dicionário com resultado e árvore de prova
+        """
+        query_atom = compile_atom(query)
+        program = magic_sets.rewrite(self.kb.get_rules(), query)
+        
+        if query_atom is None or program is None:
+            # Predicado sem regras: só os fatos base podem responder
+            answers = self.prover.facts.candidates(query) if query_atom else []
+            fact = next((f for f in answers
+                         if match_atom(query_atom, self.prover.facts.arguments(f)) is not None), None)
+            if fact is None:
+                return {'result': 'false', 'query': query, 'proof_tree': None}
+            return {
+                'result': 'true',
+                'query': query,
+                'matched_fact': fact,
+                'substitutions': match_atom(query_atom, self.prover.facts.arguments(fact)),
+                'proof_tree': self.build_proof_tree(fact, 'base_fact')
+            }
+        
+        if self._magic_engine is None:
+            self._magic_engine = InferenceEngine(self.kb, mode='semi_naive', provenance=False)
+        known, store = self._magic_engine.evaluate_program(program.rules, [program.seed],
+                                                           base=self.prover.facts)
+        
+        name, args = program.answer
+        for adorned in known.candidates_for(name, args):
+            substitutions = match_atom(query_atom, known.arguments(adorned))
+            if substitutions is not None:
+                return {
+                    'result': 'true',
+                    'query': query,
+                    'matched_fact': program.restore(adorned),
+                    'substitutions': substitutions,
+                    'proof_tree': self.build_magic_proof_tree(adorned, program, store)
+                }
+        
+        return {'result': 'false', 'query': query, 'proof_tree': None}
+    
+    def build_magic_proof_tree(self, fact: str, program, store) -> Dict:
+        """
+        Constrói a árvore de prova de um fato derivado pelo programa magic sets,
+        com os nomes e as regras originais (os fatos magic__ são omitidos).
+        
+        Args:
+            fact: Fato do programa reescrito
+            program: MagicProgram usado na avaliação
+            store: ProvenanceStore devolvido pela avaliação
+            
+        Returns:
+            Árvore de prova como dicionário
+        """
+        derivation = store.get(fact)
+        justification = store.justification(derivation) if derivation else None
+        source = program.sources.get(justification['rule']) if justification else None
+        if source is None:
+            # Fato base (diretamente ou pela regra de ligação aos fatos base)
+            return self.build_proof_tree(program.restore(fact), 'base_fact')
+        
+        return {
+            'fact': program.restore(fact),
+            'type': 'inference',
+            'rule': source,
+            'substitutions': justification['substitutions'],
+            'children': [self.build_magic_proof_tree(used, program, store)
+                         for used in justification['used_facts'] if not program.is_magic(used)],
+            'explanation': f'Derivado pela regra: {source}'
+        }
+    
+    def build_backward_proof_tree(self, fact: str) -> Dict:
+        """
+        Constrói a árvore de prova de um fato provado por encadeamento para trás.
+        
+        Args:
+            fact: Fato provado
+            
+        Returns:
+            Árvore de prova como dicionário
+        """
+        proof = self.prover.proof(fact)
+        if proof is None:
+            return self.build_proof_tree(fact, 'base_fact')
+        
+        rule, substitutions, used_facts = proof
+        return {
+            'fact': fact,
+            'type': 'inference',
+            'rule': rule.rule,
+            'substitutions': substitutions,
+            'children': [self.build_backward_proof_tree(used) for used in used_facts],
+            'explanation': f'Derivado pela regra: {rule.rule}'
+        }
+    
     def find_inference_for_fact(self, fact: str) -> Optional[Dict]:
         """
         Encontra a inferência que gerou um fato.
@@ -126,10 +322,12 @@ class QueryEngine:
         Returns:
             Dicionário de inferência ou None
         """
-        for inference in self.kb.get_inferences():
-            if inference.get('derived_fact') == fact:
-                return inference
-        return None
+        if self.kb.storage.indexed:
+            # Consulta indexada, sem carregar as inferências para memória
+            return self.kb.find_inference(fact)
+        if self._derived is None:
+            self._load_inferences()
+        return self._inference_of.get(fact)
     
     def build_proof_tree(self, fact: str, proof_type: str, 
                          inference: Optional[Dict] = None) -> Dict:
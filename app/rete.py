@@ -0,0 +1,234 @@
+"""
+Rede Rete para inferência incremental.
+As regras são compiladas uma vez numa rede de discriminação com memórias
+alfa (uma por padrão de predicado) e memórias beta (junções parciais).
+Cada fato novo percorre apenas os nós que o podem afetar.
+"""
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from app.fact_index import FactIndex
+from app.join_plan import Atom, CompiledRule, match_atom
+
+
+# Um token de uma memória beta: (ligações, fatos usados por ordem de junção)
+Token = Tuple[Dict[str, str], Tuple[str, ...]]
+
+
+class AlphaMemory:
+    """Memória alfa: fatos que emparelham com um padrão de predicado."""
+    
+    def __init__(self, atom: Atom):
+        self.atom = atom
+        self.items: List[Tuple[str, Dict[str, str]]] = []
+        self.successors: List['JoinNode'] = []
+    
+    def activate(self, fact: str, bindings: Dict[str, str]):
+        """Guarda um fato e propaga-o aos nós de junção."""
+        self.items.append((fact, bindings))
+        for node in self.successors:
+            node.right_activate(fact, bindings)
+
+
+class BetaMemory:
+    """Memória beta: junções parciais, indexadas pelas variáveis do nó seguinte."""
+    
+    def __init__(self, keys: Tuple[str, ...] = ()):
+        self.keys = keys
+        self.tokens: Dict[tuple, List[Token]] = {}
+        self.child = None
+    
+    def activate(self, token: Token):
+        """Guarda um token e propaga-o ao nó filho."""
+        key = tuple(token[0][v] for v in self.keys)
+        self.tokens.setdefault(key, []).append(token)
+        if self.child is not None:
+            self.child.left_activate(token)
+    
+    def lookup(self, key: tuple) -> List[Token]:
+        """Retorna os tokens com uma dada chave de junção."""
+        return self.tokens.get(key, [])
+
+
+class JoinNode:
+    """Nó de junção entre uma memória beta e uma memória alfa."""
+    
+    def __init__(self, parent: BetaMemory, alpha: AlphaMemory, keys: Tuple[str, ...]):
+        self.parent = parent
+        self.alpha = alpha
+        self.keys = keys
+        self.right: Dict[tuple, List[Tuple[str, Dict[str, str]]]] = {}
+        self.child = None
+    
+    def prime(self):
+        """Preenche o índice direito com os fatos já presentes na memória alfa."""
+        for fact, bindings in self.alpha.items:
+            key = tuple(bindings[v] for v in self.keys)
+            self.right.setdefault(key, []).append((fact, bindings))
+    
+    def right_activate(self, fact: str, bindings: Dict[str, str]):
+        """Um fato novo na memória alfa: juntar com os tokens da memória beta."""
+        key = tuple(bindings[v] for v in self.keys)
+        self.right.setdefault(key, []).append((fact, bindings))
+        for token in list(self.parent.lookup(key)):
+            self._emit(token, fact, bindings)
+    
+    def left_activate(self, token: Token):
+        """Um token novo na memória beta: juntar com os fatos da memória alfa."""
+        key = tuple(token[0][v] for v in self.keys)
+        for fact, bindings in list(self.right.get(key, [])):
+            self._emit(token, fact, bindings)
+    
+    def _emit(self, token: Token, fact: str, bindings: Dict[str, str]):
+        merged = dict(token[0])
+        merged.update(bindings)
+        self.child.activate((merged, token[1] + (fact,)))
+
+
+class ProductionNode:
+    """Nó terminal: uma regra cujos antecedentes foram todos satisfeitos."""
+    
+    def __init__(self, network: 'ReteNetwork', rule: CompiledRule, order: List[int]):
+        self.network = network
+        self.rule = rule
+        self.order = order
+    
+    def left_activate(self, token: Token):
+        # Repor os fatos usados pela ordem original dos antecedentes
+        used = [None] * len(self.order)
+        for position, fact in zip(self.order, token[1]):
+            used[position] = fact
+        self.network.fire(self.rule, token[0], used)
+
+
+class ReteNetwork:
+    """Rede Rete com memórias alfa partilhadas entre regras."""
+    
+    def __init__(self, on_match: Callable[[CompiledRule, str, Dict[str, str], List[str]], bool]):
+        """
+        Inicializa uma rede vazia.
+        
+        Args:
+            on_match: Chamada para cada disparo de regra com
+                (regra, fato derivado, ligações, fatos usados); se devolver
+                False o fato derivado é descartado
+        """
+        self.on_match = on_match
+        self.facts = FactIndex()
+        self.derived: set = set()
+        self.rules: Dict[str, CompiledRule] = {}
+        self._alpha: Dict[tuple, AlphaMemory] = {}
+        self._alpha_by_predicate: Dict[Tuple[str, int], List[AlphaMemory]] = {}
+        self._queue: deque = deque()
+        self._pending: set = set()
+        self._running = False
+    
+    def _alpha_memory(self, atom: Atom) -> AlphaMemory:
+        """Obtém (ou cria e preenche) a memória alfa de um padrão."""
+        name, args, _ = atom
+        key = (name, args)
+        memory = self._alpha.get(key)
+        if memory is None:
+            memory = AlphaMemory(atom)
+            self._alpha[key] = memory
+            self._alpha_by_predicate.setdefault((name, len(args)), []).append(memory)
+            for fact in self.facts.bucket(name, len(args)):
+                bindings = match_atom(atom, self.facts.arguments(fact))
+                if bindings is not None:
+                    memory.items.append((fact, bindings))
+        return memory
+    
+    def add_rule(self, rule: CompiledRule):
+        """
+        Compila uma regra na rede e dispara-a sobre os fatos já conhecidos.
+        
+        Args:
+            rule: Regra compilada
+        """
+        if not rule.valid or rule.rule in self.rules:
+            return
+        self.rules[rule.rule] = rule
+        
+        order = rule.plan(self.facts)
+        top = BetaMemory()
+        memory = top
+        bound = set()
+        joins = []
+        
+        for position in order:
+            atom = rule.body[position]
+            keys = tuple(v for v in atom[2] if v in bound)
+            alpha = self._alpha_memory(atom)
+            join = JoinNode(memory, alpha, keys)
+            memory.keys = keys
+            memory.child = join
+            alpha.successors.append(join)
+            joins.append(join)
+            bound.update(atom[2])
+            
+            memory = BetaMemory()
+            join.child = memory
+        
+        memory.child = ProductionNode(self, rule, order)
+        
+        # Preencher os nós novos e propagar a partir do token vazio
+        for join in joins:
+            join.prime()
+        self._run(lambda: top.activate(({}, ())))
+    
+    def add_fact(self, fact: str):
+        """
+        Introduz um fato na rede; só as memórias alfa do seu predicado são visitadas.
+        
+        Args:
+            fact: Fato a adicionar
+        """
+        self._enqueue(fact)
+        self._run(None)
+    
+    def fire(self, rule: CompiledRule, bindings: Dict[str, str], used: List[str]):
+        """Chamado por um nó terminal quando uma regra fica satisfeita."""
+        new_fact = rule.instantiate(bindings)
+        if new_fact is None or not self.on_match(rule, new_fact, bindings, used):
+            return
+        if new_fact not in self.facts and new_fact not in self._pending:
+            self.derived.add(new_fact)
+            self._enqueue(new_fact)
+    
+    def _enqueue(self, fact: str):
+        if fact not in self._pending:
+            self._pending.add(fact)
+            self._queue.append(fact)
+    
+    def _run(self, action: Optional[Callable[[], None]]):
+        """
+        Executa uma ação e esvazia a fila de fatos.
+        Os fatos derivados são propagados pela fila, sem recursão profunda.
+        """
+        if self._running:
+            if action is not None:
+                action()
+            return
+        
+        self._running = True
+        try:
+            if action is not None:
+                action()
+            while self._queue:
+                fact = self._queue.popleft()
+                self._pending.discard(fact)
+                self._propagate(fact)
+        finally:
+            self._running = False
+    
+    def _propagate(self, fact: str):
+        """Envia um fato às memórias alfa do seu predicado."""
+        if not self.facts.add(fact):
+            return
+        signature = self.facts.predicate(fact)
+        if signature is None:
+            return
+        args = self.facts.arguments(fact)
+        for memory in self._alpha_by_predicate.get(signature, []):
+            bindings = match_atom(memory.atom, args)
+            if bindings is not None:
+                memory.activate(fact, bindings)
@@ -0,0 +1,1239 @@
+"""
+Armazenamento em disco da base de conhecimento.
+JsonStorage reescreve o ficheiro JSON inteiro a cada gravação (formato
+original). LogStorage mantém o mesmo JSON como snapshot e acrescenta as
+alterações a um registo (write-ahead log, um registo JSON por linha):
+gravar custa só as alterações desde a última gravação, com um único
+fsync por lote, e o snapshot é reescrito (compactação) quando o registo
+fica grande. Ao carregar, o snapshot é lido e o registo é reaplicado.
+BinaryLogStorage usa como snapshot o formato binário de
+app.binary_snapshot, aberto com mmap em vez de ser lido.
+SqliteStorage guarda tudo num ficheiro SQLite com índices: a KB deixa de
+ser carregada para memória e as suas listas passam a ser vistas sobre
+as tabelas. ShardedStorage divide fatos e inferências por predicado em
+vários ficheiros e só lê os de um predicado quando este é usado.
+NdjsonStorage guarda um registo JSON por linha (opcionalmente comprimido
+com gzip ou lzma), lido e escrito registo a registo.
+"""
+import gzip
+import io
+import json
+import lzma
+import os
+import sqlite3
+import threading
+import zlib
+from collections.abc import Sequence
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from app.symbols import parse_fact
+from app.binary_snapshot import MappedColumn, MappedSnapshot, write_snapshot
+
+
+class SnapshotView(Sequence):
+    """
+    Vista só de leitura dos primeiros itens de uma lista só de acréscimo.
+    Não copia a lista: como os escritores só acrescentam (e um clear cria
+    listas novas), o prefixo visto nunca muda depois de a vista ser criada.
+    """
+    
+    __slots__ = ('_items', '_length', '_index')
+    
+    def __init__(self, items: list, length: int, index: Optional[Dict] = None):
+        """
+        Args:
+            items: Lista partilhada com o escritor
+            length: Número de itens visíveis
+            index: Item -> posição (opcional, para pertença O(1))
+        """
+        self._items = items
+        self._length = length
+        self._index = index
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self._items[i] for i in range(*position.indices(self._length))]
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("índice fora da vista")
+        return self._items[position]
+    
+    def __iter__(self) -> Iterator:
+        return islice(self._items, self._length)
+    
+    def __contains__(self, item) -> bool:
+        if self._index is not None:
+            return self._index.get(item, self._length) < self._length
+        return any(existing == item for existing in self)
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, tuple, SnapshotView)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+    
+    def __repr__(self) -> str:
+        return f"SnapshotView({list(self)!r})"
+
+
+def snapshot_view(items):
+    """
+    Retorna uma vista estável de um contentor da KB.
+    
+    Args:
+        items: OrderedSet, MappedColumn, lista, contentor dividido por
+            predicado ou tabela SQLite
+    
+    Returns:
+        SnapshotView, ShardedView ou SqliteView
+    """
+    if isinstance(items, (OrderedSet, ShardedFacts, ShardedInferences, SqliteColumn)):
+        return items.view()
+    if isinstance(items, MappedColumn):
+        return SnapshotView(items, len(items), items if items.indexed else None)
+    if isinstance(items, list):
+        return SnapshotView(items, len(items))
+    return items.copy()
+
+
+class OrderedSet:
+    """
+    Conjunto com ordem de inserção e interface de lista só de acréscimo
+    (append, iteração, len, copy): a pertença é O(1) em vez de percorrer
+    a lista.
+    """
+    
+    __slots__ = ('_items', '_index')
+    
+    def __init__(self, items: Iterable = ()):
+        self._items: list = []
+        self._index: Dict[object, int] = {}
+        for item in items:
+            self.append(item)
+    
+    def append(self, item) -> bool:
+        """
+        Acrescenta um item se ainda não existir.
+        
+        Returns:
+            True se o item era novo
+        """
+        if item in self._index:
+            return False
+        self._index[item] = len(self._items)
+        self._items.append(item)
+        return True
+    
+    def __contains__(self, item) -> bool:
+        return item in self._index
+    
+    def __iter__(self) -> Iterator:
+        return iter(self._items)
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def copy(self) -> list:
+        """Cópia dos itens, pela ordem de inserção."""
+        return self._items.copy()
+    
+    def view(self, length: Optional[int] = None) -> SnapshotView:
+        """
+        Vista dos itens atuais, sem cópia.
+        
+        Args:
+            length: Número de itens visíveis (por omissão, todos)
+        """
+        return SnapshotView(self._items, len(self._items) if length is None else length,
+                            self._index)
+
+
+def read_json(path: str) -> Dict:
+    """
+    Lê uma KB em JSON.
+    
+    Args:
+        path: Caminho do ficheiro
+    
+    Returns:
+        Dicionário com 'facts' e 'rules' (OrderedSet) e 'inferences' (lista),
+        vazios se o ficheiro não existir
+    """
+    return _kb_data(_read_raw(path))
+
+
+def _read_raw(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _kb_data(data: Dict) -> Dict:
+    return {
+        'facts': OrderedSet(data.get('facts', [])),
+        'rules': OrderedSet(data.get('rules', [])),
+        'inferences': data.get('inferences', [])
+    }
+
+
+def write_json(path: str, data: Dict):
+    """
+    Escreve uma KB em JSON.
+    O ficheiro é escrito ao lado com outro nome e trocado de uma vez
+    (os.replace): uma falha a meio deixa o ficheiro anterior intacto.
+    
+    Args:
+        path: Caminho do ficheiro
+        data: Dicionário com 'facts', 'rules' e 'inferences'
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _empty() -> Dict:
+    return {'facts': OrderedSet(), 'rules': OrderedSet(), 'inferences': []}
+
+
+class JsonStorage:
+    """Ficheiro JSON reescrito por inteiro em cada gravação."""
+    
+    # Os dados vivem em listas em memória (sem consultas indexadas)
+    indexed = False
+    # A KB é lida por inteiro ao carregar (ver ShardedStorage)
+    lazy = False
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def load(self) -> Dict:
+        """Lê a KB guardada."""
+        return read_json(self.path)
+    
+    def clear(self) -> Dict:
+        """Retorna contentores vazios para a KB."""
+        return _empty()
+    
+    def record(self, event: str, item: object = None):
+        """Alterações não são registadas: save escreve o estado inteiro."""
+    
+    def save(self, kb):
+        """Escreve o estado inteiro da KB."""
+        write_json(self.path, kb.to_dict())
+
+
+class LogStorage:
+    """Snapshot JSON mais registo de alterações só de acréscimo."""
+    
+    # Compactar quando o registo tiver mais registos que isto e que o snapshot
+    MIN_COMPACT_RECORDS = 1000
+    # Registos em memória a partir dos quais se escreve sem esperar por save
+    MAX_PENDING = 1000
+    
+    EVENTS = ('add_fact', 'add_rule', 'add_inference', 'clear')
+    
+    indexed = False
+    lazy = False
+    # Se True, só compacta com o lock de escrita da KB (a compactação troca
+    # ficheiros que as leituras estão a usar; ver KnowledgeBase._write)
+    exclusive_compaction = False
+    
+    def __init__(self, path: str):
+        """
+        Inicializa o armazenamento.
+        
+        Args:
+            path: Caminho do snapshot JSON; o registo fica em path + '.wal'
+        """
+        self.path = path
+        self.log_path = path + '.wal'
+        self._pending: List[str] = []
+        # Número de sequência do último registo (o snapshot guarda o último
+        # que já inclui, para uma compactação interrompida não o repetir)
+        self._seq = 0
+        # Registos no ficheiro de registo e tamanho do estado no snapshot
+        self._logged = 0
+        self._snapshot_size = 0
+    
+    def load(self) -> Dict:
+        """
+        Lê o snapshot e reaplica o registo.
+        Uma última linha incompleta (gravação interrompida) é ignorada e
+        cortada do ficheiro.
+        
+        Returns:
+            Dicionário com 'facts', 'rules' e 'inferences'
+        """
+        data, self._seq = self._read_snapshot()
+        self._snapshot_size = sum(len(items) for items in data.values())
+        self._pending = []
+        self._logged = 0
+        
+        if os.path.exists(self.log_path):
+            facts = data['facts']
+            rules = data['rules']
+            inferences = data['inferences']
+            # Fim do último registo completo: o que vier depois é cortado,
+            # para os próximos registos não ficarem colados a uma linha partida
+            valid_end = 0
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_end += len(line)
+                    self._logged += 1
+                    if entry.get('seq', 0) <= self._seq:
+                        continue
+                    self._seq = entry['seq']
+                    event, item = entry.get('event'), entry.get('item')
+                    if event == 'add_fact':
+                        facts.append(item)
+                    elif event == 'add_rule':
+                        rules.append(item)
+                    elif event == 'add_inference':
+                        inferences.append(item)
+                    elif event == 'clear':
+                        facts, rules, inferences = OrderedSet(), OrderedSet(), []
+            if valid_end < os.path.getsize(self.log_path):
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(valid_end)
+                    f.flush()
+                    os.fsync(f.fileno())
+            data = {'facts': facts, 'rules': rules, 'inferences': inferences}
+        
+        return data
+    
+    def clear(self) -> Dict:
+        """Retorna contentores vazios para a KB (o clear fica no registo)."""
+        return _empty()
+    
+    def record(self, event: str, item: object = None):
+        """
+        Acrescenta uma alteração ao lote em memória.
+        
+        Args:
+            event: 'add_fact', 'add_rule', 'add_inference' ou 'clear'
+            item: Fato, regra ou inferência
+        """
+        if event not in self.EVENTS:
+            return
+        self._seq += 1
+        entry = {'seq': self._seq, 'event': event, 'item': item}
+        self._pending.append(json.dumps(entry, ensure_ascii=False))
+        if len(self._pending) >= self.MAX_PENDING:
+            self.flush()
+    
+    def flush(self):
+        """Escreve o lote pendente no registo, com um único fsync."""
+        if not self._pending:
+            return
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(self._pending) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._logged += len(self._pending)
+        self._pending = []
+    
+    def save(self, kb):
+        """
+        Grava as alterações pendentes e compacta se o registo for grande.
+        
+        Args:
+            kb: KnowledgeBase (o estado inteiro só é lido na compactação)
+        """
+        self.flush()
+        if self.compaction_due() and (kb.lock.writing() or not self.exclusive_compaction):
+            self.compact(kb.to_dict())
+    
+    def compaction_due(self) -> bool:
+        """True se o registo (com o lote pendente) já justifica compactar."""
+        return self._logged + len(self._pending) > max(self.MIN_COMPACT_RECORDS, self._snapshot_size)
+    
+    def compact(self, data: Dict):
+        """
+        Escreve um snapshot novo e esvazia o registo.
+        O snapshot é escrito num ficheiro temporário e trocado de uma vez;
+        se a falha for depois da troca, os registos que o snapshot já
+        inclui são saltados ao carregar (pelo número de sequência).
+        
+        Args:
+            data: Estado atual da KB
+        """
+        self._pending = []
+        temp_path = self.path + '.tmp'
+        self._write_snapshot(temp_path, data)
+        self._replace_snapshot(temp_path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._logged = 0
+        self._snapshot_size = sum(len(items) for items in data.values())
+    
+    def _read_snapshot(self) -> Tuple[Dict, int]:
+        """Lê o snapshot: (contentores da KB, sequência do último registo incluído)."""
+        raw = _read_raw(self.path)
+        return _kb_data(raw), raw.get('wal_seq', 0)
+    
+    def _replace_snapshot(self, temp_path: str):
+        """Troca o snapshot pelo ficheiro temporário já escrito."""
+        os.replace(temp_path, self.path)
+    
+    def _write_snapshot(self, path: str, data: Dict):
+        """Escreve o snapshot (em JSON, o formato de JsonStorage)."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**data, 'wal_seq': self._seq}, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BinaryLogStorage(LogStorage):
+    """
+    Como LogStorage, mas com o snapshot no formato binário de
+    app.binary_snapshot: abrir a KB mapeia o ficheiro (mmap) em vez de o
+    ler e os itens só são materializados quando são acedidos.
+    Ao compactar, o mapeamento antigo é fechado antes da troca (no Windows
+    não se pode substituir um ficheiro mapeado) e as colunas da KB passam a
+    ler o snapshot novo, por isso só compacta com o lock de escrita da KB.
+    """
+    
+    exclusive_compaction = True
+    
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._snapshot: Optional[MappedSnapshot] = None
+        # Colunas do snapshot que a KB está a usar (deixam de o ser num clear)
+        self._columns: Dict[str, MappedColumn] = {}
+    
+    def load(self) -> Dict:
+        data = super().load()
+        # Um clear no registo substitui as colunas por contentores em memória
+        self._columns = {key: column for key, column in self._columns.items()
+                         if data[key] is column}
+        return data
+    
+    def clear(self) -> Dict:
+        self._columns = {}
+        return super().clear()
+    
+    def _read_snapshot(self) -> Tuple[Dict, int]:
+        self._snapshot, self._columns = None, {}
+        if not os.path.exists(self.path):
+            return _empty(), 0
+        self._snapshot = MappedSnapshot(self.path)
+        self._columns = self._snapshot.columns()
+        return dict(self._columns), self._snapshot.seq
+    
+    def _replace_snapshot(self, temp_path: str):
+        if self._snapshot is not None:
+            self._snapshot.close()
+        try:
+            os.replace(temp_path, self.path)
+        finally:
+            # Mapear o snapshot novo (ou de novo o antigo, se a troca falhou)
+            self._snapshot = MappedSnapshot(self.path)
+            for key, column in self._snapshot.columns().items():
+                if key in self._columns:
+                    self._columns[key].remap(column)
+    
+    def _write_snapshot(self, path: str, data: Dict):
+        write_snapshot(path, data, self._seq)
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+
+
+
+# Linhas lidas de cada vez ao percorrer uma tabela SQLite
+SQLITE_PAGE = 500
+
+
+class SqliteColumn:
+    """
+    Vista de uma tabela SQLite como lista só de acréscimo.
+    A pertença é uma consulta indexada e a iteração lê a tabela em
+    páginas, por isso os itens nunca são todos carregados para memória.
+    A ligação é partilhada entre threads: cada consulta é feita com o
+    lock da ligação e nenhum cursor fica aberto entre páginas.
+    """
+    
+    def __init__(self, conn: sqlite3.Connection, table: str, column: str,
+                 lock: threading.RLock):
+        self._conn = conn
+        self._table = table
+        self._column = column
+        self._lock = lock
+    
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        """Executa uma consulta com o lock da ligação e retorna todas as linhas."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    def _paged(self, sql: str, params: tuple = ()) -> Iterator:
+        """
+        Valores de uma consulta lidos em páginas pela ordem do id.
+        
+        Args:
+            sql: Consulta que seleciona (id, valor) da tabela, terminada
+                numa condição WHERE (a que se junta o id da página)
+            params: Parâmetros da consulta
+        
+        Yields:
+            Valores pela ordem de inserção
+        """
+        last = 0
+        while True:
+            rows = self._execute(
+                f"{sql} AND {self._table}.id > ? ORDER BY {self._table}.id LIMIT {SQLITE_PAGE}",
+                params + (last,)
+            )
+            for _, value in rows:
+                yield value
+            if len(rows) < SQLITE_PAGE:
+                return
+            last = rows[-1][0]
+    
+    @staticmethod
+    def _upto(upto: Optional[int]) -> Tuple[str, tuple]:
+        """Condição das linhas visíveis (todas, ou até ao id upto)."""
+        return ("id <= ?", (upto,)) if upto is not None else ("1", ())
+    
+    def values(self, upto: Optional[int] = None) -> Iterator:
+        """Itens pela ordem de inserção (até ao id upto, se indicado)."""
+        where, params = self._upto(upto)
+        return self._paged(f"SELECT id, {self._column} FROM {self._table} WHERE {where}", params)
+    
+    def count(self, upto: Optional[int] = None) -> int:
+        """Número de itens (até ao id upto, se indicado)."""
+        where, params = self._upto(upto)
+        return self._execute(f"SELECT COUNT(*) FROM {self._table} WHERE {where}", params)[0][0]
+    
+    def contains(self, value, upto: Optional[int] = None) -> bool:
+        """Verifica se um item existe (até ao id upto, se indicado)."""
+        where, params = self._upto(upto)
+        return bool(self._execute(
+            f"SELECT 1 FROM {self._table} WHERE {self._column} = ? AND {where} LIMIT 1",
+            (value,) + params
+        ))
+    
+    def __iter__(self) -> Iterator:
+        return self.values()
+    
+    def __len__(self) -> int:
+        return self.count()
+    
+    def __contains__(self, value) -> bool:
+        return self.contains(value)
+    
+    def append(self, value) -> bool:
+        """Insere um item no fim; retorna True se era novo."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self._table} ({self._column}) VALUES (?)", (value,)
+            )
+            return cursor.rowcount > 0
+    
+    def view(self) -> 'SqliteView':
+        """Vista dos itens atuais (relida em cada iteração, sem cópia)."""
+        last = self._execute(f"SELECT COALESCE(MAX(id), 0) FROM {self._table}")[0][0]
+        return SqliteView(self, last)
+    
+    def copy(self) -> 'SqliteView':
+        """Vista dos itens atuais (não é uma cópia em memória)."""
+        return self.view()
+
+
+class SqliteView:
+    """
+    Vista só de leitura das linhas de uma tabela SQLite até um id. Cada
+    iteração faz as suas próprias consultas, por isso pode ser percorrida
+    várias vezes; as linhas acrescentadas depois da vista não são vistas.
+    """
+    
+    __slots__ = ('_column', '_last')
+    
+    def __init__(self, column: SqliteColumn, last: int):
+        """
+        Args:
+            column: Tabela vista
+            last: Último id visível
+        """
+        self._column = column
+        self._last = last
+    
+    def __iter__(self) -> Iterator:
+        return self._column.values(self._last)
+    
+    def __len__(self) -> int:
+        return self._column.count(self._last)
+    
+    def __contains__(self, item) -> bool:
+        return self._column.contains(item, self._last)
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, tuple, SnapshotView, SqliteView)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+    
+    def __repr__(self) -> str:
+        return f"SqliteView({list(self)!r})"
+
+
+class SqliteFacts(SqliteColumn):
+    """Fatos com o predicado e cada argumento indexados."""
+    
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        super().__init__(conn, 'facts', 'fact', lock)
+    
+    def append(self, fact: str) -> bool:
+        """Insere um fato e os seus argumentos; retorna True se era novo."""
+        name, args = parse_fact(fact)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO facts (fact, predicate, arity) VALUES (?, ?, ?)",
+                (fact, name, len(args))
+            )
+            if cursor.rowcount:
+                self._conn.executemany(
+                    "INSERT INTO fact_args (fact_id, position, value) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, position, arg) for position, arg in enumerate(args)]
+                )
+            return cursor.rowcount > 0
+    
+    def matching(self, name: str, constants: Dict[int, str]) -> Iterator[str]:
+        """
+        Fatos de um predicado com constantes em certas posições.
+        
+        Args:
+            name: Nome do predicado
+            constants: Posição -> valor do argumento
+        
+        Yields:
+            Fatos pela ordem de inserção
+        """
+        sql = "SELECT id, fact FROM facts WHERE predicate = ?"
+        params: tuple = (name,)
+        for position, value in constants.items():
+            sql += (" AND EXISTS (SELECT 1 FROM fact_args a WHERE a.fact_id = facts.id"
+                    " AND a.position = ? AND a.value = ?)")
+            params += (position, value)
+        return self._paged(sql, params)
+
+
+class SqliteInferences(SqliteColumn):
+    """Inferências guardadas em JSON, indexadas pelo fato derivado."""
+    
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        super().__init__(conn, 'inferences', 'data', lock)
+    
+    def values(self, upto: Optional[int] = None) -> Iterator[Dict]:
+        for data in super().values(upto):
+            yield json.loads(data)
+    
+    def contains(self, inference, upto: Optional[int] = None) -> bool:
+        return any(item == inference
+                   for item in self.find_all(inference.get('derived_fact'), upto))
+    
+    def append(self, inference: Dict) -> bool:
+        """Insere uma inferência."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO inferences (derived_fact, data) VALUES (?, ?)",
+                (inference.get('derived_fact'), json.dumps(inference, ensure_ascii=False))
+            )
+        return True
+    
+    def find_all(self, fact: str, upto: Optional[int] = None) -> Iterator[Dict]:
+        """Inferências de um fato derivado (até ao id upto, se indicado)."""
+        where, params = self._upto(upto)
+        for data in self._paged(f"SELECT id, data FROM inferences WHERE derived_fact = ? AND {where}",
+                                (fact,) + params):
+            yield json.loads(data)
+    
+    def find(self, fact: str) -> Optional[Dict]:
+        """Primeira inferência de um fato derivado (ou None)."""
+        return next(self.find_all(fact), None)
+
+
+class SqliteStorage:
+    """KB guardada num ficheiro SQLite, consultada sem a carregar para memória."""
+    
+    indexed = True
+    lazy = False
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS facts (
+            id INTEGER PRIMARY KEY, fact TEXT UNIQUE NOT NULL,
+            predicate TEXT, arity INTEGER);
+        CREATE INDEX IF NOT EXISTS idx_facts_predicate ON facts (predicate, arity);
+        CREATE TABLE IF NOT EXISTS fact_args (
+            fact_id INTEGER NOT NULL, position INTEGER NOT NULL, value TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_fact_args_value ON fact_args (value, position);
+        CREATE INDEX IF NOT EXISTS idx_fact_args_fact ON fact_args (fact_id);
+        CREATE TABLE IF NOT EXISTS rules (
+            id INTEGER PRIMARY KEY, rule TEXT UNIQUE NOT NULL);
+        CREATE TABLE IF NOT EXISTS inferences (
+            id INTEGER PRIMARY KEY, derived_fact TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_inferences_fact ON inferences (derived_fact);
+    """
+    
+    def __init__(self, path: str):
+        """
+        Abre (ou cria) a base de dados.
+        
+        Args:
+            path: Caminho do ficheiro SQLite
+        """
+        self.path = path
+        # O servidor Flask usa várias threads com a mesma KB: a ligação é
+        # partilhada e cada acesso a ela é feito com este lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        with self.lock:
+            self.conn.executescript(self.SCHEMA)
+    
+    def load(self) -> Dict:
+        """Retorna vistas sobre as tabelas (nada é lido para memória)."""
+        return {
+            'facts': SqliteFacts(self.conn, self.lock),
+            'rules': SqliteColumn(self.conn, 'rules', 'rule', self.lock),
+            'inferences': SqliteInferences(self.conn, self.lock)
+        }
+    
+    def clear(self) -> Dict:
+        """Apaga todas as linhas e retorna as vistas (agora vazias)."""
+        with self.lock:
+            for table in ('facts', 'fact_args', 'rules', 'inferences'):
+                self.conn.execute(f"DELETE FROM {table}")
+        return self.load()
+    
+    def record(self, event: str, item: object = None):
+        """As alterações já foram escritas pelas vistas."""
+    
+    def save(self, kb):
+        """Confirma a transação com as alterações desde a última gravação."""
+        with self.lock:
+            self.conn.commit()
+
+
+def _predicate_name(fact: Optional[str]) -> str:
+    """Predicado de um fato ('' se não tiver o formato predicado(...))."""
+    name = parse_fact(fact)[0] if fact else None
+    return name if name is not None else ''
+
+
+def _parsed(facts: Iterable[str]) -> Iterator[Tuple]:
+    """Tuplos (fato, predicado, argumentos), como FactIndex espera de uma fonte."""
+    for fact in facts:
+        yield (fact,) + parse_fact(fact)
+
+
+class ShardSet:
+    """
+    Ficheiros de uma KB dividida por predicado: cada predicado pertence a
+    um balde (hash do nome) e cada balde é um ficheiro JSON lido só
+    quando um dos seus predicados é usado.
+    """
+    
+    def __init__(self, directory: str, buckets: int, counts: Dict[str, Dict[str, int]],
+                 read: bool = True):
+        """
+        Args:
+            directory: Diretório da KB
+            buckets: Número de baldes (ficheiros)
+            counts: Predicado -> número de 'facts' e 'inferences' (do manifesto)
+            read: False para uma KB nova (depois de um clear os ficheiros
+                antigos ainda existem até à gravação, mas não são lidos)
+        """
+        self.directory = directory
+        self.buckets = buckets
+        self.counts = counts
+        self.read = read
+        # Baldes lidos: balde -> predicado -> {'facts': OrderedSet, 'inferences': lista}
+        self._loaded: Dict[int, Dict[str, Dict]] = {}
+        # Baldes alterados desde a última gravação
+        self.dirty: set = set()
+        # Leitores em paralelo podem pedir o mesmo balde
+        self._lock = threading.Lock()
+    
+    def bucket_of(self, name: str) -> int:
+        return zlib.crc32(name.encode('utf-8')) % self.buckets
+    
+    def path(self, bucket: int) -> str:
+        return os.path.join(self.directory, f'shard-{bucket:04d}.json')
+    
+    def entry(self, name: str, create: bool = False) -> Optional[Dict]:
+        """
+        Fatos e inferências de um predicado (lê o balde na primeira vez).
+        
+        Args:
+            name: Nome do predicado
+            create: Criar a entrada se o predicado ainda não existir
+        
+        Returns:
+            Dicionário com 'facts' e 'inferences', ou None
+        """
+        bucket = self.bucket_of(name)
+        shard = self._loaded.get(bucket)
+        if shard is None:
+            with self._lock:
+                shard = self._loaded.get(bucket)
+                if shard is None:
+                    shard = self._loaded[bucket] = {
+                        predicate: {'facts': OrderedSet(data.get('facts', [])),
+                                    'inferences': data.get('inferences', [])}
+                        for predicate, data in (_read_raw(self.path(bucket)) if self.read else {}).items()
+                    }
+        entry = shard.get(name)
+        if entry is None and create:
+            entry = shard[name] = {'facts': OrderedSet(), 'inferences': []}
+            self.counts.setdefault(name, {'facts': 0, 'inferences': 0})
+        return entry
+    
+    def added(self, name: str, kind: str):
+        """Conta um item novo de um predicado e marca o seu balde para gravar."""
+        self.counts[name][kind] += 1
+        self.dirty.add(self.bucket_of(name))
+    
+    def loaded_buckets(self) -> int:
+        """Número de baldes lidos para memória."""
+        return len(self._loaded)
+    
+    def write(self, bucket: int):
+        """Grava um balde (que tem de ter sido lido)."""
+        write_json(self.path(bucket), {
+            name: {'facts': entry['facts'].copy(), 'inferences': entry['inferences']}
+            for name, entry in self._loaded[bucket].items()
+        })
+
+
+class ShardedView:
+    """
+    Vista só de leitura de um contentor dividido por predicado
+    (ShardedFacts ou ShardedInferences). Só guarda o número de itens de
+    cada predicado: um balde é lido quando a iteração ou a pertença
+    chegam a ele, e os itens acrescentados depois da vista não são vistos.
+    """
+    
+    __slots__ = ('_container', '_lengths')
+    
+    def __init__(self, container, lengths: Dict[str, int]):
+        """
+        Args:
+            container: ShardedFacts ou ShardedInferences
+            lengths: Predicado -> número de itens visíveis
+        """
+        self._container = container
+        self._lengths = lengths
+    
+    def __len__(self) -> int:
+        return sum(self._lengths.values())
+    
+    def __iter__(self) -> Iterator:
+        for name, length in self._lengths.items():
+            yield from self._container.prefix(name, length)
+    
+    def __contains__(self, item) -> bool:
+        name = self._container.predicate_of(item)
+        length = self._lengths.get(name)
+        return bool(length) and item in self._container.prefix(name, length)
+    
+    def predicates(self) -> List[str]:
+        """Predicados com itens na vista (sem ler nenhum balde)."""
+        return list(self._lengths)
+    
+    def parsed_facts_for(self, name: Optional[str]) -> Iterator[Tuple]:
+        """Fatos de um predicado na vista, com o parse feito (para FactIndex)."""
+        length = self._lengths.get(name if name is not None else '', 0)
+        return self._container.parsed_facts_for(name, length)
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, tuple, SnapshotView, ShardedView)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+    
+    def __repr__(self) -> str:
+        return f"ShardedView({list(self)!r})"
+
+
+class ShardedFacts:
+    """
+    Fatos de uma KB dividida por predicado, com a interface de lista só
+    de acréscimo. A pertença e o acréscimo só leem o balde do predicado
+    do fato; a iteração lê todos e segue a ordem dos predicados (a ordem
+    de inserção só é mantida dentro de cada predicado).
+    """
+    
+    # Fonte de FactIndex por predicado (ver app.fact_index.kb_fact_index)
+    lazy = True
+    
+    def __init__(self, shards: ShardSet):
+        self._shards = shards
+    
+    def predicates(self) -> List[str]:
+        """Predicados com fatos (sem ler nenhum balde)."""
+        return [name for name, count in self._shards.counts.items() if count['facts']]
+    
+    def facts_for(self, name: Optional[str], length: Optional[int] = None) -> Iterable[str]:
+        """Fatos de um predicado, ou os primeiros length (lê só o seu balde)."""
+        entry = self._shards.entry(name if name is not None else '')
+        return entry['facts'].view(length) if entry is not None else ()
+    
+    def parsed_facts_for(self, name: Optional[str], length: Optional[int] = None) -> Iterator[Tuple]:
+        """Fatos de um predicado com o parse feito (para FactIndex)."""
+        return _parsed(self.facts_for(name, length))
+    
+    def __contains__(self, fact) -> bool:
+        entry = self._shards.entry(_predicate_name(fact))
+        return entry is not None and fact in entry['facts']
+    
+    def append(self, fact: str) -> bool:
+        """Acrescenta um fato se ainda não existir; retorna True se era novo."""
+        name = _predicate_name(fact)
+        if not self._shards.entry(name, create=True)['facts'].append(fact):
+            return False
+        self._shards.added(name, 'facts')
+        return True
+    
+    def __len__(self) -> int:
+        return sum(count['facts'] for count in self._shards.counts.values())
+    
+    def __iter__(self) -> Iterator[str]:
+        for name in self.predicates():
+            yield from self.facts_for(name)
+    
+    def predicate_of(self, fact) -> str:
+        """Predicado que escolhe o balde de um fato."""
+        return _predicate_name(fact)
+    
+    def prefix(self, name: str, length: int) -> SnapshotView:
+        """Primeiros fatos de um predicado (lê só o seu balde)."""
+        return self.facts_for(name, length)
+    
+    def view(self) -> ShardedView:
+        """Vista dos fatos atuais, sem ler nenhum balde."""
+        counts = self._shards.counts
+        return ShardedView(self, {name: counts[name]['facts'] for name in self.predicates()})
+    
+    def copy(self) -> list:
+        """Cópia de todos os fatos (lê todos os baldes)."""
+        return list(self)
+
+
+class ShardedInferences:
+    """
+    Inferências de uma KB dividida por predicado, guardadas com o
+    predicado do fato derivado. Também serve de fonte de fatos derivados
+    para FactIndex (predicates e parsed_facts_for) e de derivações para
+    ProvenanceStore (inferences_for).
+    """
+    
+    def __init__(self, shards: ShardSet):
+        self._shards = shards
+    
+    def predicates(self) -> List[str]:
+        """Predicados com inferências (sem ler nenhum balde)."""
+        return [name for name, count in self._shards.counts.items() if count['inferences']]
+    
+    def inferences_for(self, name: Optional[str]) -> List[Dict]:
+        """Inferências dos fatos derivados de um predicado (lê só o seu balde)."""
+        entry = self._shards.entry(name if name is not None else '')
+        return entry['inferences'] if entry is not None else []
+    
+    def facts_for(self, name: Optional[str], length: Optional[int] = None) -> Iterator[str]:
+        """Fatos derivados de um predicado, ou só das primeiras length inferências."""
+        for inference in islice(self.inferences_for(name), length):
+            if inference.get('derived_fact'):
+                yield inference['derived_fact']
+    
+    def parsed_facts_for(self, name: Optional[str], length: Optional[int] = None) -> Iterator[Tuple]:
+        """Fatos derivados de um predicado com o parse feito (para FactIndex)."""
+        return _parsed(self.facts_for(name, length))
+    
+    def find_all(self, fact: str) -> Iterator[Dict]:
+        """Inferências de um fato derivado."""
+        for inference in self.inferences_for(_predicate_name(fact)):
+            if inference.get('derived_fact') == fact:
+                yield inference
+    
+    def find(self, fact: str) -> Optional[Dict]:
+        """Primeira inferência de um fato derivado (ou None)."""
+        return next(self.find_all(fact), None)
+    
+    def __contains__(self, inference) -> bool:
+        return any(item == inference for item in self.find_all(inference.get('derived_fact')))
+    
+    def append(self, inference: Dict) -> bool:
+        """Acrescenta uma inferência."""
+        name = _predicate_name(inference.get('derived_fact'))
+        self._shards.entry(name, create=True)['inferences'].append(inference)
+        self._shards.added(name, 'inferences')
+        return True
+    
+    def __len__(self) -> int:
+        return sum(count['inferences'] for count in self._shards.counts.values())
+    
+    def __iter__(self) -> Iterator[Dict]:
+        for name in self.predicates():
+            yield from list(self.inferences_for(name))
+    
+    def predicate_of(self, inference) -> str:
+        """Predicado do fato derivado, que escolhe o balde de uma inferência."""
+        return _predicate_name(inference.get('derived_fact') if isinstance(inference, dict) else None)
+    
+    def prefix(self, name: str, length: int) -> SnapshotView:
+        """Primeiras inferências de um predicado (lê só o seu balde)."""
+        return SnapshotView(self.inferences_for(name), length)
+    
+    def view(self) -> ShardedView:
+        """Vista das inferências atuais, sem ler nenhum balde."""
+        counts = self._shards.counts
+        return ShardedView(self, {name: counts[name]['inferences'] for name in self.predicates()})
+    
+    def copy(self) -> list:
+        """Cópia de todas as inferências (lê todos os baldes)."""
+        return list(self)
+
+
+class ShardedStorage:
+    """
+    KB num diretório: um manifesto pequeno (regras e número de fatos e
+    inferências de cada predicado) e os fatos e inferências divididos
+    por predicado em baldes. Carregar a KB só lê o manifesto.
+    """
+    
+    indexed = True
+    lazy = True
+    
+    # Número de baldes de uma KB nova (fica no manifesto)
+    BUCKETS = 64
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Diretório da KB (ex: kb.shards)
+        """
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self._shards: Optional[ShardSet] = None
+        self._cleared = False
+    
+    def load(self) -> Dict:
+        """Lê o manifesto; os baldes são lidos quando forem usados."""
+        manifest = _read_raw(self.manifest_path)
+        self._shards = ShardSet(self.path, manifest.get('buckets', self.BUCKETS),
+                                manifest.get('predicates', {}))
+        self._cleared = False
+        return self._containers(OrderedSet(manifest.get('rules', [])))
+    
+    def _containers(self, rules: OrderedSet) -> Dict:
+        return {
+            'facts': ShardedFacts(self._shards),
+            'rules': rules,
+            'inferences': ShardedInferences(self._shards)
+        }
+    
+    def clear(self) -> Dict:
+        """Retorna contentores vazios; os baldes antigos são apagados ao gravar."""
+        self._shards = ShardSet(self.path, self.BUCKETS, {}, read=False)
+        self._cleared = True
+        return self._containers(OrderedSet())
+    
+    def record(self, event: str, item: object = None):
+        """As alterações já foram marcadas pelos contentores."""
+    
+    def save(self, kb):
+        """
+        Grava os baldes alterados e depois o manifesto.
+        
+        Args:
+            kb: KnowledgeBase (só as regras são lidas)
+        """
+        os.makedirs(self.path, exist_ok=True)
+        shards = self._shards
+        if self._cleared:
+            for name in os.listdir(self.path):
+                if name.startswith('shard-'):
+                    os.remove(os.path.join(self.path, name))
+            self._cleared = False
+        for bucket in sorted(shards.dirty):
+            shards.write(bucket)
+        shards.dirty.clear()
+        write_json(self.manifest_path, {
+            'version': 1,
+            'buckets': shards.buckets,
+            'rules': list(kb.rules),
+            'predicates': shards.counts
+        })
+
+
+# Extensões dos ficheiros NDJSON comprimidos e o módulo que os abre
+COMPRESSORS = {'.gz': gzip, '.xz': lzma}
+# Opções de escrita: os níveis por omissão (gzip 9, lzma 6) são muitas
+# vezes mais lentos e quase não reduzem uma KB (texto muito repetitivo)
+COMPRESSION_OPTIONS = {gzip: {'compresslevel': 6}, lzma: {'preset': 1}}
+
+NDJSON_HEADER = {'kb': 'ndjson', 'version': 1}
+# Registos lidos ou escritos de cada vez (limita a memória usada)
+NDJSON_BATCH = 1000
+
+
+def write_ndjson(path: str, facts: Iterable[str], rules: Iterable[str],
+                 inferences: Iterable[Dict]):
+    """
+    Escreve uma KB em NDJSON, um registo por linha, sem montar o
+    documento inteiro em memória. Comprime com gzip ou lzma se o caminho
+    terminar em .gz ou .xz. Como write_json, escreve ao lado e troca o
+    ficheiro de uma vez.
+    
+    Args:
+        path: Caminho do ficheiro
+        facts: Fatos (qualquer iterável, ex: uma vista de snapshot)
+        rules: Regras
+        inferences: Inferências
+    """
+    compressor = COMPRESSORS.get(os.path.splitext(path)[1])
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as raw:
+        if compressor:
+            stream = compressor.open(raw, 'wb', **COMPRESSION_OPTIONS[compressor])
+        else:
+            stream = raw
+        text = io.TextIOWrapper(stream, encoding='utf-8')
+        text.write(json.dumps(NDJSON_HEADER) + '\n')
+        for kind, items in (('fact', facts), ('rule', rules), ('inference', inferences)):
+            items = iter(items)
+            while True:
+                batch = [json.dumps({kind: item}, ensure_ascii=False)
+                         for item in islice(items, NDJSON_BATCH)]
+                if not batch:
+                    break
+                text.write('\n'.join(batch) + '\n')
+        text.flush()
+        text.detach()
+        if compressor:
+            stream.close()
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp_path, path)
+
+
+def read_ndjson(path: str) -> Iterator[Tuple[str, object]]:
+    """
+    Lê uma KB em NDJSON registo a registo.
+    
+    Args:
+        path: Caminho do ficheiro (.gz ou .xz se estiver comprimido)
+    
+    Yields:
+        Pares (tipo, item) com tipo 'fact', 'rule' ou 'inference'
+    
+    Raises:
+        ValueError: Se o ficheiro não for uma KB em NDJSON
+    """
+    compressor = COMPRESSORS.get(os.path.splitext(path)[1])
+    opener = compressor.open if compressor else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('kb') != NDJSON_HEADER['kb']:
+            raise ValueError(f"{path} não é uma KB em NDJSON")
+        while True:
+            batch = list(islice(f, NDJSON_BATCH))
+            if not batch:
+                return
+            # Descodificar um lote de linhas de uma vez é mais rápido que linha a linha
+            lines = [line for line in batch if line.strip()]
+            for record in json.loads('[' + ','.join(lines) + ']'):
+                (kind, item), = record.items()
+                yield kind, item
+
+
+class NdjsonStorage:
+    """
+    KB em NDJSON (opcionalmente comprimido): carregar e gravar percorrem
+    os registos um a um, sem ter o documento inteiro em memória.
+    """
+    
+    indexed = False
+    lazy = False
+    
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Caminho do ficheiro (ex: kb.ndjson, kb.ndjson.gz, kb.ndjson.xz)
+        """
+        self.path = path
+    
+    def load(self) -> Dict:
+        """Lê a KB registo a registo."""
+        data = _empty()
+        if not os.path.exists(self.path):
+            return data
+        containers = {'fact': data['facts'], 'rule': data['rules'],
+                      'inference': data['inferences']}
+        for kind, item in read_ndjson(self.path):
+            containers[kind].append(item)
+        return data
+    
+    def clear(self) -> Dict:
+        """Retorna contentores vazios para a KB."""
+        return _empty()
+    
+    def record(self, event: str, item: object = None):
+        """Alterações não são registadas: save escreve o estado inteiro."""
+    
+    def save(self, kb):
+        """Escreve o estado inteiro da KB, a partir de um snapshot (sem cópias)."""
+        snapshot = kb.snapshot()
+        write_ndjson(self.path, snapshot.facts, snapshot.rules, snapshot.inferences)
+
+
+STORAGES = {
+    'json': JsonStorage,
+    'wal': LogStorage,
+    'sqlite': SqliteStorage,
+    'binary': BinaryLogStorage,
+    'sharded': ShardedStorage,
+    'ndjson': NdjsonStorage,
+}
+
+# Extensões do caminho que escolhem o armazenamento quando não é indicado
+SUFFIXES = {
+    '.sqlite': 'sqlite',
+    '.sqlite3': 'sqlite',
+    '.db': 'sqlite',
+    '.kbin': 'binary',
+    '.shards': 'sharded',
+    '.ndjson': 'ndjson',
+    '.ndjson.gz': 'ndjson',
+    '.ndjson.xz': 'ndjson',
+}
+
+
+def open_storage(path: str, kind: Optional[str] = None):
+    """
+    Escolhe o armazenamento de uma KB.
+    
+    Args:
+        path: Caminho da KB
+        kind: 'json', 'wal', 'binary', 'sqlite', 'sharded' ou 'ndjson'; se não
+            for especificado usa a variável KB_STORAGE ou, sem ela, a extensão
+            do caminho (ex: kb.sqlite, kb.shards, kb.ndjson.gz), e por omissão 'json'
+    
+    Returns:
+        Instância de armazenamento
+    """
+    if kind is None:
+        kind = os.environ.get('KB_STORAGE') or next(
+            (name for suffix, name in SUFFIXES.items() if path.endswith(suffix)), 'json')
+    if kind not in STORAGES:
+        raise ValueError(f"Armazenamento desconhecido: {kind}")
+    return STORAGES[kind](path)
@@ -0,0 +1,122 @@
+"""
+Cache do parse de fatos e tabelas de símbolos.
+parse_fact faz o parse de um fato com a expressão regular e guarda o
+resultado num cache LRU limitado, partilhado pelos módulos que precisam
+dos argumentos de fatos da KB; é só um cache (os fatos continuam a ser
+strings na KB, nos índices e nas respostas HTTP) e não cresce com o
+número de fatos. Padrões de consultas não passam por ele.
+clear_parse_caches esvazia-o, com os caches de termos de app.terms.
+
+SymbolTable dá ids inteiros a nomes de predicados e constantes, para os
+módulos que guardam fatos como tuplos de inteiros (motor colunar,
+proveniência). Cada KB tem a sua (KnowledgeBase.symbols), que é
+libertada com a KB.
+"""
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from app.unification import parse_predicate
+from app.terms import parse_term, parse_predicate_term, parse_rule_term
+
+
+# Um fato codificado: (id do predicado, id do argumento 1, ...)
+FactKey = Tuple[int, ...]
+
+# Número máximo de fatos no cache do parse
+PARSE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_fact(fact: str) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """
+    Como parse_predicate, mas com o resultado em cache (limitado).
+    
+    Args:
+        fact: Fato no formato predicado(arg1, ...)
+    
+    Returns:
+        Tupla (nome, argumentos) ou (None, ()) se não for válido
+    """
+    name, args = parse_predicate(fact)
+    if name is None:
+        return None, ()
+    return name, tuple(args)
+
+
+def clear_parse_caches():
+    """
+    Esvazia os caches do parse de fatos e termos (ex: ao descarregar uma
+    KB, para que as suas strings e termos não fiquem em memória).
+    """
+    parse_fact.cache_clear()
+    parse_term.cache_clear()
+    parse_predicate_term.cache_clear()
+    parse_rule_term.cache_clear()
+
+
+class SymbolTable:
+    """Internamento de símbolos em inteiros."""
+    
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._symbols: List[str] = []
+        self._lock = threading.Lock()
+    
+    def intern(self, symbol: str) -> int:
+        """
+        Retorna o id de um símbolo, atribuindo um novo se necessário.
+        
+        Args:
+            symbol: Nome de predicado ou constante
+        
+        Returns:
+            Id do símbolo
+        """
+        symbol_id = self._ids.get(symbol)
+        if symbol_id is None:
+            with self._lock:
+                symbol_id = self._ids.get(symbol)
+                if symbol_id is None:
+                    symbol_id = len(self._symbols)
+                    self._symbols.append(symbol)
+                    self._ids[symbol] = symbol_id
+        return symbol_id
+    
+    def lookup(self, symbol: str) -> Optional[int]:
+        """Retorna o id de um símbolo já internado (ou None)."""
+        return self._ids.get(symbol)
+    
+    def symbol(self, symbol_id: int) -> str:
+        """Retorna o símbolo de um id."""
+        return self._symbols[symbol_id]
+    
+    def encode(self, fact: str) -> Optional[FactKey]:
+        """
+        Codifica um fato.
+        
+        Args:
+            fact: Fato no formato predicado(arg1, ...)
+        
+        Returns:
+            Tuplo (id do predicado, ids dos argumentos) ou None se não for válido
+        """
+        name, args = parse_fact(fact)
+        if name is None:
+            return None
+        return (self.intern(name),) + tuple(self.intern(arg) for arg in args)
+    
+    def decode(self, key: FactKey) -> str:
+        """
+        Escreve um fato codificado no formato predicado(arg1, arg2).
+        
+        Args:
+            key: Fato codificado
+        
+        Returns:
+            Fato em string
+        """
+        symbols = self._symbols
+        return f"{symbols[key[0]]}({', '.join(symbols[i] for i in key[1:])})"
+    
+    def __len__(self) -> int:
+        return len(self._symbols)
@@ -0,0 +1,211 @@
+"""
+Várias bases de conhecimento (tenants) no mesmo processo.
+Cada KB tem um nome, o seu ficheiro e os seus motores de inferência e de
+consultas. As KBs usadas recentemente ficam em memória; quando o
+orçamento de memória é ultrapassado, as que não estão a ser usadas há
+mais tempo são gravadas e descarregadas (LRU).
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from app.kb_manager import KnowledgeBase
+from app.inference import InferenceEngine
+from app.query_engine import QueryEngine
+from app.storage import SUFFIXES
+from app.symbols import clear_parse_caches
+
+
+# Nomes aceites (também usados como nome de diretório)
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Memória de um item da KB (fato, regra ou inferência) contando com os
+# índices dos motores: cerca de 2 KB, medidos com tracemalloc numa KB de
+# fatos simples depois de /infer e de uma consulta
+ITEM_BYTES = 2048
+
+
+class Tenant:
+    """Uma KB carregada, com os seus motores."""
+    
+    def __init__(self, name: Optional[str], kb_path: str, save_delay: Optional[float] = None):
+        """
+        Args:
+            name: Nome da KB (None para a KB por omissão)
+            kb_path: Caminho do ficheiro da KB
+            save_delay: Segundos a juntar alterações numa gravação em segundo
+                plano (None grava em cada save)
+        """
+        self.name = name
+        self.kb = KnowledgeBase(kb_path)
+        if save_delay is not None:
+            self.kb.start_background_saver(save_delay)
+        self.inference_engine = InferenceEngine(self.kb)
+        self.query_engine = QueryEngine(self.kb)
+        # Pedidos a usar a KB neste momento (não pode ser descarregada)
+        self.users = 0
+        # Itens em memória, mantidos pelas notificações da KB (o orçamento é
+        # verificado a cada pedido, por isso não se conta a KB de cada vez)
+        self.items = self._resident_items()
+        self.kb.add_listener(self._on_kb_change)
+    
+    def _resident_items(self) -> int:
+        """
+        Itens da KB em memória ao carregar. Num armazenamento lazy (SQLite,
+        por predicado) os itens ficam no disco e só contam os adicionados.
+        """
+        kb = self.kb
+        if kb.storage.lazy:
+            return 0
+        return len(kb.facts) + len(kb.rules) + len(kb.inferences)
+    
+    def _on_kb_change(self, event: str, item):
+        if event == 'clear':
+            self.items = 0
+        else:
+            self.items += 1
+    
+    def estimated_bytes(self) -> int:
+        """Memória estimada da KB e dos motores."""
+        return self.items * ITEM_BYTES
+    
+    def unload(self):
+        """
+        Grava a KB antes de ser descarregada e descarta os motores. Os
+        caches de parse partilhados são esvaziados, para que não guardem
+        as strings e os termos da KB descarregada.
+        """
+        self.kb.remove_listener(self._on_kb_change)
+        self.kb.close()
+        self.inference_engine.close()
+        self.query_engine.close()
+        clear_parse_caches()
+
+
+class TenantRegistry:
+    """Cache LRU de KBs com orçamento de memória."""
+    
+    def __init__(self, default_path: str, root: Optional[str] = None,
+                 memory_budget: Optional[int] = None, save_delay: Optional[float] = None):
+        """
+        Args:
+            default_path: Caminho da KB por omissão (rotas sem nome)
+            root: Diretório das KBs com nome (usa KB_ROOT env var ou 'kbs')
+            memory_budget: Memória máxima em bytes das KBs carregadas (usa
+                KB_CACHE_MB env var ou 512 MB)
+            save_delay: Intervalo da gravação em segundo plano de cada KB
+                (ver KnowledgeBase.start_background_saver; None grava em cada save)
+        """
+        if root is None:
+            root = os.environ.get('KB_ROOT', 'kbs')
+        if memory_budget is None:
+            memory_budget = int(float(os.environ.get('KB_CACHE_MB', '512')) * 1024 * 1024)
+        
+        self.default_path = default_path
+        self.root = root
+        self.memory_budget = memory_budget
+        self.save_delay = save_delay
+        # A extensão da KB por omissão escolhe o armazenamento das outras
+        self.suffix = next((suffix for suffix in SUFFIXES if default_path.endswith(suffix)),
+                           os.path.splitext(default_path)[1] or '.json')
+        self._tenants: 'OrderedDict[Optional[str], Tenant]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def valid(self, name: Optional[str]) -> bool:
+        """True se name for None (KB por omissão) ou um nome de KB aceite."""
+        return name is None or bool(NAME_PATTERN.match(name))
+    
+    def path_for(self, name: Optional[str]) -> str:
+        """
+        Caminho do ficheiro de uma KB.
+        
+        Args:
+            name: Nome da KB (None para a KB por omissão)
+        
+        Raises:
+            ValueError: Se o nome não for válido
+        """
+        if not self.valid(name):
+            raise ValueError(f"Nome de KB inválido: {name}")
+        if name is None:
+            return self.default_path
+        return os.path.join(self.root, name, 'kb' + self.suffix)
+    
+    def get(self, name: Optional[str] = None) -> Tenant:
+        """
+        Retorna uma KB, carregando-a do disco se não estiver em memória.
+        
+        Args:
+            name: Nome da KB (None para a KB por omissão)
+        
+        Raises:
+            ValueError: Se o nome não for válido
+        """
+        with self._lock:
+            tenant = self._load(name)
+            self._evict()
+            return tenant
+    
+    @contextmanager
+    def use(self, name: Optional[str] = None) -> Iterator[Tenant]:
+        """
+        Usa uma KB durante um pedido; enquanto estiver em uso não é descarregada.
+        
+        Args:
+            name: Nome da KB (None para a KB por omissão)
+        
+        Raises:
+            ValueError: Se o nome não for válido
+        """
+        with self._lock:
+            tenant = self._load(name)
+            tenant.users += 1
+            self._evict()
+        try:
+            yield tenant
+        finally:
+            with self._lock:
+                tenant.users -= 1
+                self._evict()
+    
+    def _load(self, name: Optional[str]) -> Tenant:
+        """Carrega uma KB (se preciso) e marca-a como a mais recente (chamado com o lock)."""
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = Tenant(name, self.path_for(name), self.save_delay)
+        self._tenants.move_to_end(name)
+        return tenant
+    
+    def _evict(self):
+        """Descarrega as KBs menos usadas até caber no orçamento (chamado com o lock)."""
+        total = sum(tenant.estimated_bytes() for tenant in self._tenants.values())
+        for name in list(self._tenants):
+            if total <= self.memory_budget:
+                break
+            tenant = self._tenants[name]
+            # A KB mais recente fica sempre, mesmo que sozinha exceda o orçamento
+            if tenant.users or name == next(reversed(self._tenants)):
+                continue
+            total -= tenant.estimated_bytes()
+            tenant.unload()
+            del self._tenants[name]
+    
+    def loaded(self) -> List[Optional[str]]:
+        """Nomes das KBs em memória, da menos para a mais recente."""
+        with self._lock:
+            return list(self._tenants)
+    
+    def save_all(self):
+        """Grava já as alterações pendentes de todas as KBs em memória."""
+        with self._lock:
+            for tenant in self._tenants.values():
+                tenant.kb.flush()
+    
+    def close(self):
+        """Grava e descarrega todas as KBs (ao terminar o processo)."""
+        with self._lock:
+            for tenant in self._tenants.values():
+                tenant.unload()
+            self._tenants.clear()
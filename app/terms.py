@@ -0,0 +1,264 @@
+"""
+Representação estruturada de termos lógicos.
+Constantes (Atom), variáveis (Var), termos compostos (Compound, ex:
+pai(João, Maria) ou f(g(X))) e regras (Rule) são imutáveis e usam
+__slots__; o texto de cada termo é calculado uma vez na construção.
+O parse é feito por um cache LRU, por isso o mesmo texto devolve sempre
+o mesmo objeto.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+def is_pattern_variable(term: str) -> bool:
+    """
+    Verifica se um termo é uma variável de regra ou consulta.
+    Ao contrário de is_variable, nomes próprios (ex: Socrates) são constantes:
+    só letras únicas maiúsculas (X, Y, Z) ou nomes com dígitos (Var1) contam.
+    
+    Args:
+        term: Termo a verificar
+    
+    Returns:
+        True se for variável de padrão, False caso contrário
+    """
+    return bool(term) and term[0].isupper() and (
+        len(term) == 1 or term.isalnum() and any(c.isdigit() for c in term)
+    )
+
+
+class Term:
+    """Classe base dos termos (imutáveis)."""
+    
+    __slots__ = ('_text', '_hash', 'ground')
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} é imutável")
+    
+    def _init(self, text: str, key: tuple, ground: bool):
+        object.__setattr__(self, '_text', text)
+        object.__setattr__(self, '_hash', hash(key))
+        object.__setattr__(self, 'ground', ground)
+    
+    def __str__(self) -> str:
+        return self._text
+    
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._text!r})"
+    
+    def __hash__(self) -> int:
+        return self._hash
+
+
+class Atom(Term):
+    """Constante, ex: Socrates."""
+    
+    __slots__ = ('name',)
+    
+    def __init__(self, name: str):
+        object.__setattr__(self, 'name', name)
+        self._init(name, (Atom, name), True)
+    
+    def __eq__(self, other) -> bool:
+        return self is other or type(other) is Atom and self.name == other.name
+    
+    __hash__ = Term.__hash__
+
+
+class Var(Term):
+    """Variável, ex: X ou Var1."""
+    
+    __slots__ = ('name',)
+    
+    def __init__(self, name: str):
+        object.__setattr__(self, 'name', name)
+        self._init(name, (Var, name), False)
+    
+    def __eq__(self, other) -> bool:
+        return self is other or type(other) is Var and self.name == other.name
+    
+    __hash__ = Term.__hash__
+
+
+class Compound(Term):
+    """Termo composto: functor com argumentos, ex: pai(João, Maria)."""
+    
+    __slots__ = ('name', 'args')
+    
+    def __init__(self, name: str, args: Tuple[Term, ...]):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'args', tuple(args))
+        self._init(f"{name}({', '.join(arg._text for arg in self.args)})",
+                   (Compound, name, self.args), all(arg.ground for arg in self.args))
+    
+    @property
+    def arity(self) -> int:
+        return len(self.args)
+    
+    def __eq__(self, other) -> bool:
+        return self is other or (
+            type(other) is Compound and self._hash == other._hash
+            and self.name == other.name and self.args == other.args
+        )
+    
+    __hash__ = Term.__hash__
+
+
+class Rule:
+    """Regra cabeça :- corpo (imutável)."""
+    
+    __slots__ = ('head', 'body', '_text')
+    
+    def __init__(self, head: Term, body: Tuple[Term, ...], text: str):
+        object.__setattr__(self, 'head', head)
+        object.__setattr__(self, 'body', tuple(body))
+        object.__setattr__(self, '_text', text)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Rule é imutável")
+    
+    def __str__(self) -> str:
+        return self._text
+    
+    def __repr__(self) -> str:
+        return f"Rule({self._text!r})"
+    
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Rule) and self.head == other.head and self.body == other.body
+    
+    def __hash__(self) -> int:
+        return hash((self.head, self.body))
+
+
+def term_variables(term: Term) -> List[str]:
+    """
+    Retorna os nomes das variáveis de um termo, pela ordem em que aparecem.
+    
+    Args:
+        term: Termo
+    
+    Returns:
+        Lista de nomes sem repetições
+    """
+    found: Dict[str, None] = {}
+    pending = [term]
+    while pending:
+        current = pending.pop()
+        if current.ground:
+            continue
+        if isinstance(current, Var):
+            found[current.name] = None
+        else:
+            pending.extend(reversed(current.args))
+    return list(found)
+
+
+_COMPOUND = re.compile(r'(\w+)\((.*)\)')
+
+
+def split_top_level(text: str) -> List[str]:
+    """
+    Separa um texto pelas vírgulas fora de parênteses.
+    
+    Args:
+        text: Texto, ex: "X, f(Y, Z)"
+    
+    Returns:
+        Lista de partes sem espaços nas pontas (vazia se o texto for vazio)
+    """
+    if not text.strip():
+        return []
+    
+    parts = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _compound(name: str, inner: str) -> Compound:
+    return Compound(name, tuple(parse_term(arg) for arg in split_top_level(inner)))
+
+
+@lru_cache(maxsize=65536)
+def parse_term(text: str) -> Term:
+    """
+    Faz parse de um termo: composto, variável ou constante.
+    
+    Args:
+        text: Termo em string, ex: X, Socrates ou f(g(X), a)
+    
+    Returns:
+        Term (o mesmo objeto para o mesmo texto enquanto estiver no cache)
+    """
+    text = text.strip()
+    match = _COMPOUND.fullmatch(text)
+    if match:
+        return _compound(match.group(1), match.group(2))
+    return Var(text) if is_pattern_variable(text) else Atom(text)
+
+
+@lru_cache(maxsize=65536)
+def parse_predicate_term(text: str) -> Optional[Compound]:
+    """
+    Faz parse de um predicado no formato predicado(arg1, arg2, ...).
+    Como o parse original, texto a seguir ao último parêntese é ignorado.
+    
+    Args:
+        text: Predicado em string
+    
+    Returns:
+        Compound ou None se o texto não for um predicado
+    """
+    match = _COMPOUND.match(text.strip())
+    if not match:
+        return None
+    return _compound(match.group(1), match.group(2))
+
+
+@lru_cache(maxsize=16384)
+def parse_rule_term(text: str) -> Optional[Rule]:
+    """
+    Faz parse de uma regra no formato: consequente :- antecedente1, antecedente2.
+    
+    Args:
+        text: Regra em string
+    
+    Returns:
+        Rule ou None se o texto não tiver ':-'
+    """
+    if ':-' not in text:
+        return None
+    parts = text.split(':-')
+    antecedents = split_top_level(parts[1])
+    if antecedents and not antecedents[-1]:
+        # Vírgula final
+        antecedents.pop()
+    return Rule(parse_term(parts[0]), tuple(parse_term(a) for a in antecedents), text)
+
+
+def is_open_pattern(text: str) -> bool:
+    """
+    Verifica se um argumento de um padrão tem variáveis: é uma variável
+    ou um termo composto com variáveis, ex: filho(X).
+    
+    Args:
+        text: Argumento em string
+    
+    Returns:
+        True se o argumento não for fechado
+    """
+    if is_pattern_variable(text):
+        return True
+    return '(' in text and not parse_term(text).ground
@@ -1,8 +1,17 @@
 """
 Módulo de unificação para matching de predicados lógicos.
+As funções em string são uma fachada sobre os termos estruturados de
+app.terms: o parse é feito uma vez (cache LRU) e a substituição percorre
+a estrutura, sem substituir texto.
+A primitiva de unificação é a classe Trail (ao estilo da WAM): as
+ligações são registadas num trilho e desfeitas ao voltar atrás, em vez
+de se copiar o dicionário de ligações a cada passo.
 """
-import re
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+from app.terms import (
+    Term, Var, Compound, is_pattern_variable, is_open_pattern,
+    parse_term, parse_predicate_term
+)
 
 
 def parse_predicate(predicate: str) -> Tuple[str, list]:
@@ -15,19 +24,10 @@ def parse_predicate(predicate: str) -> Tuple[str, list]:
     Returns:
         Tupla (nome_predicado, [argumentos])
     """
-    match = re.match(r'(\w+)\((.*)\)', predicate.strip())
-    if not match:
+    term = parse_predicate_term(predicate)
+    if term is None:
         return None, []
-    
-    name = match.group(1)
-    args_str = match.group(2)
-    
-    if args_str:
-        args = [arg.strip() for arg in args_str.split(',')]
-    else:
-        args = []
-    
-    return name, args
+    return term.name, [str(arg) for arg in term.args]
 
 
 def is_variable(term: str) -> bool:
@@ -43,6 +43,168 @@ def is_variable(term: str) -> bool:
     return term and term[0].isupper()
 
 
+def walk(term: Term, bindings: Dict[str, Term]) -> Term:
+    """Segue as ligações de uma variável até um termo não ligado."""
+    while isinstance(term, Var) and term.name in bindings:
+        term = bindings[term.name]
+    return term
+
+
+class Trail:
+    """
+    Ligações de variáveis com trilho, ao estilo da WAM.
+    Cada ligação fica registada no trilho; undo(marca) desfaz as ligações
+    feitas depois da marca. As variáveis são desreferenciadas (deref) em
+    vez de se aplicar a substituição aos termos a cada passo.
+    """
+    
+    __slots__ = ('bindings', 'trail', 'occurs_check')
+    
+    def __init__(self, occurs_check: bool = False):
+        """
+        Inicializa um trilho vazio.
+        
+        Args:
+            occurs_check: Recusar ligações de uma variável a um termo que a contém
+        """
+        self.bindings: Dict[str, Term] = {}
+        self.trail: List[str] = []
+        self.occurs_check = occurs_check
+    
+    def mark(self) -> int:
+        """Retorna uma marca do estado atual (para undo)."""
+        return len(self.trail)
+    
+    def undo(self, mark: int):
+        """Desfaz as ligações feitas depois da marca."""
+        bindings = self.bindings
+        trail = self.trail
+        while len(trail) > mark:
+            del bindings[trail.pop()]
+    
+    def bind(self, name: str, value):
+        """Liga uma variável (ainda livre) a um valor."""
+        self.bindings[name] = value
+        self.trail.append(name)
+    
+    def deref(self, term: Term) -> Term:
+        """Segue as ligações de uma variável até um termo não ligado."""
+        bindings = self.bindings
+        while type(term) is Var:
+            bound = bindings.get(term.name)
+            if bound is None:
+                return term
+            term = bound
+        return term
+    
+    def occurs(self, name: str, term: Term) -> bool:
+        """Verifica se a variável name ocorre em term (com as ligações atuais)."""
+        pending = [term]
+        while pending:
+            current = self.deref(pending.pop())
+            if current.ground:
+                continue
+            if type(current) is Var:
+                if current.name == name:
+                    return True
+            else:
+                pending.extend(current.args)
+        return False
+    
+    def unify(self, term1: Term, term2: Term) -> bool:
+        """
+        Unifica dois termos, acrescentando as ligações ao trilho.
+        Se falhar, as ligações feitas por esta chamada são desfeitas.
+        
+        Args:
+            term1: Primeiro termo
+            term2: Segundo termo
+            
+        Returns:
+            True se os termos unificarem
+        """
+        mark = len(self.trail)
+        pending = [(term1, term2)]
+        
+        while pending:
+            left, right = pending.pop()
+            left = self.deref(left)
+            right = self.deref(right)
+            
+            if left is right or left == right:
+                continue
+            if type(left) is Var:
+                var, value = left, right
+            elif type(right) is Var:
+                var, value = right, left
+            elif (type(left) is Compound and type(right) is Compound
+                  and left.name == right.name and len(left.args) == len(right.args)):
+                pending.extend(zip(left.args, right.args))
+                continue
+            else:
+                self.undo(mark)
+                return False
+            
+            if self.occurs_check and not value.ground and self.occurs(var.name, value):
+                self.undo(mark)
+                return False
+            self.bind(var.name, value)
+        
+        return True
+    
+    def resolve(self, term: Term) -> Term:
+        """Aplica as ligações atuais a um termo."""
+        return substitute(term, self.bindings)
+
+
+def unify_terms(term1: Term, term2: Term,
+                bindings: Optional[Dict[str, Term]] = None,
+                occurs_check: bool = False) -> Optional[Dict[str, Term]]:
+    """
+    Unifica dois termos estruturados.
+    
+    Args:
+        term1: Primeiro termo
+        term2: Segundo termo
+        bindings: Ligações já existentes (não são alteradas)
+        occurs_check: Recusar ligações cíclicas, ex: X = f(X)
+        
+    Returns:
+        Novo dicionário de ligações (nome da variável -> termo) ou None
+    """
+    trail = Trail(occurs_check)
+    if bindings:
+        trail.bindings.update(bindings)
+    return trail.bindings if trail.unify(term1, term2) else None
+
+
+def substitute(term: Term, bindings: Dict[str, Term]) -> Term:
+    """
+    Aplica ligações a um termo, percorrendo a estrutura.
+    
+    Args:
+        term: Termo original
+        bindings: Ligações (nome da variável -> termo)
+        
+    Returns:
+        Termo com as variáveis ligadas substituídas (o próprio se nada mudar)
+    """
+    term = walk(term, bindings)
+    if isinstance(term, Compound):
+        args = tuple(substitute(arg, bindings) for arg in term.args)
+        if any(new is not old for new, old in zip(args, term.args)):
+            return Compound(term.name, args)
+    return term
+
+
+def _as_terms(substitutions: Dict[str, str]) -> Dict[str, Term]:
+    return {var: parse_term(value) for var, value in substitutions.items()}
+
+
+def _as_strings(bindings: Dict[str, Term]) -> Dict[str, str]:
+    return {var: str(substitute(value, bindings)) for var, value in bindings.items()}
+
+
 def unify(term1: str, term2: str, substitutions: Dict[str, str] = None) -> Optional[Dict[str, str]]:
     """
     Unifica dois termos, retornando as substituições necessárias.
@@ -50,7 +212,7 @@ def unify(term1: str, term2: str, substitutions: Dict[str, str] = None) -> Optio
     Args:
         term1: Primeiro termo
         term2: Segundo termo
-        substitutions: Substituições já existentes
+        substitutions: Substituições já existentes (são atualizadas)
         
     Returns:
         Dicionário de substituições ou None se não for possível unificar
@@ -58,37 +220,21 @@ def unify(term1: str, term2: str, substitutions: Dict[str, str] = None) -> Optio
     if substitutions is None:
         substitutions = {}
     
-    # Aplicar substituições existentes
-    term1 = apply_substitution(term1, substitutions)
-    term2 = apply_substitution(term2, substitutions)
-    
-    # Se são iguais, unificação bem-sucedida
-    if term1 == term2:
-        return substitutions
-    
-    # Se term1 é variável
-    if is_variable(term1):
-        if term1 in substitutions:
-            return unify(substitutions[term1], term2, substitutions)
-        else:
-            substitutions[term1] = term2
-            return substitutions
-    
-    # Se term2 é variável
-    if is_variable(term2):
-        if term2 in substitutions:
-            return unify(term1, substitutions[term2], substitutions)
-        else:
-            substitutions[term2] = term1
-            return substitutions
+    # Com occurs check: uma ligação cíclica não tem forma finita em texto
+    bindings = unify_terms(parse_term(term1), parse_term(term2), _as_terms(substitutions),
+                           occurs_check=True)
+    if bindings is None:
+        return None
     
-    # Não é possível unificar
-    return None
+    substitutions.update(_as_strings(bindings))
+    return substitutions
 
 
 def apply_substitution(term: str, substitutions: Dict[str, str]) -> str:
     """
     Aplica substituições a um termo.
+    Só variáveis inteiras são substituídas: constantes que contêm o nome
+    de uma variável (ex: Xavier com X ligado) ficam intactas.
     
     Args:
         term: Termo original
@@ -97,9 +243,7 @@ def apply_substitution(term: str, substitutions: Dict[str, str]) -> str:
     Returns:
         Termo com substituições aplicadas
     """
-    for var, value in substitutions.items():
-        term = term.replace(var, value)
-    return term
+    return str(substitute(parse_term(term), _as_terms(substitutions)))
 
 
 def unify_predicates(pred1: str, pred2: str) -> Optional[Dict[str, str]]:
@@ -113,27 +257,13 @@ def unify_predicates(pred1: str, pred2: str) -> Optional[Dict[str, str]]:
     Returns:
         Dicionário de substituições ou None se não unificarem
     """
-    name1, args1 = parse_predicate(pred1)
-    name2, args2 = parse_predicate(pred2)
-    
-    # Nomes devem ser iguais
-    if name1 != name2:
-        return None
-    
-    # Número de argumentos deve ser igual
-    if len(args1) != len(args2):
+    term1 = parse_predicate_term(pred1)
+    term2 = parse_predicate_term(pred2)
+    if term1 is None or term2 is None:
         return None
     
-    substitutions = {}
-    
-    # Tentar unificar cada par de argumentos
-    for arg1, arg2 in zip(args1, args2):
-        result = unify(arg1, arg2, substitutions)
-        if result is None:
-            return None
-        substitutions = result
-    
-    return substitutions
+    bindings = unify_terms(term1, term2, occurs_check=True)
+    return None if bindings is None else _as_strings(bindings)
 
 
 def apply_substitution_to_predicate(predicate: str, substitutions: Dict[str, str]) -> str:
@@ -147,7 +277,5 @@ def apply_substitution_to_predicate(predicate: str, substitutions: Dict[str, str
     Returns:
         Predicado com substituições aplicadas
     """
-    result = predicate
-    for var, value in substitutions.items():
-        result = result.replace(var, value)
-    return result
+    term = parse_predicate_term(predicate) or parse_term(predicate)
+    return str(substitute(term, _as_terms(substitutions)))
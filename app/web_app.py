@@ -2,14 +2,16 @@
 Interface Web Flask para o Motor de Inferência.
 """
 from flask import Flask, render_template, request, jsonify, redirect, url_for
+import atexit
+import math
 import os
 from werkzeug.utils import secure_filename
 
 from app.text_reader import read_text, read_text_from_upload
 from app.extractor import SemanticExtractor
-from app.kb_manager import KnowledgeBase
-from app.inference import InferenceEngine
+from app.inference import InferenceBudget
 from app.query_engine import QueryEngine
+from app.tenants import TenantRegistry
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -18,15 +20,56 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 # Criar pasta de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Tempo máximo (segundos) de um pedido /infer; sem limite se não definido
+infer_timeout = float(os.environ['INFER_TIMEOUT']) if os.environ.get('INFER_TIMEOUT') else None
+
 # Obter caminho da KB (usar variável de ambiente ou padrão)
 kb_path = os.environ.get('KB_PATH', 'kb.json')
 os.makedirs(os.path.dirname(kb_path) if os.path.dirname(kb_path) else '.', exist_ok=True)
 
-# Inicializar componentes
-kb = KnowledgeBase(kb_path)
+# Inicializar componentes: o extrator é partilhado; cada KB tem os seus
+# motores. As rotas /kb/<nome>/... usam KBs com nome (em KB_ROOT) e as
+# restantes a KB por omissão.
+# As gravações são feitas numa thread de cada KB, juntando as alterações
+# de KB_SAVE_DELAY segundos (0.5 por omissão); o que faltar grava-se à saída.
 extractor = SemanticExtractor()
-inference_engine = InferenceEngine(kb)
-query_engine = QueryEngine(kb)
+tenants = TenantRegistry(kb_path, save_delay=float(os.environ.get('KB_SAVE_DELAY', '0.5')))
+atexit.register(tenants.close)
+
+
+def tenant_not_found(name):
+    """Resposta para um nome de KB inválido."""
+    return jsonify({'error': f'KB inválida: {name}'}), 404
+
+
+def budget_limit(data: dict, key: str, default=None, integer: bool = False):
+    """
+    Lê um limite do orçamento de /infer.
+    
+    Args:
+        data: Corpo JSON do pedido
+        key: Nome do parâmetro
+        default: Valor se o parâmetro não for enviado
+        integer: Se o limite tem de ser inteiro
+    
+    Returns:
+        O limite, ou None (sem limite)
+    
+    Raises:
+        ValueError: Se o valor não for um número positivo (inteiro, se pedido)
+    """
+    value = data.get(key, default)
+    if value is None:
+        return None
+    try:
+        number = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        number = None
+    if (number is None or not math.isfinite(number) or number <= 0
+            or (integer and not number.is_integer())):
+        kind = 'um inteiro positivo' if integer else 'um número positivo'
+        raise ValueError(f"'{key}' tem de ser {kind}")
+    return int(number) if integer else number
 
 
 @app.route('/')
@@ -36,8 +79,12 @@ def index():
 
 
 @app.route('/upload', methods=['POST'])
-def upload_file():
+@app.route('/kb/<name>/upload', methods=['POST'])
+def upload_file(name=None):
     """Processa upload de ficheiro de texto."""
+    if not tenants.valid(name):
+        return tenant_not_found(name)
+    
     if 'file' not in request.files:
         return jsonify({'error': 'Nenhum ficheiro enviado'}), 400
     
@@ -54,14 +101,15 @@ def upload_file():
             # Extrair conhecimento
             knowledge = extractor.extract_knowledge(content)
             
-            # Importar para KB
-            kb.import_knowledge(knowledge['facts'], knowledge['rules'])
-            
-            # Executar inferência
-            derived = inference_engine.forward_chaining()
-            
-            # Guardar KB
-            kb.save()
+            with tenants.use(name) as tenant, tenant.kb.lock.write():
+                # Importar para KB
+                added = tenant.kb.import_knowledge(knowledge['facts'], knowledge['rules'])
+                
+                # Executar inferência só sobre o conhecimento novo
+                derived = tenant.inference_engine.infer_incremental(added['facts'], added['rules'])
+                
+                # Guardar KB
+                tenant.kb.save()
             
             return jsonify({
                 'success': True,
@@ -77,42 +125,85 @@ def upload_file():
 
 
 @app.route('/kb', methods=['GET'])
-def get_kb():
+@app.route('/kb/<name>', methods=['GET'])
+def get_kb(name=None):
     """Retorna a base de conhecimento atual."""
-    return jsonify(kb.to_dict())
+    if not tenants.valid(name):
+        return tenant_not_found(name)
+    with tenants.use(name) as tenant:
+        return jsonify(tenant.kb.to_dict())
 
 
 @app.route('/query', methods=['POST'])
-def execute_query():
+@app.route('/kb/<name>/query', methods=['POST'])
+def execute_query(name=None):
     """Executa uma consulta."""
     data = request.get_json()
     query = data.get('query', '')
+    strategy = data.get('strategy', 'materialized')
     
     if not query:
         return jsonify({'error': 'Query vazia'}), 400
     
-    result = query_engine.query(query)
+    if strategy not in QueryEngine.STRATEGIES:
+        return jsonify({'error': f'Estratégia desconhecida: {strategy}'}), 400
+    
+    if not tenants.valid(name):
+        return tenant_not_found(name)
+    with tenants.use(name) as tenant:
+        result = tenant.query_engine.query(query, strategy)
     
     return jsonify(result)
 
 
 @app.route('/clear', methods=['POST'])
-def clear_kb():
+@app.route('/kb/<name>/clear', methods=['POST'])
+def clear_kb(name=None):
     """Limpa a base de conhecimento."""
-    kb.clear()
+    if not tenants.valid(name):
+        return tenant_not_found(name)
+    with tenants.use(name) as tenant:
+        tenant.kb.clear()
     return jsonify({'success': True, 'message': 'Base de conhecimento limpa'})
 
 
 @app.route('/infer', methods=['POST'])
-def run_inference():
-    """Executa inferência manualmente."""
-    derived = inference_engine.forward_chaining()
-    kb.save()
+@app.route('/kb/<name>/infer', methods=['POST'])
+def run_inference(name=None):
+    """Executa inferência manualmente, dentro do orçamento do pedido."""
+    if not tenants.valid(name):
+        return tenant_not_found(name)
+    data = request.get_json(silent=True) or {}
+    try:
+        budget = InferenceBudget(
+            max_seconds=budget_limit(data, 'timeout', infer_timeout),
+            max_facts=budget_limit(data, 'max_facts', integer=True),
+            max_iterations=budget_limit(data, 'max_iterations', integer=True)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    derived = []
+    reason = 'fixpoint'
+    with tenants.use(name) as tenant, tenant.kb.lock.write():
+        for event in tenant.inference_engine.forward_chaining_iter(budget):
+            if event['type'] == 'fact':
+                derived.append(event['fact'])
+            elif event['type'] == 'done':
+                reason = event['reason']
+        tenant.kb.save()
+    
+    complete = reason == 'fixpoint'
+    message = f'{len(derived)} novos fatos derivados'
+    if not complete:
+        message += ' (resultado parcial)'
     
     return jsonify({
         'success': True,
         'derived_facts': derived,
-        'message': f'{len(derived)} novos fatos derivados'
+        'complete': complete,
+        'stop_reason': reason,
+        'message': message
     })
 
 
@@ -8,6 +8,8 @@ from test_extractor import *
 from test_unification import *
 from test_inference import *
 from test_query import *
+from test_storage import *
+from test_tenants import *
 
 
 def run_all_tests():
@@ -34,6 +36,9 @@ def run_all_tests():
         test_unify_simple()
         test_unify_predicates()
         test_apply_substitution()
+        test_substitution_does_not_touch_constants()
+        test_structured_terms()
+        test_trail_unification()
         print("✓ Testes de unificação: OK")
     except Exception as e:
         print(f"✗ Testes de unificação: FALHOU - {e}")
@@ -44,6 +49,24 @@ def run_all_tests():
         test_forward_chaining_simple()
         test_forward_chaining_chain()
         test_no_duplicate_derivation()
+        test_semi_naive_same_result()
+        test_semi_naive_reaches_fixpoint()
+        test_fact_index_candidates()
+        test_symbol_table_interning()
+        test_discrimination_tree_retrieval()
+        test_conjunctive_rule_requires_all_antecedents()
+        test_join_shared_variables()
+        test_rete_incremental_facts()
+        test_incremental_matches_full_inference()
+        test_incremental_from_saved_inferences()
+        test_dependency_graph_strata()
+        test_parallel_matches_serial()
+        test_provenance_deduplicated()
+        test_provenance_off()
+        test_forward_chaining_iter_budget()
+        test_incremental_after_budgeted_run()
+        test_columnar_matches_semi_naive()
+        test_nested_terms_in_rules()
         print("✓ Testes de inferência: OK")
     except Exception as e:
         print(f"✗ Testes de inferência: FALHOU - {e}")
@@ -55,11 +78,47 @@ def run_all_tests():
         test_query_inferred_fact()
         test_query_unknown()
         test_proof_tree_structure()
+        test_query_backward_without_inference()
+        test_query_backward_recursive_rules()
+        test_query_magic_sets()
+        test_query_variables_indexed()
+        test_discarded_engines_detached()
         print("✓ Testes de consultas: OK")
     except Exception as e:
         print(f"✗ Testes de consultas: FALHOU - {e}")
         return False
     
+    print("\n💾 Testes de Armazenamento...")
+    try:
+        test_write_ahead_log_replay()
+        test_write_ahead_log_compaction()
+        test_bulk_ingest()
+        test_snapshot_views()
+        test_binary_snapshot()
+        test_binary_compaction_remaps_snapshot()
+        test_binary_snapshot_index_without_parsing()
+        test_sqlite_storage()
+        test_read_write_lock()
+        test_atomic_json_save()
+        test_background_saver()
+        test_sharded_storage()
+        test_sharded_incremental_upload()
+        test_ndjson_storage()
+        print("✓ Testes de armazenamento: OK")
+    except Exception as e:
+        print(f"✗ Testes de armazenamento: FALHOU - {e}")
+        return False
+    
+    print("\n🗂️ Testes de Tenants...")
+    try:
+        test_tenants_are_isolated()
+        test_tenant_eviction()
+        test_eviction_releases_memory()
+        print("✓ Testes de tenants: OK")
+    except Exception as e:
+        print(f"✗ Testes de tenants: FALHOU - {e}")
+        return False
+    
     print("\n" + "=" * 60)
     print("✅ TODOS OS TESTES PASSARAM COM SUCESSO!")
     print("=" * 60)
@@ -6,7 +6,12 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.kb_manager import KnowledgeBase
-from app.inference import InferenceEngine
+from app.inference import InferenceEngine, InferenceBudget, CancellationToken
+from app.fact_index import FactIndex
+from app import columnar
+from app.symbols import SymbolTable, parse_fact, PARSE_CACHE_SIZE
+from app.discrimination_tree import DiscriminationTree
+from app.backward_chaining import TabledProver
 
 
 def test_forward_chaining_simple():
@@ -78,8 +83,522 @@ def test_no_duplicate_derivation():
     os.remove("test_kb_dup.json")
 
 
+def test_semi_naive_same_result():
+    """Testa que o modo semi-ingénuo deriva os mesmos fatos que o ingénuo."""
+    kb = KnowledgeBase("test_kb_semi.json")
+    kb.clear()
+    
+    kb.add_fact("cao(Rex)")
+    kb.add_fact("humano(João)")
+    kb.add_rule("animal(X) :- cao(X)")
+    kb.add_rule("ser_vivo(X) :- animal(X)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    
+    naive = InferenceEngine(kb).forward_chaining()
+    semi = InferenceEngine(kb, mode='semi_naive').forward_chaining()
+    
+    assert set(naive) == set(semi)
+    assert "ser_vivo(Rex)" in semi
+    
+    os.remove("test_kb_semi.json")
+
+
+def test_semi_naive_reaches_fixpoint():
+    """Testa que o modo semi-ingénuo não para no limite de iterações."""
+    kb = KnowledgeBase("test_kb_semi_chain.json")
+    kb.clear()
+    
+    # Regras em ordem inversa: cada iteração avança um passo na cadeia
+    kb.add_fact("p0(Rex)")
+    for i in reversed(range(150)):
+        kb.add_rule(f"p{i + 1}(X) :- p{i}(X)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive')
+    derived = engine.forward_chaining()
+    
+    assert len(derived) == 150
+    assert "p150(Rex)" in derived
+    
+    os.remove("test_kb_semi_chain.json")
+
+
+def test_fact_index_candidates():
+    """Testa que o índice só devolve fatos do predicado e constantes certos."""
+    index = FactIndex([
+        "humano(João)",
+        "humano(Maria)",
+        "cao(Rex)",
+        "pai(João, Maria)",
+        "pai(Pedro, Ana)",
+    ])
+    
+    assert index.candidates("humano(X)") == {"humano(João)", "humano(Maria)"}
+    assert index.candidates("pai(X, Maria)") == {"pai(João, Maria)"}
+    assert index.candidates("pai(X)") == set()
+    assert index.candidates("gato(X)") == set()
+    assert "cao(Rex)" in index
+    assert not index.add("cao(Rex)")
+
+
+def test_symbol_table_interning():
+    """Testa que fatos são codificados em inteiros e que o parse fica num cache limitado."""
+    table = SymbolTable()
+    
+    key = table.encode("pai(João, Maria)")
+    assert key == (table.intern("pai"), table.intern("João"), table.intern("Maria"))
+    assert table.encode("mae(Maria, João)")[2] == key[1]
+    assert table.decode(key) == "pai(João, Maria)"
+    assert parse_fact("pai(João, Maria)") == ("pai", ("João", "Maria"))
+    assert table.encode("texto sem predicado") is None
+    assert table.lookup("Pedro") is None
+    
+    # Índices diferentes partilham os mesmos argumentos já separados
+    first = FactIndex(["irmao(Rui, Ana)"])
+    second = FactIndex(["irmao(Rui, Ana)"])
+    assert first.arguments("irmao(Rui, Ana)")[0] is second.arguments("irmao(Rui, Ana)")[0]
+    
+    # Cada KB tem a sua tabela; o cache do parse não cresce com os fatos
+    kb = KnowledgeBase("test_kb_symbols.json")
+    kb.clear()
+    assert kb.symbols is not KnowledgeBase("test_kb_symbols.json").symbols
+    kb.add_facts(f"valor(n{i})" for i in range(PARSE_CACHE_SIZE + 10))
+    FactIndex(kb.get_facts())
+    assert parse_fact.cache_info().currsize <= PARSE_CACHE_SIZE
+    assert len(kb.symbols) == 0
+    
+    # Padrões de consultas não entram no cache
+    before = parse_fact.cache_info().currsize
+    FactIndex(["irmao(Rui, Ana)"]).retrieve("irmao(Rui, Y)")
+    assert parse_fact.cache_info().currsize == before
+    
+    os.remove("test_kb_symbols.json")
+
+
+def test_discrimination_tree_retrieval():
+    """Testa que a árvore devolve só os fatos que unificam, pela ordem de inserção."""
+    tree = DiscriminationTree([
+        "pai(João, Maria)",
+        "pai(Pedro, Ana)",
+        "pai(João, Rui)",
+        "igual(Ana, Ana)",
+        "igual(Ana, Rui)",
+        "humano(João)",
+    ])
+    
+    assert tree.retrieve("pai(João, X)") == ["pai(João, Maria)", "pai(João, Rui)"]
+    assert tree.retrieve("pai(X, Ana)") == ["pai(Pedro, Ana)"]
+    assert tree.retrieve("pai(X, Y)") == ["pai(João, Maria)", "pai(Pedro, Ana)", "pai(João, Rui)"]
+    assert tree.retrieve("igual(X, X)") == ["igual(Ana, Ana)"]
+    assert tree.retrieve("pai(X)") == []
+    assert tree.retrieve("humano(Pedro)") == []
+    assert not tree.add("humano(João)")
+    
+    # O FactIndex usa a árvore em padrões com várias constantes
+    index = FactIndex(["ligado(Lisboa, Porto, Comboio)", "ligado(Lisboa, Faro, Comboio)",
+                       "ligado(Lisboa, Porto, Autocarro)"])
+    assert list(index.candidates("ligado(Lisboa, X, Autocarro)")) == ["ligado(Lisboa, Porto, Autocarro)"]
+    index.add("ligado(Braga, Porto, Autocarro)")
+    assert index.retrieve("ligado(X, Porto, Autocarro)") == [
+        "ligado(Lisboa, Porto, Autocarro)", "ligado(Braga, Porto, Autocarro)"
+    ]
+
+
+def test_conjunctive_rule_requires_all_antecedents():
+    """Testa que regras com vários antecedentes exigem todos."""
+    kb = KnowledgeBase("test_kb_conj.json")
+    kb.clear()
+    
+    kb.add_fact("filósofo(Platão)")
+    kb.add_fact("escritor(Platão)")
+    kb.add_fact("filósofo(Sócrates)")
+    kb.add_rule("autor(X) :- filósofo(X), escritor(X)")
+    
+    for mode in InferenceEngine.available_modes():
+        derived = InferenceEngine(kb, mode=mode).forward_chaining()
+        assert derived == ["autor(Platão)"]
+    
+    # Sem o NumPy o modo colunar não é oferecido
+    numpy = columnar.np
+    columnar.np = None
+    try:
+        assert 'columnar' not in InferenceEngine.available_modes()
+    finally:
+        columnar.np = numpy
+    
+    os.remove("test_kb_conj.json")
+
+
+def test_join_shared_variables():
+    """Testa junção por variáveis partilhadas entre antecedentes."""
+    kb = KnowledgeBase("test_kb_join.json")
+    kb.clear()
+    
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_fact("pai(Pedro, Ana)")
+    kb.add_fact("pai(Rui, Luís)")
+    kb.add_rule("avô(X, Z) :- pai(X, Y), pai(Y, Z)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive')
+    derived = engine.forward_chaining()
+    
+    assert derived == ["avô(João, Ana)"]
+    justification = engine.get_justification("avô(João, Ana)")
+    assert justification['used_facts'] == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    assert justification['substitutions'] == {"X": "João", "Y": "Pedro", "Z": "Ana"}
+    
+    os.remove("test_kb_join.json")
+
+
+def test_rete_incremental_facts():
+    """Testa que a rede Rete propaga fatos adicionados depois da construção."""
+    kb = KnowledgeBase("test_kb_rete.json")
+    kb.clear()
+    
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_rule("avô(X, Z) :- pai(X, Y), pai(Y, Z)")
+    kb.add_rule("ancestral(X, Y) :- avô(X, Y)")
+    
+    engine = InferenceEngine(kb, mode='rete')
+    assert engine.forward_chaining() == []
+    
+    # O fato novo atravessa a rede sem reavaliar o resto da KB
+    kb.add_fact("pai(Pedro, Ana)")
+    derived = engine.forward_chaining()
+    
+    assert set(derived) == {"avô(João, Ana)", "ancestral(João, Ana)"}
+    assert set(derived) == set(InferenceEngine(kb, mode='semi_naive').forward_chaining())
+    
+    # Regras novas também são compiladas na rede existente
+    kb.add_rule("pai_de_alguem(X) :- pai(X, Y)")
+    assert "pai_de_alguem(Pedro)" in engine.forward_chaining()
+    
+    os.remove("test_kb_rete.json")
+
+
+def test_incremental_matches_full_inference():
+    """Testa que a inferência incremental chega ao mesmo fecho que a completa."""
+    kb = KnowledgeBase("test_kb_incr.json")
+    kb.clear()
+    
+    kb.import_knowledge(["humano(João)"], ["mortal(X) :- humano(X)"])
+    engine = InferenceEngine(kb, mode='semi_naive')
+    engine.forward_chaining()
+    
+    added = kb.import_knowledge(
+        ["humano(Maria)", "humano(João)"],
+        ["finito(X) :- mortal(X)"]
+    )
+    assert added == {'facts': ["humano(Maria)"], 'rules': ["finito(X) :- mortal(X)"]}
+    
+    derived = engine.infer_incremental(added['facts'], added['rules'])
+    assert set(derived) == {"mortal(Maria)", "finito(Maria)", "finito(João)"}
+    
+    full = InferenceEngine(kb, mode='semi_naive').forward_chaining()
+    assert engine.derived_facts == set(full)
+    assert engine.get_justification("finito(João)")['used_facts'] == ["mortal(João)"]
+    
+    os.remove("test_kb_incr.json")
+
+
+def test_incremental_from_saved_inferences():
+    """Testa que um motor novo reaproveita as inferências guardadas na KB."""
+    kb = KnowledgeBase("test_kb_incr2.json")
+    kb.clear()
+    
+    kb.import_knowledge(["cao(Rex)"], ["animal(X) :- cao(X)", "ser_vivo(X) :- animal(X)"])
+    InferenceEngine(kb).forward_chaining()
+    kb.save()
+    
+    kb2 = KnowledgeBase("test_kb_incr2.json")
+    added = kb2.import_knowledge(["cao(Bobi)"], [])
+    derived = InferenceEngine(kb2).infer_incremental(added['facts'], added['rules'])
+    
+    assert set(derived) == {"animal(Bobi)", "ser_vivo(Bobi)"}
+    
+    os.remove("test_kb_incr2.json")
+
+
+def test_dependency_graph_strata():
+    """Testa a estratificação das regras por componentes fortemente conexas."""
+    kb = KnowledgeBase("test_kb_strata.json")
+    kb.clear()
+    
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_fact("pai(Pedro, Ana)")
+    kb.add_rule("respeitado(X) :- ancestral(X, Y)")
+    kb.add_rule("ancestral(X, Y) :- pai(X, Y)")
+    kb.add_rule("ancestral(X, Z) :- pai(X, Y), ancestral(Y, Z)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive')
+    strata = engine.dependency_graph().describe()
+    
+    assert strata == [
+        {
+            'predicates': ['ancestral/2'],
+            'recursive': True,
+            'rules': ["ancestral(X, Y) :- pai(X, Y)", "ancestral(X, Z) :- pai(X, Y), ancestral(Y, Z)"]
+        },
+        {
+            'predicates': ['respeitado/1'],
+            'recursive': False,
+            'rules': ["respeitado(X) :- ancestral(X, Y)"]
+        },
+    ]
+    
+    derived = set(engine.forward_chaining())
+    assert derived == set(InferenceEngine(kb).forward_chaining())
+    assert "ancestral(João, Ana)" in derived
+    assert "respeitado(Pedro)" in derived
+    
+    os.remove("test_kb_strata.json")
+
+
+def test_parallel_matches_serial():
+    """Testa que o modo paralelo produz as mesmas justificações que o sequencial."""
+    kb = KnowledgeBase("test_kb_parallel.json")
+    kb.clear()
+    
+    nomes = ["Ana", "Bruno", "Carla", "Duarte", "Eva", "Filipe", "Gil"]
+    for pai, filho in zip(nomes, nomes[1:]):
+        kb.add_fact(f"pai({pai}, {filho})")
+        kb.add_fact(f"humano({filho})")
+    kb.add_rule("ancestral(X, Y) :- pai(X, Y)")
+    kb.add_rule("ancestral(X, Z) :- pai(X, Y), ancestral(Y, Z)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.add_rule("antepassado_mortal(X) :- ancestral(X, Y), mortal(Y)")
+    
+    serial = InferenceEngine(kb, mode='semi_naive')
+    serial.forward_chaining()
+    
+    parallel = InferenceEngine(kb, mode='parallel', workers=2)
+    parallel.parallel_min_delta = 0
+    parallel.forward_chaining()
+    
+    def strip_ids(justifications):
+        return {
+            fact: {k: v for k, v in j.items() if k != 'id'}
+            for fact, j in justifications.items()
+        }
+    
+    assert parallel.derived_facts == serial.derived_facts
+    assert "antepassado_mortal(Ana)" in parallel.derived_facts
+    assert strip_ids(parallel.justifications) == strip_ids(serial.justifications)
+    
+    # A inferência incremental reutiliza o pool e os fatos já enviados
+    added = kb.import_knowledge(["pai(Gil, Hugo)", "humano(Hugo)"], [])
+    fresh = serial.infer_incremental(added['facts'], added['rules'])
+    assert parallel.infer_incremental(added['facts'], added['rules']) == fresh
+    assert "antepassado_mortal(Ana)" in parallel.derived_facts
+    assert "ancestral(Ana, Hugo)" in fresh
+    assert strip_ids(parallel.justifications) == strip_ids(serial.justifications)
+    parallel.close()
+    
+    os.remove("test_kb_parallel.json")
+
+
+def test_provenance_deduplicated():
+    """Testa que inferências repetidas não fazem crescer a KB."""
+    kb = KnowledgeBase("test_kb_prov.json")
+    kb.clear()
+    
+    kb.add_fact("humano(João)")
+    kb.add_fact("grego(João)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.add_rule("mortal(X) :- grego(X)")
+    
+    engine = InferenceEngine(kb)
+    engine.forward_chaining()
+    engine.forward_chaining()
+    InferenceEngine(kb).forward_chaining()
+    
+    # Uma derivação por fato, mesmo depois de várias execuções
+    assert len(kb.get_inferences()) == 1
+    assert engine.get_justification("mortal(João)")['used_facts'] == ["humano(João)"]
+    
+    # Com alternativas, guarda também a segunda derivação
+    kb.clear()
+    kb.add_fact("humano(João)")
+    kb.add_fact("grego(João)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.add_rule("mortal(X) :- grego(X)")
+    engine = InferenceEngine(kb, max_derivations=2)
+    engine.forward_chaining()
+    engine.forward_chaining()
+    
+    assert len(kb.get_inferences()) == 2
+    assert len(engine.provenance_store.alternatives("mortal(João)")) == 2
+    
+    # Os ids da proveniência são os da tabela de símbolos da KB
+    derivation = engine.provenance_store.get("mortal(João)")
+    assert engine.provenance_store.symbols is kb.symbols
+    assert kb.symbols.symbol(derivation.fact) == "mortal(João)"
+    
+    os.remove("test_kb_prov.json")
+
+
+def test_provenance_off():
+    """Testa o modo sem proveniência para cargas em massa."""
+    kb = KnowledgeBase("test_kb_prov_off.json")
+    kb.clear()
+    
+    kb.add_fact("humano(João)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive', provenance=False)
+    
+    assert engine.forward_chaining() == ["mortal(João)"]
+    assert kb.get_inferences() == []
+    assert engine.get_justification("mortal(João)") is None
+    
+    os.remove("test_kb_prov_off.json")
+
+
+def test_forward_chaining_iter_budget():
+    """Testa a inferência em gerador com orçamento e cancelamento."""
+    kb = KnowledgeBase("test_kb_iter.json")
+    kb.clear()
+    
+    kb.add_fact("p0(Rex)")
+    for i in range(10):
+        kb.add_rule(f"p{i + 1}(X) :- p{i}(X)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive')
+    events = list(engine.forward_chaining_iter(InferenceBudget(max_facts=3)))
+    facts = [e['fact'] for e in events if e['type'] == 'fact']
+    
+    assert facts == ["p1(Rex)", "p2(Rex)", "p3(Rex)"]
+    assert events[-1]['type'] == 'done'
+    assert events[-1]['reason'] == 'facts'
+    
+    events = list(engine.forward_chaining_iter(InferenceBudget(max_iterations=2)))
+    assert [e['iteration'] for e in events if e['type'] == 'progress'] == [1, 2]
+    assert events[-1]['reason'] == 'iterations'
+    
+    token = CancellationToken()
+    token.cancel()
+    events = list(engine.forward_chaining_iter(cancel=token))
+    assert events == [events[-1]] and events[-1]['reason'] == 'cancelled'
+    
+    events = list(engine.forward_chaining_iter())
+    assert events[-1]['reason'] == 'fixpoint'
+    assert events[-1]['derived'] == 10
+    
+    os.remove("test_kb_iter.json")
+
+
+def test_incremental_after_budgeted_run():
+    """Testa que a inferência incremental completa o fecho de uma execução parada pelo orçamento."""
+    kb = KnowledgeBase("test_kb_iter.json")
+    kb.clear()
+    
+    for i in range(5):
+        kb.add_fact(f"ligado(n{i}, n{i + 1})")
+    kb.add_rule("caminho(X, Y) :- ligado(X, Y)")
+    kb.add_rule("caminho(X, Z) :- ligado(X, Y), caminho(Y, Z)")
+    
+    engine = InferenceEngine(kb, mode='semi_naive')
+    events = list(engine.forward_chaining_iter(InferenceBudget(max_facts=3)))
+    assert events[-1]['reason'] == 'facts'
+    
+    # Como no /upload: importar e inferir só sobre o conhecimento novo
+    added = kb.import_knowledge(["ligado(n5, n6)"], [])
+    derived = engine.infer_incremental(added['facts'], added['rules'])
+    
+    # Fecho completo: um caminho por cada par de nós n0..n6
+    assert len(engine.derived_facts) == 21
+    assert "caminho(n0, n6)" in derived
+    assert len({inference['derived_fact'] for inference in kb.get_inferences()}) == 21
+    
+    # Depois do fecho completo, a próxima atualização volta a ser incremental
+    added = kb.import_knowledge(["ligado(n6, n7)"], [])
+    assert len(engine.infer_incremental(added['facts'], added['rules'])) == 7
+    
+    os.remove("test_kb_iter.json")
+
+
+def test_columnar_matches_semi_naive():
+    """Testa que o backend colunar deriva os mesmos fatos que o semi-ingénuo."""
+    if not columnar.available():
+        print("NumPy não instalado: teste do modo colunar ignorado")
+        return
+    
+    kb = KnowledgeBase("test_kb_columnar.json")
+    kb.clear()
+    
+    nomes = ["Ana", "Bruno", "Carla", "Duarte", "Eva"]
+    for pai, filho in zip(nomes, nomes[1:]):
+        kb.add_fact(f"pai({pai}, {filho})")
+        kb.add_fact(f"humano({filho})")
+    kb.add_fact("pai(Eva, Eva)")
+    kb.add_rule("ancestral(X, Y) :- pai(X, Y)")
+    kb.add_rule("ancestral(X, Z) :- pai(X, Y), ancestral(Y, Z)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.add_rule("antepassado_mortal(X) :- ancestral(X, Y), mortal(Y)")
+    kb.add_rule("circular(X) :- pai(X, X)")
+    kb.add_rule("de_ana(Y) :- ancestral(Ana, Y)")
+    
+    serial = InferenceEngine(kb, mode='semi_naive', provenance=False)
+    serial.forward_chaining()
+    
+    engine = InferenceEngine(kb, mode='columnar')
+    derived = engine.forward_chaining()
+    
+    assert set(derived) == serial.derived_facts
+    assert "circular(Eva)" in derived
+    assert "de_ana(Eva)" in derived
+    
+    # Cada fato derivado tem uma justificação com fatos conhecidos
+    known = set(kb.get_facts()) | set(derived)
+    justification = engine.get_justification("antepassado_mortal(Ana)")
+    assert justification['rule'] == "antepassado_mortal(X) :- ancestral(X, Y), mortal(Y)"
+    assert all(fact in known for fact in justification['used_facts'])
+    
+    os.remove("test_kb_columnar.json")
+
+
+def test_nested_terms_in_rules():
+    """Testa regras com termos compostos com variáveis (para frente e para trás)."""
+    kb = KnowledgeBase("test_kb_nested.json")
+    kb.clear()
+    
+    kb.add_fact("pai(João, filho(Ana))")
+    kb.add_fact("pai(Ana, filho(Rui))")
+    kb.add_fact("idade(Rui, anos(3))")
+    kb.add_rule("progenitor(X, Y) :- pai(X, filho(Y))")
+    kb.add_rule("registo(X, par(Y, N)) :- progenitor(Y, X), idade(X, anos(N))")
+    
+    expected = {"progenitor(João, Ana)", "progenitor(Ana, Rui)", "registo(Rui, par(Ana, 3))"}
+    for mode in ('naive', 'semi_naive', 'rete'):
+        engine = InferenceEngine(kb, mode=mode)
+        assert set(engine.forward_chaining()) == expected
+    
+    prover = TabledProver(kb)
+    assert prover.solve("registo(Rui, par(Y, N))") == ["registo(Rui, par(Ana, 3))"]
+    assert prover.solve("registo(Rui, par(João, N))") == []
+    
+    os.remove("test_kb_nested.json")
+
+
 if __name__ == "__main__":
     test_forward_chaining_simple()
     test_forward_chaining_chain()
     test_no_duplicate_derivation()
+    test_semi_naive_same_result()
+    test_semi_naive_reaches_fixpoint()
+    test_fact_index_candidates()
+    test_symbol_table_interning()
+    test_discrimination_tree_retrieval()
+    test_conjunctive_rule_requires_all_antecedents()
+    test_join_shared_variables()
+    test_rete_incremental_facts()
+    test_incremental_matches_full_inference()
+    test_incremental_from_saved_inferences()
+    test_dependency_graph_strata()
+    test_parallel_matches_serial()
+    test_provenance_deduplicated()
+    test_provenance_off()
+    test_forward_chaining_iter_budget()
+    test_incremental_after_budgeted_run()
+    test_columnar_matches_semi_naive()
+    test_nested_terms_in_rules()
     print("✓ Todos os testes de inferência passaram!")
@@ -3,6 +3,8 @@ Testes unitários para o motor de consultas.
 """
 import sys
 import os
+import gc
+import weakref
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.kb_manager import KnowledgeBase
@@ -248,6 +250,180 @@ def test_proof_tree_structure():
     os.remove("test_proof_tree.json")
 
 
+def test_query_backward_without_inference():
+    """Testa consulta por encadeamento para trás sem executar /infer."""
+    kb = KnowledgeBase("test_query_backward.json")
+    kb.clear()
+    
+    kb.add_fact("humano(Sócrates)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.add_rule("finito(X) :- mortal(X)")
+    
+    query_engine = QueryEngine(kb)
+    
+    # Sem inferência prévia, a consulta materializada falha
+    assert query_engine.query("finito(Sócrates)?")['result'] == 'false'
+    
+    result = query_engine.query("finito(Sócrates)?", strategy='backward')
+    assert result['result'] == 'true'
+    tree = result['proof_tree']
+    assert tree['type'] == 'inference'
+    assert tree['rule'] == "finito(X) :- mortal(X)"
+    assert tree['children'][0]['fact'] == "mortal(Sócrates)"
+    assert tree['children'][0]['children'][0]['type'] == 'base_fact'
+    
+    assert query_engine.query("finito(Platão)?", strategy='backward')['result'] == 'false'
+    
+    # Fatos novos invalidam as tabelas
+    kb.add_fact("humano(Platão)")
+    assert query_engine.query("finito(Platão)?", strategy='backward')['result'] == 'true'
+    
+    os.remove("test_query_backward.json")
+
+
+def test_query_backward_recursive_rules():
+    """Testa que regras recursivas terminam graças ao tabelamento."""
+    kb = KnowledgeBase("test_query_backward_rec.json")
+    kb.clear()
+    
+    kb.add_fact("ligado(Lisboa, Porto)")
+    kb.add_fact("ligado(Porto, Braga)")
+    kb.add_fact("ligado(Braga, Lisboa)")
+    kb.add_rule("caminho(X, Y) :- ligado(X, Y)")
+    kb.add_rule("caminho(X, Z) :- caminho(X, Y), ligado(Y, Z)")
+    
+    query_engine = QueryEngine(kb)
+    
+    result = query_engine.query("caminho(Lisboa, Braga)?", strategy='backward')
+    assert result['result'] == 'true'
+    
+    result = query_engine.query("caminho(Porto, X)?", strategy='backward')
+    assert result['result'] == 'true'
+    answers = set(query_engine.prover.solve("caminho(Porto, X)"))
+    assert answers == {"caminho(Porto, Braga)", "caminho(Porto, Lisboa)", "caminho(Porto, Porto)"}
+    
+    assert query_engine.query("caminho(Lisboa, Faro)?", strategy='backward')['result'] == 'false'
+    
+    os.remove("test_query_backward_rec.json")
+
+
+def test_query_magic_sets():
+    """Testa que a estratégia magic só materializa o que a consulta precisa."""
+    kb = KnowledgeBase("test_query_magic.json")
+    kb.clear()
+    
+    kb.add_fact("ligado(Lisboa, Porto)")
+    kb.add_fact("ligado(Porto, Braga)")
+    kb.add_fact("ligado(Faro, Beja)")
+    kb.add_fact("caminho(Braga, Viana)")
+    kb.add_rule("caminho(X, Y) :- ligado(X, Y)")
+    kb.add_rule("caminho(X, Z) :- ligado(X, Y), caminho(Y, Z)")
+    
+    query_engine = QueryEngine(kb)
+    
+    result = query_engine.query("caminho(Lisboa, Viana)?", strategy='magic')
+    assert result['result'] == 'true'
+    tree = result['proof_tree']
+    assert tree['fact'] == "caminho(Lisboa, Viana)"
+    assert tree['rule'] == "caminho(X, Z) :- ligado(X, Y), caminho(Y, Z)"
+    assert [child['fact'] for child in tree['children']] == ["ligado(Lisboa, Porto)", "caminho(Porto, Viana)"]
+    
+    assert tree['explanation'] == "Derivado pela regra: caminho(X, Z) :- ligado(X, Y), caminho(Y, Z)"
+    
+    def tree_facts(node):
+        return [node['fact']] + [f for child in node['children'] for f in tree_facts(child)]
+    
+    # A prova usa os nomes e as regras originais (sem fatos magic__) e
+    # desce até aos fatos base
+    assert tree_facts(tree) == ["caminho(Lisboa, Viana)", "ligado(Lisboa, Porto)",
+                                "caminho(Porto, Viana)", "ligado(Porto, Braga)",
+                                "caminho(Braga, Viana)"]
+    assert tree['children'][0]['type'] == 'base_fact'
+    
+    # Respostas de uma consulta com variáveis, cada uma com a sua prova
+    result = query_engine.query("caminho(Lisboa, X)?", strategy='magic')
+    assert result['matched_fact'] == "caminho(Lisboa, Porto)"
+    assert result['substitutions'] == {"X": "Porto"}
+    assert result['proof_tree']['rule'] == "caminho(X, Y) :- ligado(X, Y)"
+    for destino in ["Porto", "Braga", "Viana"]:
+        assert query_engine.query(f"caminho(Lisboa, {destino})?", strategy='magic')['result'] == 'true'
+    
+    assert query_engine.query("caminho(Faro, Viana)?", strategy='magic')['result'] == 'false'
+    assert query_engine.query("caminho(Lisboa, Beja)?", strategy='magic')['result'] == 'false'
+    assert query_engine.query("caminho(Faro, Beja)?", strategy='magic')['result'] == 'true'
+    
+    # Nada é guardado na KB
+    assert kb.get_inferences() == []
+    
+    os.remove("test_query_magic.json")
+
+
+def test_query_variables_indexed():
+    """Testa consultas com variáveis sobre fatos base e inferidos."""
+    kb = KnowledgeBase("test_query_index.json")
+    kb.clear()
+    
+    kb.add_fact("pai(João, Ana)")
+    kb.add_fact("pai(Pedro, Maria)")
+    kb.add_rule("progenitor(X, Y) :- pai(X, Y)")
+    
+    query_engine = QueryEngine(kb)
+    
+    result = query_engine.query("pai(X, Maria)?")
+    assert result['result'] == 'true'
+    assert result['matched_fact'] == "pai(Pedro, Maria)"
+    assert result['substitutions'] == {"X": "Pedro"}
+    
+    assert query_engine.query("progenitor(X, Ana)?")['result'] == 'false'
+    
+    # Inferências feitas depois da primeira consulta também são encontradas
+    InferenceEngine(kb).forward_chaining()
+    result = query_engine.query("progenitor(X, Ana)?")
+    assert result['result'] == 'true'
+    assert result['matched_fact'] == "progenitor(João, Ana)"
+    assert result['proof_tree']['type'] == 'inference'
+    
+    os.remove("test_query_index.json")
+
+
+def test_discarded_engines_detached():
+    """Testa que motores descartados deixam de ser notificados pela KB."""
+    kb = KnowledgeBase("test_query_listeners.json")
+    kb.clear()
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_fact("pai(Pedro, Ana)")
+    kb.add_rule("avô(X, Z) :- pai(X, Y), pai(Y, Z)")
+    
+    # A KB não mantém vivos os motores (nem os que criaram por dentro)
+    query_engine = QueryEngine(kb)
+    assert query_engine.query("avô(João, X)?", 'backward')['result'] == 'true'
+    assert query_engine.query("avô(João, X)?", 'magic')['result'] == 'true'
+    engine = weakref.ref(query_engine)
+    del query_engine
+    gc.collect()
+    assert engine() is None
+    
+    events = []
+    
+    def listener(event, item):
+        events.append(event)
+    
+    kb.add_listener(listener)
+    kb.add_fact("pai(Ana, Rita)")
+    kb.remove_listener(listener)
+    kb.add_fact("pai(Rita, Eva)")
+    assert events == ['add_fact']
+    
+    # close() desliga o motor mesmo que ainda haja referências a ele
+    rete = InferenceEngine(kb, mode='rete')
+    rete.forward_chaining()
+    rete.close()
+    kb.add_fact("pai(Eva, Luna)")
+    assert "avô(Rita, Luna)" not in rete.network.derived
+    
+    os.remove("test_query_listeners.json")
+
+
 if __name__ == "__main__":
     print("🧪 Testando consultas básicas...")
     test_query_base_fact()
@@ -265,4 +441,15 @@ if __name__ == "__main__":
     print("🧪 Testando estrutura de prova...")
     test_proof_tree_structure()
     
+    print("🧪 Testando encadeamento para trás...")
+    test_query_backward_without_inference()
+    test_query_backward_recursive_rules()
+    
+    print("🧪 Testando consultas com variáveis...")
+    test_query_variables_indexed()
+    
+    print("🧪 Testando magic sets...")
+    test_query_magic_sets()
+    test_discarded_engines_detached()
+    
     print("✓ Todos os testes de consultas passaram!")
@@ -0,0 +1,503 @@
+"""
+Testes unitários para o armazenamento da base de conhecimento.
+"""
+import sys
+import os
+import json
+import shutil
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.kb_manager import KnowledgeBase
+from app.storage import LogStorage, SqliteStorage, BinaryLogStorage, ShardedStorage, NdjsonStorage
+from app.binary_snapshot import MappedSnapshot, write_snapshot
+from app.symbols import parse_fact
+from app import symbols
+from app.locking import ReadWriteLock
+from app import storage
+from app.inference import InferenceEngine
+from app.query_engine import QueryEngine
+
+
+def test_write_ahead_log_replay():
+    """Testa que o registo de alterações é reaplicado ao carregar."""
+    kb = KnowledgeBase("test_kb_wal.json", storage='wal')
+    kb.clear()
+    
+    kb.add_fact("humano(Socrates)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    kb.save()
+    # O snapshot não é reescrito numa gravação pequena
+    assert not os.path.exists("test_kb_wal.json")
+    
+    kb.add_fact("humano(Platao)")
+    kb.add_inference({'derived_fact': "mortal(Socrates)", 'rule': "mortal(X) :- humano(X)"})
+    kb.save()
+    
+    kb2 = KnowledgeBase("test_kb_wal.json", storage='wal')
+    assert kb2.get_facts() == ["humano(Socrates)", "humano(Platao)"]
+    assert kb2.get_rules() == ["mortal(X) :- humano(X)"]
+    assert kb2.get_inferences()[0]['derived_fact'] == "mortal(Socrates)"
+    
+    # Uma linha incompleta no fim (gravação interrompida) é ignorada
+    with open("test_kb_wal.json.wal", 'a', encoding='utf-8') as f:
+        f.write('{"seq": 99, "event": "add_fa')
+    kb3 = KnowledgeBase("test_kb_wal.json", storage='wal')
+    assert kb3.get_facts() == kb2.get_facts()
+    
+    # A linha partida é cortada: os registos seguintes continuam legíveis
+    kb3.add_fact("humano(Aristoteles)")
+    kb3.add_fact("humano(Zenao)")
+    kb3.save()
+    assert KnowledgeBase("test_kb_wal.json", storage='wal').get_facts() == [
+        "humano(Socrates)", "humano(Platao)", "humano(Aristoteles)", "humano(Zenao)"]
+    
+    for path in ("test_kb_wal.json", "test_kb_wal.json.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_write_ahead_log_compaction():
+    """Testa que a compactação escreve um snapshot e esvazia o registo."""
+    kb = KnowledgeBase("test_kb_wal_compact.json", storage='wal')
+    kb.clear()
+    
+    for i in range(LogStorage.MIN_COMPACT_RECORDS + 10):
+        kb.add_fact(f"numero(N{i})")
+    kb.save()
+    
+    assert not os.path.exists("test_kb_wal_compact.json.wal")
+    with open("test_kb_wal_compact.json", encoding='utf-8') as f:
+        assert len(json.load(f)['facts']) == LogStorage.MIN_COMPACT_RECORDS + 10
+    
+    kb.add_fact("numero(Extra)")
+    kb.save()
+    kb2 = KnowledgeBase("test_kb_wal_compact.json", storage='wal')
+    assert kb2.get_facts() == kb.get_facts()
+    
+    # Depois de um clear o registo não repõe o que estava no snapshot
+    kb.clear()
+    assert KnowledgeBase("test_kb_wal_compact.json", storage='wal').get_facts() == []
+    
+    for path in ("test_kb_wal_compact.json", "test_kb_wal_compact.json.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_bulk_ingest():
+    """Testa a importação em lote: deduplicação e uma gravação por lote."""
+    kb = KnowledgeBase("test_kb_bulk.json")
+    kb.clear()
+    kb.add_fact("numero(N1)")
+    
+    saves = []
+    save = kb.storage.save
+    kb.storage.save = lambda target: saves.append(save(target))
+    
+    facts = (f"numero(N{i % 4})" for i in range(10))
+    added = kb.ingest(facts, ["par(X) :- numero(X)", "par(X) :- numero(X)"])
+    
+    assert added == {'facts': ["numero(N0)", "numero(N2)", "numero(N3)"],
+                     'rules': ["par(X) :- numero(X)"]}
+    assert kb.get_facts() == ["numero(N1)", "numero(N0)", "numero(N2)", "numero(N3)"]
+    assert len(saves) == 1
+    assert kb.add_facts(["numero(N2)", "numero(N9)"]) == ["numero(N9)"]
+    
+    os.remove("test_kb_bulk.json")
+
+
+def test_snapshot_views():
+    """Testa que os snapshots não copiam nem veem alterações posteriores."""
+    kb = KnowledgeBase("test_kb_snapshot.json")
+    kb.clear()
+    kb.add_fact("humano(Socrates)")
+    kb.add_rule("mortal(X) :- humano(X)")
+    
+    snapshot = kb.snapshot()
+    generation = kb.generation
+    kb.add_fact("humano(Platao)")
+    assert kb.generation > generation
+    
+    assert snapshot.facts == ["humano(Socrates)"]
+    assert "humano(Platao)" not in snapshot.facts
+    assert "humano(Platao)" in kb.get_facts()
+    assert snapshot.facts[-1] == "humano(Socrates)"
+    
+    # Um clear cria listas novas: o snapshot antigo continua igual
+    kb.clear()
+    assert list(snapshot.rules) == ["mortal(X) :- humano(X)"]
+    assert kb.get_facts() == []
+    
+    os.remove("test_kb_snapshot.json")
+
+
+def test_binary_snapshot():
+    """Testa o snapshot binário mapeado com mmap e o registo por cima dele."""
+    kb = KnowledgeBase("test_kb_binary.kbin")
+    assert isinstance(kb.storage, BinaryLogStorage)
+    kb.clear()
+    
+    kb.ingest(["pai(João, Pedro)", "pai(Pedro, Ana)", "humano(Ana)"],
+              ["avô(X, Z) :- pai(X, Y), pai(Y, Z)"])
+    kb.add_inference({'derived_fact': "avô(João, Ana)", 'from_rule': "avô(X, Z) :- pai(X, Y), pai(Y, Z)"})
+    kb.storage.compact(kb.to_dict())
+    assert not os.path.exists("test_kb_binary.kbin.wal")
+    
+    snapshot = MappedSnapshot("test_kb_binary.kbin")
+    assert list(snapshot.facts_for("pai", 2)) == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    assert snapshot.fact_arguments(1) == ("pai", ("Pedro", "Ana"))
+    
+    kb2 = KnowledgeBase("test_kb_binary.kbin")
+    assert kb2.get_facts() == ["pai(João, Pedro)", "pai(Pedro, Ana)", "humano(Ana)"]
+    assert "humano(Ana)" in kb2.get_facts() and "humano(João)" not in kb2.facts
+    assert kb2.get_inferences()[0]['derived_fact'] == "avô(João, Ana)"
+    
+    # Alterações depois do snapshot vão para o registo
+    assert not kb2.add_fact("humano(Ana)")
+    kb2.add_fact("humano(Pedro)")
+    kb2.save()
+    assert KnowledgeBase("test_kb_binary.kbin").get_facts()[-1] == "humano(Pedro)"
+    
+    for path in ("test_kb_binary.kbin", "test_kb_binary.kbin.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_binary_compaction_remaps_snapshot():
+    """Testa que a compactação passa a KB para o snapshot novo e fecha o antigo."""
+    kb = KnowledgeBase("test_kb_binary.kbin")
+    kb.clear()
+    kb.add_fact("humano(Ana)")
+    kb.storage.compact(kb.to_dict())
+    
+    kb = KnowledgeBase("test_kb_binary.kbin")
+    old = kb.storage._snapshot
+    view = kb.get_facts()
+    facts = [f"pessoa(p{i})" for i in range(LogStorage.MIN_COMPACT_RECORDS + 1)]
+    kb.add_facts(facts)
+    kb.save()
+    
+    # O registo foi compactado e os fatos acrescentados já vêm do ficheiro
+    assert not os.path.exists("test_kb_binary.kbin.wal")
+    assert old._mmap.closed
+    assert kb.facts._extra == [] and len(kb.facts) == len(facts) + 1
+    assert "pessoa(p7)" in kb.facts and kb.get_facts()[-1] == facts[-1]
+    # Vistas anteriores à compactação continuam a ler os mesmos itens
+    assert view == ["humano(Ana)"]
+    
+    kb.add_rule("mortal(X) :- humano(X)")
+    assert InferenceEngine(kb, mode='semi_naive').forward_chaining() == ["mortal(Ana)"]
+    
+    for path in ("test_kb_binary.kbin", "test_kb_binary.kbin.wal"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_binary_snapshot_index_without_parsing():
+    """Testa que o índice de fatos usa o índice do snapshot, sem parse dos fatos."""
+    # Nomes sem dígitos (com dígitos seriam variáveis)
+    names = [f"Ilha{a}{b}" for a in 'abcdefgh' for b in 'abcdefgh'][:51]
+    facts = [f"irmao({names[i]}, {names[i + 1]})" for i in range(50)] + ["cidade(Luanda)"]
+    write_snapshot("test_kb_mapped.kbin", {
+        'facts': facts,
+        'rules': ["primo(X, Z) :- irmao(X, Y), irmao(Y, Z)"],
+        'inferences': []
+    })
+    # Esquecer o parse feito ao escrever (como num processo novo)
+    parse_fact.cache_clear()
+    
+    parsed = []
+    parse_predicate = symbols.parse_predicate
+    symbols.parse_predicate = lambda text: parsed.append(text) or parse_predicate(text)
+    try:
+        kb = KnowledgeBase("test_kb_mapped.kbin")
+        result = QueryEngine(kb).query("irmao(Ilhaad, X)?", 'backward')
+        derived = InferenceEngine(kb, mode='semi_naive').forward_chaining()
+    finally:
+        symbols.parse_predicate = parse_predicate
+    
+    assert result['result'] == 'true'
+    assert "primo(Ilhaaa, Ilhaac)" in derived and len(derived) == 49
+    assert not set(parsed) & set(facts)
+    
+    os.remove("test_kb_mapped.kbin")
+
+
+def test_sqlite_storage():
+    """Testa a KB em SQLite (escolhida pela extensão do caminho)."""
+    kb = KnowledgeBase("test_kb_storage.sqlite")
+    assert isinstance(kb.storage, SqliteStorage)
+    kb.clear()
+    
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_fact("pai(Pedro, Ana)")
+    kb.add_fact("pai(João, Pedro)")
+    kb.add_rule("avô(X, Z) :- pai(X, Y), pai(Y, Z)")
+    InferenceEngine(kb, mode='semi_naive').forward_chaining()
+    kb.save()
+    
+    kb2 = KnowledgeBase("test_kb_storage.sqlite")
+    assert list(kb2.get_facts()) == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    assert "pai(Pedro, Ana)" in kb2.facts
+    assert list(kb2.facts.matching("pai", {1: "Ana"})) == ["pai(Pedro, Ana)"]
+    assert kb2.find_inference("avô(João, Ana)")['using_facts'] == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    
+    result = QueryEngine(kb2).query("avô(João, Ana)?")
+    assert result['result'] == 'true'
+    assert result['proof_tree']['type'] == 'inference'
+    
+    # As vistas podem ser percorridas várias vezes e não veem o que vem depois
+    facts = kb2.get_facts()
+    inferences = kb2.get_inferences()
+    kb2.add_fact("pai(Ana, Rita)")
+    assert len(facts) == 2 and list(facts) == list(facts) == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    assert "pai(Pedro, Ana)" in facts and "pai(Ana, Rita)" not in facts
+    assert len(inferences) == 1 and list(inferences) == list(inferences)
+    assert next(iter(inferences))['derived_fact'] == "avô(João, Ana)"
+    
+    # Leituras e escritas de várias threads na mesma ligação
+    errors = []
+    
+    def read():
+        try:
+            for _ in range(20):
+                view = kb2.get_facts()
+                assert len(list(view)) == len(view)
+        except Exception as e:
+            errors.append(e)
+    
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for i in range(600):
+        kb2.add_fact(f"numero(n{i})")
+    for thread in readers:
+        thread.join()
+    assert errors == []
+    assert len(kb2.get_facts()) == 603 and list(kb2.get_facts())[-1] == "numero(n599)"
+    
+    kb2.clear()
+    assert len(kb2.facts) == 0
+    assert list(KnowledgeBase("test_kb_storage.sqlite").get_inferences()) == []
+    
+    kb.storage.conn.close()
+    kb2.storage.conn.close()
+    os.remove("test_kb_storage.sqlite")
+
+
+def test_read_write_lock():
+    """Testa que as leituras são em paralelo e as escritas exclusivas."""
+    lock = ReadWriteLock()
+    events = []
+    
+    def read():
+        with lock.read():
+            events.append('read')
+    
+    def write():
+        with lock.write():
+            events.append('write')
+    
+    with lock.read():
+        # Outra thread pode ler ao mesmo tempo
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(1)
+        assert events == ['read']
+        
+        # Mas não escreve enquanto houver leitores
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        assert events == ['read']
+    writer.join(1)
+    assert events == ['read', 'write']
+    
+    # Reentrante para quem escreve; quem lê não pode passar a escrever
+    with lock.write(), lock.write(), lock.read():
+        pass
+    with lock.read():
+        try:
+            with lock.write():
+                pass
+            assert False
+        except RuntimeError:
+            pass
+
+
+def test_atomic_json_save():
+    """Testa que uma gravação interrompida não estraga o ficheiro anterior."""
+    kb = KnowledgeBase("test_kb_atomic.json")
+    kb.clear()
+    kb.add_fact("humano(Socrates)")
+    kb.save()
+    
+    dump = storage.json.dump
+    def crash(data, f, **kwargs):
+        f.write('{"facts": [')
+        raise OSError("disco cheio")
+    storage.json.dump = crash
+    try:
+        kb.add_fact("humano(Platao)")
+        kb.save()
+    finally:
+        storage.json.dump = dump
+    
+    assert KnowledgeBase("test_kb_atomic.json").get_facts() == ["humano(Socrates)"]
+    
+    for path in ("test_kb_atomic.json", "test_kb_atomic.json.tmp"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_background_saver():
+    """Testa que as gravações em segundo plano juntam alterações seguidas."""
+    kb = KnowledgeBase("test_kb_saver.json")
+    kb.clear()
+    
+    saves = []
+    save = kb.storage.save
+    kb.storage.save = lambda target: saves.append(save(target))
+    
+    kb.start_background_saver(delay=0.1)
+    for i in range(20):
+        kb.add_fact(f"numero(N{i})")
+        kb.save()
+    # save() não escreve no pedido
+    assert saves == []
+    
+    time.sleep(0.3)
+    assert len(saves) == 1
+    assert len(KnowledgeBase("test_kb_saver.json").get_facts()) == 20
+    
+    # close grava o que ainda estiver pendente
+    kb.add_fact("numero(Extra)")
+    kb.save()
+    kb.close()
+    assert len(saves) == 2
+    assert KnowledgeBase("test_kb_saver.json").get_facts()[-1] == "numero(Extra)"
+    
+    os.remove("test_kb_saver.json")
+
+
+def test_sharded_storage():
+    """Testa a KB dividida por predicado: só os baldes usados são lidos."""
+    kb = KnowledgeBase("test_kb_sharded.shards")
+    assert isinstance(kb.storage, ShardedStorage)
+    kb.clear()
+    
+    for i in range(20):
+        kb.add_facts([f"cor{i}(Azul)", f"cor{i}(Verde)"])
+    kb.ingest(["pai(João, Pedro)", "pai(Pedro, Ana)", "pai(João, Pedro)"],
+              ["avô(X, Z) :- pai(X, Y), pai(Y, Z)"])
+    
+    # Abrir a KB só lê o manifesto
+    kb2 = KnowledgeBase("test_kb_sharded.shards")
+    shards = kb2.facts._shards
+    assert len(kb2.facts) == 42 and shards.loaded_buckets() == 0
+    
+    # A inferência só lê os baldes de pai e avô
+    derived = InferenceEngine(kb2, mode='semi_naive').forward_chaining()
+    assert derived == ["avô(João, Ana)"]
+    assert shards.loaded_buckets() <= 2
+    kb2.save()
+    
+    kb3 = KnowledgeBase("test_kb_sharded.shards")
+    result = QueryEngine(kb3).query("avô(João, X)?")
+    assert result['matched_fact'] == "avô(João, Ana)"
+    assert result['proof_tree']['type'] == 'inference'
+    assert kb3.facts._shards.loaded_buckets() <= 2
+    assert QueryEngine(kb3).query("pai(Pedro, Ana)?", 'backward')['result'] == 'true'
+    assert "cor3(Verde)" in kb3.facts and "cor3(Roxo)" not in kb3.facts
+    assert sorted(kb3.get_facts()) == sorted(kb.get_facts())
+    
+    # Um clear não deixa reaparecer fatos dos ficheiros antigos
+    kb3.clear()
+    kb3.add_fact("cor3(Roxo)")
+    kb3.save()
+    assert list(KnowledgeBase("test_kb_sharded.shards").get_facts()) == ["cor3(Roxo)"]
+    
+    shutil.rmtree("test_kb_sharded.shards")
+
+
+def test_sharded_incremental_upload():
+    """Testa que um upload (importar + inferência incremental) só lê os baldes usados."""
+    kb = KnowledgeBase("test_kb_sharded_upload.shards")
+    kb.clear()
+    for i in range(20):
+        kb.add_facts([f"cor{i}(Azul)", f"cor{i}(Verde)"])
+    kb.ingest(["pai(João, Pedro)", "pai(Pedro, Ana)"], ["avô(X, Z) :- pai(X, Y), pai(Y, Z)"])
+    InferenceEngine(kb).forward_chaining()
+    kb.save()
+    
+    # Como a rota /upload: importar e derivar só as consequências novas
+    kb2 = KnowledgeBase("test_kb_sharded_upload.shards")
+    shards = kb2.facts._shards
+    engine = InferenceEngine(kb2)
+    with kb2.lock.write():
+        added = kb2.import_knowledge(["pai(Ana, Rita)"], [])
+        derived = engine.infer_incremental(added['facts'], added['rules'])
+        kb2.save()
+    assert derived == ["avô(Pedro, Rita)"]
+    assert shards.loaded_buckets() <= 2
+    
+    # Os ids continuam depois das inferências guardadas (que não foram lidas)
+    assert kb2.inferences.find("avô(Pedro, Rita)")['id'] == 2
+    assert engine.get_justification("avô(João, Ana)")['used_facts'] == ["pai(João, Pedro)", "pai(Pedro, Ana)"]
+    
+    # As vistas não leem os baldes até serem percorridas
+    facts = kb2.get_facts()
+    assert len(facts) == 43 and shards.loaded_buckets() <= 2
+    assert "cor3(Azul)" in facts and "cor3(Roxo)" not in facts
+    assert shards.loaded_buckets() <= 3
+    kb2.add_fact("cor3(Roxo)")
+    assert "cor3(Roxo)" not in facts and len(list(facts)) == 43
+    assert len(kb2.get_inferences()) == 2
+    
+    shutil.rmtree("test_kb_sharded_upload.shards")
+
+
+def test_ndjson_storage():
+    """Testa a KB em NDJSON, sem compressão e com gzip e lzma."""
+    kb = KnowledgeBase("test_kb_ndjson.json")
+    kb.clear()
+    kb.ingest(["pai(João, Pedro)", "pai(Pedro, Ana)"], ["avô(X, Z) :- pai(X, Y), pai(Y, Z)"])
+    InferenceEngine(kb, mode='semi_naive').forward_chaining()
+    
+    # Cabeçalho de cada formato (o JSON de um registo por linha ou a compressão)
+    headers = {"test_kb_ndjson.ndjson": b'{"kb"', "test_kb_ndjson.ndjson.gz": b'\x1f\x8b',
+               "test_kb_ndjson.ndjson.xz": b'\xfd7zXZ'}
+    for path, header in headers.items():
+        kb.export(path)
+        with open(path, 'rb') as f:
+            assert f.read(len(header)) == header
+        
+        kb2 = KnowledgeBase(path)
+        assert isinstance(kb2.storage, NdjsonStorage)
+        assert kb2.to_dict() == kb.to_dict()
+        
+        kb2.add_fact("pai(Ana, Rita)")
+        kb2.save()
+        assert KnowledgeBase(path).get_facts()[-1] == "pai(Ana, Rita)"
+        os.remove(path)
+    
+    os.remove("test_kb_ndjson.json")
+
+
+if __name__ == "__main__":
+    test_write_ahead_log_replay()
+    test_write_ahead_log_compaction()
+    test_bulk_ingest()
+    test_snapshot_views()
+    test_binary_snapshot()
+    test_binary_compaction_remaps_snapshot()
+    test_binary_snapshot_index_without_parsing()
+    test_sqlite_storage()
+    test_read_write_lock()
+    test_atomic_json_save()
+    test_background_saver()
+    test_sharded_storage()
+    test_sharded_incremental_upload()
+    test_ndjson_storage()
+    print("✓ Todos os testes de armazenamento passaram!")
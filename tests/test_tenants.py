@@ -0,0 +1,98 @@
+"""
+Testes unitários para as várias bases de conhecimento (tenants).
+"""
+import sys
+import os
+import gc
+import shutil
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.tenants import TenantRegistry, ITEM_BYTES
+
+
+def test_tenants_are_isolated():
+    """Testa que cada KB com nome tem os seus fatos e motores."""
+    registry = TenantRegistry("test_kb_tenants/default.json", root="test_kb_tenants")
+    
+    equipa_a = registry.get("equipa_a")
+    equipa_a.kb.add_fact("humano(Socrates)")
+    equipa_a.kb.add_rule("mortal(X) :- humano(X)")
+    equipa_a.inference_engine.forward_chaining()
+    
+    equipa_b = registry.get("equipa_b")
+    assert equipa_b.kb.get_facts() == []
+    assert equipa_a.query_engine.query("mortal(Socrates)?")['result'] == 'true'
+    assert equipa_b.query_engine.query("mortal(Socrates)?")['result'] == 'false'
+    assert registry.get("equipa_a") is equipa_a
+    assert registry.get() is not equipa_a
+    
+    for name in ("../fora", "a/b", ""):
+        assert not registry.valid(name)
+    
+    shutil.rmtree("test_kb_tenants")
+
+
+def test_tenant_eviction():
+    """Testa que as KBs menos usadas são gravadas e descarregadas."""
+    registry = TenantRegistry("test_kb_tenants/default.json", root="test_kb_tenants",
+                              memory_budget=3 * ITEM_BYTES)
+    
+    for name in ("a1", "a2", "a3"):
+        registry.get(name).kb.add_fact(f"equipa(E{name[-1]})")
+    # Cada KB tem um fato: cabem as três
+    assert registry.loaded() == ["a1", "a2", "a3"]
+    
+    with registry.use("a1"):
+        registry.get("a2")
+        registry.get("a3")
+        registry.get("a4").kb.add_fact("equipa(E4)")
+        # O orçamento é verificado a cada acesso; a1 é a mais antiga mas está em uso
+        registry.get("a4")
+        assert registry.loaded() == ["a1", "a3", "a4"]
+    
+    # A KB descarregada foi gravada e volta do disco
+    assert registry.get("a2").kb.get_facts() == ["equipa(E2)"]
+    assert registry.loaded() == ["a3", "a4", "a2"]
+    
+    shutil.rmtree("test_kb_tenants")
+
+
+def test_eviction_releases_memory():
+    """Testa que descarregar uma KB liberta a memória dela e dos motores."""
+    registry = TenantRegistry("test_kb_tenants/default.json", root="test_kb_tenants",
+                              memory_budget=ITEM_BYTES)
+    
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tenant = registry.get("grande")
+        tenant.kb.add_facts(f"pessoa(p{i})" for i in range(3000))
+        tenant.kb.add_rule("mortal(X) :- pessoa(X)")
+        tenant.inference_engine.forward_chaining()
+        assert tenant.query_engine.query("mortal(p7)?")['result'] == 'true'
+        estimate = tenant.estimated_bytes()
+        del tenant
+        gc.collect()
+        loaded = tracemalloc.get_traced_memory()[0] - before
+        
+        # A KB seguinte excede o orçamento com a primeira, que é descarregada
+        registry.get("pequena")
+        gc.collect()
+        evicted = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    
+    assert registry.loaded() == ["pequena"]
+    # A estimativa acompanha a memória medida
+    assert loaded / 2 < estimate < loaded * 2
+    assert evicted < loaded / 10
+    
+    shutil.rmtree("test_kb_tenants")
+
+
+if __name__ == "__main__":
+    test_tenants_are_isolated()
+    test_tenant_eviction()
+    test_eviction_releases_memory()
+    print("✓ Todos os testes de tenants passaram!")
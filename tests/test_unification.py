@@ -10,8 +10,13 @@ from app.unification import (
     is_variable, 
     unify, 
     unify_predicates,
-    apply_substitution_to_predicate
+    apply_substitution,
+    apply_substitution_to_predicate,
+    unify_terms,
+    substitute,
+    Trail
 )
+from app.terms import Atom, Var, Compound, parse_term, parse_rule_term
 
 
 def test_parse_predicate():
@@ -60,10 +65,67 @@ def test_apply_substitution():
     assert result == "mortal(Socrates)"
 
 
+def test_substitution_does_not_touch_constants():
+    """Testa que só variáveis inteiras são substituídas (não substrings)."""
+    result = apply_substitution_to_predicate("amigo(X, Xavier)", {"X": "Ana"})
+    assert result == "amigo(Ana, Xavier)"
+    
+    assert apply_substitution("Xavier", {"X": "Ana"}) == "Xavier"
+    
+    # Constantes diferentes não unificam, mesmo começando por maiúscula
+    assert unify_predicates("pai(X, Maria)", "pai(João, Ana)") is None
+
+
+def test_structured_terms():
+    """Testa termos compostos imutáveis e o cache de parse."""
+    term = parse_term("f(g(X), a)")
+    assert term == Compound("f", (Compound("g", (Var("X"),)), Atom("a")))
+    assert parse_term("f(g(X), a)") is term
+    assert str(term) == "f(g(X), a)"
+    
+    try:
+        term.name = "h"
+        assert False, "Termos devem ser imutáveis"
+    except AttributeError:
+        pass
+    
+    bindings = unify_terms(term, parse_term("f(g(b), Y)"))
+    assert bindings == {"X": Atom("b"), "Y": Atom("a")}
+    assert str(substitute(term, bindings)) == "f(g(b), a)"
+    
+    rule = parse_rule_term("avo(X, Z) :- pai(X, Y), pai(Y, Z)")
+    assert rule.head == parse_term("avo(X, Z)")
+    assert [str(a) for a in rule.body] == ["pai(X, Y)", "pai(Y, Z)"]
+    assert parse_rule_term("avo(X, Z) :- pai(X, Y), pai(Y, Z)") is rule
+
+
+def test_trail_unification():
+    """Testa o trilho: termos aninhados, retrocesso e occurs check."""
+    trail = Trail()
+    mark = trail.mark()
+    assert trail.unify(parse_term("f(X, g(Y))"), parse_term("f(a, g(h(X)))"))
+    assert str(trail.resolve(parse_term("Y"))) == "h(a)"
+    
+    # Uma unificação falhada não deixa ligações
+    before = dict(trail.bindings)
+    assert not trail.unify(parse_term("X"), parse_term("b"))
+    assert trail.bindings == before
+    
+    trail.undo(mark)
+    assert trail.bindings == {} and trail.trail == []
+    
+    assert unify_terms(parse_term("X"), parse_term("f(X)"), occurs_check=True) is None
+    assert unify_terms(parse_term("X"), parse_term("f(X)")) is not None
+    assert unify_predicates("p(X)", "p(f(X))") is None
+
+
 if __name__ == "__main__":
     test_parse_predicate()
     test_is_variable()
     test_unify_simple()
     test_unify_predicates()
     test_apply_substitution()
+    test_substitution_does_not_touch_constants()
+    test_structured_terms()
+    test_trail_unification()
     print("✓ Todos os testes de unificação passaram!")